@@ -1,16 +1,78 @@
-from flask import Flask, request, jsonify
-from models import Session, Admin, Utente, Bicicletta, Stazione, Operazione
-from services import BikeRentalService, UserService
+from flask import Blueprint, Flask, Response, request, jsonify, stream_with_context
+from models import (
+    Session,
+    Admin,
+    Utente,
+    Bicicletta,
+    Stazione,
+    Operazione,
+    close_request_session,
+    configure_engine,
+    get_engine,
+    init_db,
+    pool_stats,
+    session_scope,
+)
+from services import (
+    ArchiveService,
+    AuthService,
+    BikeRentalService,
+    DemandService,
+    FleetService,
+    LeaderboardService,
+    RebalancingService,
+    StationService,
+    TelemetryService,
+    TripService,
+    UserService,
+    biciclette_index,
+    classifica_distanze,
+    disponibilita,
+    gps_allocator,
+    stazioni_index,
+    stazioni_response,
+    tag_allocator,
+)
+from archive import archivio
+from availability import stream_events
+from geo import parse_nearby_args, valid_coordinates
+from projection import BICICLETTA, STAZIONE, UTENTE
+from rebalancing import parse_plan_args
+from telemetry import TelemetryError, decode_fixes_body
+from writebuffer import write_buffer
+from pagination import (
+    PaginationError,
+    STREAM_BATCH_SIZE,
+    decode_cursor,
+    encode_cursor,
+    parse_limit,
+    stream_json_array,
+    stream_ndjson,
+)
+import cache
+import click
+import metrics
+import passwords
+import json
 import sqlalchemy as sa
 from sqlalchemy.orm import Mapped, mapped_column, sessionmaker, declarative_base
 from sqlalchemy.exc import IntegrityError
 
-app = Flask(__name__)
+bp = Blueprint("api", __name__)
+
+# Ordinamento stabile per la lista biciclette (chiave della paginazione keyset)
+_ORDINE_BICICLETTE = (Bicicletta.distanzaPercorsa.desc(), Bicicletta.ID.desc())
+
+
+def _json_response(payload):
+    """Risposta JSON codificata direttamente, per le liste lette con projection"""
+    return Response(json.dumps(payload), mimetype="application/json")
+
 
 # ==================== API AUTENTICAZIONE ====================
 
 
-@app.route("/api/auth/login", methods=["POST"])
+@bp.route("/api/auth/login", methods=["POST"])
 def login():
     """Endpoint per il login di admin e utenti"""
     try:
@@ -19,47 +81,28 @@ def login():
         email = data["email"]
         password = data["password"]
 
-        with Session() as session:
-            # Controlla prima se è un admin
-            admin = session.query(Admin).filter_by(email=email).first()
-            if admin and admin.check_password(password):
-                return (
-                    jsonify(
-                        {
-                            "status": "ok",
-                            "tipoUtente": "admin",
-                            "message": "Login avvenuto con successo",
-                            "data": admin.to_dict(),
-                        }
-                    ),
-                    200,
-                )
-
-            # Controlla se è un utente normale
-            utente = session.query(Utente).filter_by(email=email).first()
-            if utente and utente.check_password(password):
-                return (
-                    jsonify(
-                        {
-                            "status": "ok",
-                            "tipoUtente": "user",
-                            "message": "Login avvenuto con successo",
-                            "data": utente.to_dict(),
-                        }
-                    ),
-                    200,
-                )
+        result = AuthService.authenticate(email, password)
+        if result["status"] == "success":
+            return (
+                jsonify(
+                    {
+                        "status": "ok",
+                        "tipoUtente": result["tipoUtente"],
+                        "message": "Login avvenuto con successo",
+                        "data": result["data"],
+                    }
+                ),
+                200,
+            )
 
-        return (
-            jsonify({"status": "error", "message": "Credenziali non valide. Riprova."}),
-            401,
-        )
+        status_code = result.pop("code", 401)
+        return jsonify(result), status_code
 
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
-@app.route("/api/auth/register", methods=["POST"])
+@bp.route("/api/auth/register", methods=["POST"])
 def register():
     """Endpoint per la registrazione di nuovi utenti"""
     try:
@@ -78,7 +121,7 @@ def register():
             "regione",
         ]
 
-        with Session() as session:
+        with session_scope() as session:
             # Controlla se l'utente esiste già
             existing_user = session.query(Utente).filter_by(email=data["email"]).first()
             if existing_user:
@@ -103,6 +146,7 @@ def register():
 
             session.add(nuovo_utente)
             session.commit()
+            AuthService.invalidate(nuovo_utente.email)
 
             return (
                 jsonify(
@@ -121,35 +165,137 @@ def register():
 
 # ==================== API BICICLETTE ====================
 
-@app.route("/api/biciclette", methods=["GET"])
+@bp.route("/api/biciclette", methods=["GET"])
 def get_biciclette():
-    """Ottieni tutte le biciclette"""
+    """Ottieni le biciclette ordinate per distanza percorsa.
+
+    Senza parametri restituisce l'intera flotta. Con ``limit`` (ed
+    eventualmente ``cursor``) restituisce una pagina keyset su
+    (distanzaPercorsa, ID); con ``stream=json`` o ``stream=ndjson`` la
+    risposta viene prodotta a blocchi leggendo da un cursore lato server.
+    """
     try:
-        with Session() as session:
-            biciclette = (
-                session.query(Bicicletta)
-                .order_by(Bicicletta.distanzaPercorsa.desc())
-                .all()
+        stream = request.args.get("stream")
+        if stream is not None:
+            if stream not in ("json", "ndjson"):
+                return (
+                    jsonify({"status": "error", "message": "Parametro stream non valido"}),
+                    400,
+                )
+            return _stream_biciclette(stream)
+
+        limit = request.args.get("limit")
+        cursor = request.args.get("cursor")
+        if limit is None and cursor is None:
+            with session_scope() as session:
+                biciclette = BICICLETTA.all(
+                    session, BICICLETTA.select().order_by(*_ORDINE_BICICLETTE)
+                )
+                return _json_response({"status": "success", "data": biciclette}), 200
+
+        limit = parse_limit(limit)
+        query = BICICLETTA.select().order_by(*_ORDINE_BICICLETTE)
+        if cursor:
+            distanza, bici_id = decode_cursor(cursor, 2)
+            query = query.where(
+                sa.or_(
+                    Bicicletta.distanzaPercorsa < distanza,
+                    sa.and_(
+                        Bicicletta.distanzaPercorsa == distanza,
+                        Bicicletta.ID < bici_id,
+                    ),
+                )
             )
-            return (
-                jsonify(
-                    {
-                        "status": "success",
-                        "data": [bici.to_dict() for bici in biciclette],
-                    }
-                ),
-                200,
+
+        with session_scope() as session:
+            biciclette = BICICLETTA.all(session, query.limit(limit + 1))
+
+        next_cursor = None
+        if len(biciclette) > limit:
+            biciclette = biciclette[:limit]
+            ultima = biciclette[-1]
+            next_cursor = encode_cursor([ultima["distanzaPercorsa"], ultima["ID"]])
+
+        payload = {"status": "success", "data": biciclette, "next_cursor": next_cursor}
+        return _json_response(payload), 200
+    except PaginationError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+def _stream_biciclette(formato):
+    """Risposta in streaming: le righe arrivano a blocchi dal cursore lato server"""
+
+    def righe():
+        # Sessione propria: lo stream continua dopo la fine della view
+        with Session() as session:
+            result = session.execute(
+                BICICLETTA.select()
+                .order_by(*_ORDINE_BICICLETTE)
+                .execution_options(yield_per=STREAM_BATCH_SIZE)
             )
+            yield from BICICLETTA.dicts(result)
+
+    if formato == "ndjson":
+        body, mimetype = stream_ndjson(righe()), "application/x-ndjson"
+    else:
+        body, mimetype = stream_json_array(righe()), "application/json"
+
+    return Response(stream_with_context(body), mimetype=mimetype), 200
+
+
+@bp.route("/api/biciclette/nearby", methods=["GET"])
+def get_biciclette_nearby():
+    """Ottieni le biciclette disponibili più vicine (lat, lon, k, radius in km)"""
+    try:
+        try:
+            lat, lon, k, radius = parse_nearby_args(request.args)
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+
+        result = BikeRentalService.get_nearby_bikes(lat, lon, k=k, radius=radius)
+
+        if result["status"] == "success":
+            return jsonify(result), 200
+        else:
+            return jsonify(result), 500
+
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
-@app.route("/api/biciclette", methods=["POST"])
+@bp.route("/api/biciclette/classifica", methods=["GET"])
+def get_classifica_biciclette():
+    """Classifica delle biciclette per distanza percorsa (n, ordine=top|bottom)"""
+    try:
+        ordine = request.args.get("ordine", "top")
+        if ordine not in ("top", "bottom"):
+            return jsonify({"status": "error", "message": "Parametro ordine non valido"}), 400
+        try:
+            n = parse_limit(request.args.get("n"), default=10)
+        except PaginationError:
+            return jsonify({"status": "error", "message": "Parametro n non valido"}), 400
+
+        result = LeaderboardService.get_classifica(n, ordine)
+
+        if result["status"] == "success":
+            return jsonify(result), 200
+        else:
+            return jsonify(result), 500
+
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+@bp.route("/api/biciclette", methods=["POST"])
 def create_bicicletta():
     """Crea una nuova bicicletta"""
     try:
-        with Session() as session:
-            nuova_bici = Bicicletta()
+        with session_scope() as session:
+            (codice,) = tag_allocator.allocate(1)
+            (gps,) = gps_allocator.allocate(1)
+            nuova_bici = Bicicletta(codiceTag=codice, gps=gps)
             session.add(nuova_bici)
             session.commit()
 
@@ -167,17 +313,52 @@ def create_bicicletta():
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
-@app.route("/api/biciclette/<int:bici_id>", methods=["PUT"])
+@bp.route("/api/biciclette/bulk", methods=["POST"])
+def create_biciclette_bulk():
+    """Crea molte biciclette in una sola transazione ({"quantita": N})"""
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or "quantita" not in data:
+            return jsonify({"status": "error", "message": "Campo quantita richiesto"}), 400
+
+        result = FleetService.provision_bikes(data["quantita"])
+        if result["status"] == "ok":
+            return jsonify(result), 201
+        return jsonify(result), result.pop("code")
+
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+@bp.route("/api/biciclette/<int:bici_id>", methods=["PUT"])
 def update_bicicletta(bici_id):
     """Aggiorna una bicicletta in base al movimento"""
-    raise NotImplemented
+    try:
+        data = request.get_json(silent=True)
+        if not data:
+            return jsonify({"status": "error", "message": "Dati richiesti"}), 400
 
+        result = TelemetryService.ingest_fixes([data], bike_id=bici_id)
+        if result["status"] != "success":
+            return jsonify(result), 500
 
-@app.route("/api/biciclette/<int:bici_id>", methods=["DELETE"])
+        result = BikeRentalService.get_bike_status(bici_id)
+        if result["status"] == "success":
+            return jsonify(result), 200
+        else:
+            return jsonify(result), 404
+
+    except TelemetryError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+@bp.route("/api/biciclette/<int:bici_id>", methods=["DELETE"])
 def delete_bicicletta(bici_id):
     """Elimina una bicicletta"""
     try:
-        with Session() as session:
+        with session_scope() as session:
             bici = session.query(Bicicletta).filter_by(ID=bici_id).first()
             if not bici:
                 return (
@@ -187,6 +368,8 @@ def delete_bicicletta(bici_id):
 
             session.delete(bici)
             session.commit()
+            biciclette_index.remove(bici_id)
+            classifica_distanze.remove(bici_id)
 
             return (
                 jsonify(
@@ -204,18 +387,113 @@ def delete_bicicletta(bici_id):
 # ==================== API STAZIONI ====================
 
 
-@app.route("/api/stazioni", methods=["GET"])
+@bp.route("/api/stazioni", methods=["GET"])
 def get_stazioni():
-    """Ottieni tutte le stazioni"""
+    """Ottieni tutte le stazioni.
+
+    Il corpo è codificato una volta e servito dalla cache finché una
+    modifica alle stazioni non lo invalida; con If-None-Match o
+    If-Modified-Since aggiornati la risposta è un 304 senza query.
+    """
     try:
-        with Session() as session:
-            stazioni = session.query(Stazione).all()
-            return jsonify([stazione.to_dict() for stazione in stazioni]), 200
+        def build():
+            with session_scope() as session:
+                return STAZIONE.json(session, STAZIONE.select())
+
+        cached = stazioni_response.get(build)
+
+        response = Response(cached.body, mimetype="application/json")
+        response.set_etag(cached.etag)
+        response.last_modified = cached.last_modified
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+@bp.route("/api/stazioni/nearby", methods=["GET"])
+def get_stazioni_nearby():
+    """Ottieni le stazioni più vicine a una posizione (lat, lon, k, radius in km)"""
+    try:
+        try:
+            lat, lon, k, radius = parse_nearby_args(request.args)
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+
+        result = StationService.get_nearby_stations(lat, lon, k=k, radius=radius)
+
+        if result["status"] == "success":
+            return jsonify(result), 200
+        else:
+            return jsonify(result), 500
+
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+@bp.route("/api/stazioni/stream", methods=["GET"])
+def get_stazioni_stream():
+    """Disponibilità delle stazioni in tempo reale (Server-Sent Events).
+
+    Il primo evento (``snapshot``) contiene tutte le stazioni, i successivi
+    (``delta``) solo quelle cambiate. Tutti i client leggono lo stesso log
+    di eventi in memoria: nessuna query per client. Ogni stream occupa un
+    thread del worker: oltre ``SSE_MAX_SUBSCRIBERS`` stream aperti nel
+    processo la risposta è 503 con Retry-After.
+    """
+    if not disponibilita.subscribe():
+        response = jsonify({"status": "error", "message": "Troppi stream aperti, riprovare più tardi"})
+        response.headers["Retry-After"] = "30"
+        return response, 503
+
+    last_event_id = request.headers.get("Last-Event-ID", type=int)
+    response = Response(
+        stream_events(disponibilita, last_event_id=last_event_id),
+        mimetype="text/event-stream",
+    )
+    # Chiamato dal server alla chiusura della connessione, anche se lo
+    # stream non è mai partito
+    response.call_on_close(disponibilita.unsubscribe)
+    response.cache_control.no_cache = True
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+@bp.route("/api/stazioni/domanda", methods=["GET"])
+def get_stazioni_domanda():
+    """Noleggi e riconsegne per stazione e ora (dal, al, idStazione)"""
+    try:
+        result = DemandService.get_demand(
+            dal=request.args.get("dal"),
+            al=request.args.get("al"),
+            station_id=request.args.get("idStazione", type=int),
+        )
+
+        if result["status"] == "success":
+            return _json_response(result), 200
+        status_code = result.pop("code", 500)
+        return jsonify(result), status_code
+
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+@bp.route("/api/stazioni/domanda/ricostruisci", methods=["POST"])
+def ricostruisci_domanda():
+    """Ricalcola i contatori orari dall'intero log delle operazioni"""
+    try:
+        result = DemandService.rebuild()
+
+        if result["status"] == "success":
+            return jsonify(result), 200
+        else:
+            return jsonify(result), 500
+
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
-@app.route("/api/stazioni", methods=["POST"])
+@bp.route("/api/stazioni", methods=["POST"])
 def create_stazione():
     """Crea una nuova stazione"""
     try:
@@ -236,7 +514,7 @@ def create_stazione():
                     400,
                 )
 
-        with Session() as session:
+        with session_scope() as session:
             nuova_stazione = Stazione(
                 numSlot=data["numSlot"],
                 numBiciclette=data["numBiciclette"],
@@ -250,6 +528,13 @@ def create_stazione():
 
             session.add(nuova_stazione)
             session.commit()
+            stazioni_index.insert(
+                nuova_stazione.ID, nuova_stazione.latitudine, nuova_stazione.longitudine
+            )
+            stazioni_response.invalidate()
+            disponibilita.update(
+                nuova_stazione.ID, nuova_stazione.numBiciclette, nuova_stazione.numSlot
+            )
 
             return (
                 jsonify(
@@ -265,17 +550,17 @@ def create_stazione():
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
-@app.route("/api/stazioni/<int:stazione_id>", methods=["PUT"])
+@bp.route("/api/stazioni/<int:stazione_id>", methods=["PUT"])
 def update_stazione(stazione_id):
     """Aggiorna una stazione"""
     raise NotImplemented
 
 
-@app.route("/api/stazioni/<int:stazione_id>", methods=["DELETE"])
+@bp.route("/api/stazioni/<int:stazione_id>", methods=["DELETE"])
 def delete_stazione(stazione_id):
     """Elimina una stazione"""
     try:
-        with Session() as session:
+        with session_scope() as session:
             stazione = session.query(Stazione).filter_by(ID=stazione_id).first()
             if not stazione:
                 return (
@@ -285,6 +570,9 @@ def delete_stazione(stazione_id):
 
             session.delete(stazione)
             session.commit()
+            stazioni_index.remove(stazione_id)
+            stazioni_response.invalidate()
+            disponibilita.remove(stazione_id)
 
             return (
                 jsonify(
@@ -299,28 +587,77 @@ def delete_stazione(stazione_id):
 # ==================== API OPERAZIONI ====================
 
 
-@app.route("/api/operazioni", methods=["POST"])
+@bp.route("/api/operazioni", methods=["POST"])
 def create_operazione():
     """Crea una nuova operazione (noleggio o riconsegna)"""
-    raise NotImplemented
+    try:
+        data = request.get_json(silent=True)
+        if not data:
+            return jsonify({"status": "error", "message": "Dati richiesti"}), 400
+
+        required_fields = ["tipo", "idUtente", "idBicicletta", "idStazione"]
+        for field in required_fields:
+            if field not in data:
+                return (
+                    jsonify({"status": "error", "message": f"Campo {field} richiesto"}),
+                    400,
+                )
+
+        if data["tipo"] == "noleggio":
+            result = BikeRentalService.rent_bike(
+                data["idUtente"],
+                data["idBicicletta"],
+                data["idStazione"],
+                tariffa=data.get("tariffa"),
+            )
+        elif data["tipo"] == "riconsegna":
+            result = BikeRentalService.return_bike(
+                data["idUtente"],
+                data["idBicicletta"],
+                data["idStazione"],
+                distanzaPercorsa=data.get("distanzaPercorsa", 0),
+                tariffa=data.get("tariffa"),
+            )
+        else:
+            return (
+                jsonify({"status": "error", "message": "Tipo operazione non valido"}),
+                400,
+            )
+
+        status_code = result.pop("code", 400)
+        if result["status"] == "success":
+            return jsonify(result), 201
+        else:
+            return jsonify(result), status_code
 
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
 
-@app.route("/api/operazioni/utente/<int:user_id>", methods=["GET"])
+
+@bp.route("/api/operazioni/utente/<int:user_id>", methods=["GET"])
 def get_user_operations(user_id):
-    """Ottieni tutte le operazioni di un utente"""
+    """Ottieni le operazioni di un utente (limit, cursor, dal, al, dettagli opzionali)"""
     try:
-        result = BikeRentalService.get_user_operations(user_id)
+        result = BikeRentalService.get_user_operations(
+            user_id,
+            limit=request.args.get("limit"),
+            cursor=request.args.get("cursor"),
+            dal=request.args.get("dal"),
+            al=request.args.get("al"),
+            dettagli=request.args.get("dettagli", "").lower() in ("1", "true", "yes"),
+        )
 
+        status_code = result.pop("code", 400)
         if result["status"] == "success":
             return jsonify(result), 200
         else:
-            return jsonify(result), 400
+            return jsonify(result), status_code
 
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
-@app.route("/api/biciclette/<int:bike_id>/status", methods=["GET"])
+@bp.route("/api/biciclette/<int:bike_id>/status", methods=["GET"])
 def get_bike_status(bike_id):
     """Ottieni lo stato di una bicicletta"""
     try:
@@ -338,7 +675,7 @@ def get_bike_status(bike_id):
 # ==================== API UTENTI ====================
 
 
-@app.route("/api/utenti/<int:user_id>/profilo", methods=["GET"])
+@bp.route("/api/utenti/<int:user_id>/profilo", methods=["GET"])
 def get_user_profile(user_id):
     """Ottieni il profilo di un utente"""
     try:
@@ -353,7 +690,7 @@ def get_user_profile(user_id):
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
-@app.route("/api/utenti/<int:user_id>/profilo", methods=["PUT"])
+@bp.route("/api/utenti/<int:user_id>/profilo", methods=["PUT"])
 def update_user_profile(user_id):
     """Aggiorna il profilo di un utente"""
     try:
@@ -372,21 +709,158 @@ def update_user_profile(user_id):
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
-@app.route("/api/utenti", methods=["GET"])
+@bp.route("/api/utenti", methods=["GET"])
 def get_all_users():
     """Ottieni tutti gli utenti (solo per admin)"""
     try:
-        with Session() as session:
-            utenti = session.query(Utente).all()
-            return (
-                jsonify(
-                    {
-                        "status": "success",
-                        "data": [utente.to_dict() for utente in utenti],
-                    }
-                ),
-                200,
-            )
+        with session_scope() as session:
+            utenti = UTENTE.all(session, UTENTE.select())
+            return _json_response({"status": "success", "data": utenti}), 200
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+# ==================== API SIMULAZIONE / TELEMETRIA ====================
+
+
+def _read_fixes_body():
+    """Legge i fix GPS dal corpo: JSON {"fixes": [...]}, lista JSON o NDJSON"""
+    return decode_fixes_body(request.get_data(as_text=True), request.mimetype)
+
+
+@bp.route("/api/simulazione", methods=["POST"])
+def ingest_telemetria():
+    """Acquisisce un batch di fix GPS (idBicicletta, latitudine, longitudine, timestamp)"""
+    try:
+        result = TelemetryService.ingest_fixes(_read_fixes_body())
+
+        if result["status"] == "success":
+            return jsonify(result), 200
+        else:
+            return jsonify(result), 500
+
+    except TelemetryError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+@bp.route("/api/simulazione/<int:bike_id>", methods=["POST"])
+def simula_movimento(bike_id):
+    """Applica uno o più fix GPS a una singola bicicletta"""
+    try:
+        result = TelemetryService.ingest_fixes(_read_fixes_body(), bike_id=bike_id)
+
+        if result["status"] == "success":
+            if result["data"]["biciclette"] == 0 and result["data"]["ricevuti"] > 0:
+                return (
+                    jsonify({"status": "error", "message": "Bicicletta non trovata o fix non validi"}),
+                    404,
+                )
+            return jsonify(result), 200
+        else:
+            return jsonify(result), 500
+
+    except TelemetryError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+# ==================== API VIAGGI ====================
+
+
+@bp.route("/api/viaggi", methods=["GET"])
+def get_viaggi():
+    """Viaggi ricostruiti (limit, cursor, stato, idBicicletta, idUtente)"""
+    try:
+        result = TripService.get_trips(
+            limit=request.args.get("limit"),
+            cursor=request.args.get("cursor"),
+            stato=request.args.get("stato"),
+            bike_id=request.args.get("idBicicletta", type=int),
+            user_id=request.args.get("idUtente", type=int),
+        )
+
+        if result["status"] == "success":
+            return _json_response(result), 200
+        else:
+            return jsonify(result), 400
+
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+@bp.route("/api/viaggi/ricostruisci", methods=["POST"])
+def ricostruisci_viaggi():
+    """Elabora le operazioni nuove; con {"completo": true} ricostruisce tutto"""
+    try:
+        data = request.get_json(silent=True) or {}
+        result = TripService.rebuild(completo=bool(data.get("completo")))
+
+        if result["status"] == "success":
+            return jsonify(result), 200
+        else:
+            return jsonify(result), 500
+
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+# ==================== API AMMINISTRAZIONE ====================
+
+
+@bp.route("/api/admin/ribilanciamento", methods=["GET"])
+def get_piano_ribilanciamento():
+    """Giri di prelievo/consegna per i furgoni (furgoni, capacita, target, lat, lon)"""
+    try:
+        try:
+            furgoni, capacita, target, deposito = parse_plan_args(request.args)
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+
+        result = RebalancingService.plan(furgoni, capacita, target=target, deposito=deposito)
+
+        if result["status"] == "success":
+            return jsonify(result), 200
+        else:
+            return jsonify(result), 500
+
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+@bp.route("/api/admin/archivio", methods=["POST"])
+def archivia_operazioni():
+    """Sposta nell'archivio su disco le operazioni vecchie ({"eta_giorni": N} opzionale)"""
+    try:
+        data = request.get_json(silent=True) or {}
+        result = ArchiveService.archive(eta_giorni=data.get("eta_giorni"))
+
+        if result["status"] == "success":
+            return jsonify(result), 200
+        else:
+            status_code = result.pop("code", 500)
+            return jsonify(result), status_code
+
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+# ==================== API SISTEMA ====================
+
+
+@bp.route("/metrics", methods=["GET"])
+def get_metrics():
+    """Metriche di richieste, query SQL e pool in formato Prometheus"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+@bp.route("/api/sistema/pool", methods=["GET"])
+def get_pool_stats():
+    """Statistiche del pool di connessioni al database"""
+    try:
+        return jsonify({"status": "success", "data": pool_stats(get_engine())}), 200
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
@@ -394,7 +868,7 @@ def get_all_users():
 # ==================== ENDPOINT INFORMAZIONI ====================
 
 
-@app.route("/api/info", methods=["GET"])
+@bp.route("/api/info", methods=["GET"])
 def get_api_info():
     """Endpoint informativo con tutte le API disponibili"""
     api_endpoints = {
@@ -406,13 +880,21 @@ def get_api_info():
                 "POST /api/auth/register": "Registrazione nuovo utente",
             },
             "biciclette": {
-                "GET /api/biciclette": "Lista tutte le biciclette",
+                "GET /api/biciclette": "Lista biciclette (limit/cursor per paginare, stream=json|ndjson)",
+                "GET /api/biciclette/classifica": "Classifica per distanza (n, ordine=top|bottom)",
+                "GET /api/biciclette/nearby": "Biciclette disponibili più vicine (lat, lon, k, radius km)",
                 "POST /api/biciclette": "Crea nuova bicicletta",
+                "POST /api/biciclette/bulk": "Crea N biciclette in una transazione",
+                "PUT /api/biciclette/<id>": "Aggiorna posizione bicicletta",
                 "DELETE /api/biciclette/<id>": "Elimina bicicletta",
                 "GET /api/biciclette/<id>/status": "Stato bicicletta",
             },
             "stazioni": {
                 "GET /api/stazioni": "Lista tutte le stazioni",
+                "GET /api/stazioni/stream": "Disponibilità in tempo reale (SSE, solo delta)",
+                "GET /api/stazioni/nearby": "Stazioni più vicine (lat, lon, k, radius km)",
+                "GET /api/stazioni/domanda": "Noleggi e riconsegne per stazione e ora (dal, al, idStazione)",
+                "POST /api/stazioni/domanda/ricostruisci": "Ricalcola i contatori orari dallo storico",
                 "POST /api/stazioni": "Crea nuova stazione",
                 "PUT /api/stazioni/<id>": "Aggiorna stazione",
                 "DELETE /api/stazioni/<id>": "Elimina stazione",
@@ -420,7 +902,7 @@ def get_api_info():
             "operazioni": {
                 "POST /api/operazioni": "Crea operazione (noleggio/riconsegna)",
                 "GET /api/operazioni": "Lista tutte le operazioni",
-                "GET /api/operazioni/utente/<id>": "Operazioni di un utente",
+                "GET /api/operazioni/utente/<id>": "Operazioni di un utente (limit, cursor, dal, al, dettagli=1)",
             },
             "utenti": {
                 "GET /api/utenti": "Lista tutti gli utenti",
@@ -428,7 +910,20 @@ def get_api_info():
                 "PUT /api/utenti/<id>/profilo": "Aggiorna profilo utente",
             },
             "simulazione": {
-                "POST /api/simulazione/<bike_id>": "Simula movimento GPS manuale"
+                "POST /api/simulazione": "Batch di fix GPS (JSON o NDJSON)",
+                "POST /api/simulazione/<bike_id>": "Simula movimento GPS manuale",
+            },
+            "viaggi": {
+                "GET /api/viaggi": "Viaggi ricostruiti (limit, cursor, stato, idBicicletta, idUtente)",
+                "POST /api/viaggi/ricostruisci": "Elabora le nuove operazioni in viaggi",
+            },
+            "admin": {
+                "GET /api/admin/ribilanciamento": "Giri dei furgoni (furgoni, capacita, target, lat, lon deposito)",
+                "POST /api/admin/archivio": "Archivia su disco le operazioni vecchie (eta_giorni)",
+            },
+            "sistema": {
+                "GET /api/sistema/pool": "Statistiche pool connessioni",
+                "GET /metrics": "Metriche Prometheus (latenze, query SQL, pool)",
             },
             "info": {"GET /api/info": "Informazioni API"},
         },
@@ -436,5 +931,103 @@ def get_api_info():
     return jsonify(api_endpoints), 200
 
 
+# ==================== APPLICAZIONE ====================
+
+
+@click.command("init-db")
+def init_db_command():
+    """Crea le tabelle mancanti nel database configurato"""
+    init_db()
+    click.echo("Schema del database inizializzato")
+
+
+@click.command("build-trips")
+@click.option("--completo", is_flag=True, help="Cancella e ricostruisce tutti i viaggi")
+def build_trips_command(completo):
+    """Ricostruisce i viaggi dalle operazioni non ancora elaborate"""
+    result = TripService.rebuild(completo=completo)
+    if result["status"] != "success":
+        raise click.ClickException(result["message"])
+    click.echo(json.dumps(result["data"]))
+
+
+@click.command("build-rollups")
+def build_rollups_command():
+    """Ricalcola i contatori orari della domanda dall'intero log delle operazioni"""
+    result = DemandService.rebuild()
+    if result["status"] != "success":
+        raise click.ClickException(result["message"])
+    click.echo(json.dumps(result["data"]))
+
+
+@click.command("archive-operations")
+@click.option("--eta-giorni", type=int, default=None, help="Età minima delle operazioni da archiviare")
+def archive_operations_command(eta_giorni):
+    """Sposta nell'archivio su disco le operazioni più vecchie di ARCHIVE_AGE_DAYS"""
+    result = ArchiveService.archive(eta_giorni=eta_giorni)
+    if result["status"] != "success":
+        raise click.ClickException(result["message"])
+    click.echo(json.dumps(result["data"]))
+
+
+def create_app(config=None):
+    """Crea l'applicazione Flask.
+
+    Chiavi di configurazione opzionali: ``DATABASE_URL`` e
+    ``DATABASE_OPTIONS`` (argomenti per create_engine). Senza di esse
+    l'engine viene creato al primo utilizzo dalle variabili d'ambiente.
+    ``METRICS_SAMPLE_RATE`` (0-1, default 1) è la quota di richieste di
+    cui si misurano latenza e query SQL per /metrics. ``PASSWORD_COST``
+    e ``PASSWORD_WORKERS`` impostano le iterazioni di PBKDF2 e i processi
+    del pool di hash (vedi passwords.py). ``WRITE_BUFFER``,
+    ``WRITE_BUFFER_SIZE`` e ``WRITE_BUFFER_DELAY_MS`` attivano e regolano
+    il commit di gruppo di noleggi, riconsegne e telemetria (vedi
+    writebuffer.py). ``SSE_MAX_SUBSCRIBERS`` limita gli stream di
+    /api/stazioni/stream aperti nel processo. ``ARCHIVE_DIR``, ``ARCHIVE_AGE_DAYS`` e
+    ``ARCHIVE_SEGMENT_ROWS`` configurano l'archivio delle operazioni
+    vecchie (vedi archive.py).
+    Lo schema non viene creato qui: usare ``flask --app app init-db``.
+    """
+    app = Flask(__name__)
+    if config:
+        app.config.update(config)
+
+    if "DATABASE_URL" in app.config:
+        configure_engine(app.config["DATABASE_URL"], **app.config.get("DATABASE_OPTIONS", {}))
+        # Indici e cache in memoria appartengono al database precedente
+        cache.reset_all()
+
+    if "PASSWORD_COST" in app.config or "PASSWORD_WORKERS" in app.config:
+        passwords.configure(
+            cost=app.config.get("PASSWORD_COST"), workers=app.config.get("PASSWORD_WORKERS")
+        )
+
+    if any(key in app.config for key in ("WRITE_BUFFER", "WRITE_BUFFER_SIZE", "WRITE_BUFFER_DELAY_MS")):
+        write_buffer.configure(
+            enabled=app.config.get("WRITE_BUFFER"),
+            max_batch=app.config.get("WRITE_BUFFER_SIZE"),
+            max_delay_ms=app.config.get("WRITE_BUFFER_DELAY_MS"),
+        )
+
+    if "SSE_MAX_SUBSCRIBERS" in app.config:
+        disponibilita.max_subscribers = app.config["SSE_MAX_SUBSCRIBERS"]
+
+    if "ARCHIVE_DIR" in app.config:
+        archivio.configure(
+            app.config["ARCHIVE_DIR"],
+            eta_giorni=app.config.get("ARCHIVE_AGE_DAYS"),
+            segment_rows=app.config.get("ARCHIVE_SEGMENT_ROWS"),
+        )
+
+    app.register_blueprint(bp)
+    metrics.init_app(app)
+    app.teardown_appcontext(close_request_session)
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(build_trips_command)
+    app.cli.add_command(build_rollups_command)
+    app.cli.add_command(archive_operations_command)
+    return app
+
+
 if __name__ == "__main__":
-    app.run(debug=True, host="localhost", port=5000)
\ No newline at end of file
+    create_app().run(debug=True, host="localhost", port=5000)
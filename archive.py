@@ -0,0 +1,350 @@
+"""Archivio a colonne delle operazioni più vecchie.
+
+Le operazioni più vecchie di ``ARCHIVE_AGE_DAYS`` giorni escono dalla
+tabella ``operazioni`` e finiscono in segmenti su disco, in ``ARCHIVE_DIR``:
+una directory per segmento (``<primo ID>-<ultimo ID>``) con un file .npy
+per colonna, ordinato per (idUtente, ID). I file sono letti con
+``np.load(mmap_mode="r")``: una lettura dello storico di un utente è una
+ricerca binaria sulla colonna idUtente e tocca solo le pagine delle sue
+righe, senza caricare il segmento in memoria.
+
+I file sono la fonte di verità: un segmento diventa visibile con il rename
+atomico della sua directory e da quel momento le letture ignorano le righe
+della tabella con ID fino all'ultimo archiviato, che vengono poi
+cancellate. Un'archiviazione interrotta tra i due passi lascia righe
+ignorate, cancellate all'esecuzione successiva.
+
+Si archivia solo un prefisso di ID già elaborato dalla ricostruzione dei
+viaggi e precedente a ogni viaggio ancora in corso, così i viaggi non
+hanno più bisogno delle operazioni archiviate.
+"""
+import os
+import shutil
+import tempfile
+import threading
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import sqlalchemy as sa
+
+from models import Operazione, Sequenza, Viaggio
+from trips import FINESTRA_RITARDO, SEQUENZA_VIAGGI
+
+TIPI = ("noleggio", "riconsegna")
+
+DEFAULT_ETA_GIORNI = 365
+DEFAULT_SEGMENT_ROWS = 1000000
+
+# Contatore in sequenze con l'ultimo ID archiviato; la sua riga fa anche da
+# lock, così due archiviazioni non si sovrappongono
+SEQUENZA_ARCHIVIO = "archivio_operazioni"
+
+# Righe cancellate dalla tabella per ogni DELETE
+_DELETE_BATCH = 10000
+
+_EPOCH = date(1970, 1, 1)
+# Microsecondi in un'ora (la colonna ora è in microsecondi dalla mezzanotte)
+MICROSECONDI_ORA = 3600 * 10**6
+
+# Colonne di un segmento e loro tipo su disco (il più stretto sufficiente;
+# tariffa nulla è tariffaNulla=True)
+COLONNE = {
+    "ID": np.int64,
+    "tipo": np.int8,
+    "giorno": np.int32,  # giorni dal 1970-01-01
+    "ora": np.int64,  # microsecondi dalla mezzanotte
+    "distanzaPercorsa": np.int32,
+    "idUtente": np.int32,
+    "idBicicletta": np.int32,
+    "idStazione": np.int32,
+    "tariffa": np.int32,
+    "tariffaNulla": np.bool_,
+}
+
+
+def settings_from_env(environ=os.environ):
+    """Opzioni dell'archivio lette dalle variabili d'ambiente"""
+    return {
+        "directory": environ.get("ARCHIVE_DIR") or None,
+        "eta_giorni": int(environ.get("ARCHIVE_AGE_DAYS", DEFAULT_ETA_GIORNI)),
+        "segment_rows": int(environ.get("ARCHIVE_SEGMENT_ROWS", DEFAULT_SEGMENT_ROWS)),
+    }
+
+
+def _giorno(giorni):
+    return _EPOCH + timedelta(days=giorni)
+
+
+def _ora(microsecondi):
+    return (datetime.min + timedelta(microseconds=microsecondi)).time()
+
+
+class Segment:
+    """Segmento di operazioni archiviate, letto in memory mapping"""
+
+    def __init__(self, path):
+        self.path = path
+        primo, ultimo = os.path.basename(path).split("-")
+        self.primo = int(primo)
+        self.ultimo = int(ultimo)
+        self._colonne = {}
+
+    def __getitem__(self, nome):
+        colonna = self._colonne.get(nome)
+        if colonna is None:
+            colonna = np.load(os.path.join(self.path, f"{nome}.npy"), mmap_mode="r")
+            self._colonne[nome] = colonna
+        return colonna
+
+    def __len__(self):
+        return len(self["ID"])
+
+    def user_rows(self, user_id, before=None, dal=None, al=None):
+        """Indici (crescenti per ID) delle operazioni di un utente"""
+        utenti = self["idUtente"]
+        lo = int(np.searchsorted(utenti, user_id, "left"))
+        hi = int(np.searchsorted(utenti, user_id, "right"))
+        if before is not None:
+            hi = lo + int(np.searchsorted(self["ID"][lo:hi], before, "left"))
+        indici = np.arange(lo, hi)
+        if len(indici) and (dal is not None or al is not None):
+            giorni = self["giorno"][lo:hi]
+            tieni = np.ones(len(indici), dtype=bool)
+            if dal is not None:
+                tieni &= giorni >= (dal - _EPOCH).days
+            if al is not None:
+                tieni &= giorni <= (al - _EPOCH).days
+            indici = indici[tieni]
+        return indici
+
+    def dicts(self, indici):
+        """Le righe in ``indici`` come i dizionari di Operazione.to_dict()"""
+        colonne = {nome: self[nome][indici].tolist() for nome in COLONNE}
+        return [
+            {
+                "ID": colonne["ID"][i],
+                "tipo": TIPI[colonne["tipo"][i]],
+                "data": _giorno(colonne["giorno"][i]).isoformat(),
+                "ora": _ora(colonne["ora"][i]).isoformat(),
+                "distanzaPercorsa": colonne["distanzaPercorsa"][i],
+                "idUtente": colonne["idUtente"][i],
+                "idBicicletta": colonne["idBicicletta"][i],
+                "idStazione": colonne["idStazione"][i],
+                "tariffa": None if colonne["tariffaNulla"][i] else colonne["tariffa"][i],
+            }
+            for i in range(len(indici))
+        ]
+
+
+def _columns(rows):
+    """Colonne di un segmento dalle righe lette, ordinate per (idUtente, ID)"""
+    n = len(rows)
+    colonne = {
+        "ID": np.fromiter((r.ID for r in rows), dtype=np.int64, count=n),
+        "tipo": np.fromiter((TIPI.index(r.tipo) for r in rows), dtype=np.int8, count=n),
+        "giorno": np.fromiter(((r.data - _EPOCH).days for r in rows), dtype=np.int32, count=n),
+        "ora": np.fromiter(
+            (
+                ((r.ora.hour * 60 + r.ora.minute) * 60 + r.ora.second) * 10**6 + r.ora.microsecond
+                for r in rows
+            ),
+            dtype=np.int64,
+            count=n,
+        ),
+        "distanzaPercorsa": np.fromiter((r.distanzaPercorsa or 0 for r in rows), dtype=np.int32, count=n),
+        "idUtente": np.fromiter((r.idUtente for r in rows), dtype=np.int32, count=n),
+        "idBicicletta": np.fromiter((r.idBicicletta for r in rows), dtype=np.int32, count=n),
+        "idStazione": np.fromiter((r.idStazione for r in rows), dtype=np.int32, count=n),
+        "tariffa": np.fromiter((r.tariffa or 0 for r in rows), dtype=np.int32, count=n),
+        "tariffaNulla": np.fromiter((r.tariffa is None for r in rows), dtype=np.bool_, count=n),
+    }
+    ordine = np.lexsort((colonne["ID"], colonne["idUtente"]))
+    return {nome: colonna[ordine] for nome, colonna in colonne.items()}
+
+
+def _fsync(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class OperationArchive:
+    """Segmenti di ``directory``; senza directory l'archivio è vuoto"""
+
+    def __init__(self, directory=None, eta_giorni=DEFAULT_ETA_GIORNI, segment_rows=DEFAULT_SEGMENT_ROWS):
+        self._lock = threading.Lock()
+        self.directory = None
+        self._segmenti = {}
+        self.configure(directory, eta_giorni, segment_rows)
+
+    def configure(self, directory, eta_giorni=None, segment_rows=None):
+        """Cambia directory (None: archivio vuoto e spento) e parametri; i
+        parametri non indicati restano invariati"""
+        if eta_giorni is not None and eta_giorni < 0:
+            raise ValueError("ARCHIVE_AGE_DAYS non può essere negativo")
+        if segment_rows is not None and segment_rows < 1:
+            raise ValueError("ARCHIVE_SEGMENT_ROWS deve essere almeno 1")
+        with self._lock:
+            if directory != self.directory:
+                self.directory = directory
+                self._segmenti = {}
+            if eta_giorni is not None:
+                self.eta_giorni = eta_giorni
+            if segment_rows is not None:
+                self.segment_rows = segment_rows
+
+    def segments(self):
+        """Segmenti visibili, dal più vecchio. La directory è riletta a ogni
+        chiamata (un segmento appare con un rename); i file già aperti
+        restano mappati"""
+        directory = self.directory
+        if directory is None:
+            return []
+        try:
+            nomi = [nome for nome in os.listdir(directory) if not nome.startswith(".")]
+        except FileNotFoundError:
+            return []
+
+        aperti = self._segmenti
+        nuovi = [nome for nome in nomi if nome not in aperti]
+        if nuovi:
+            with self._lock:
+                aperti = dict(self._segmenti)
+                for nome in nuovi:
+                    aperti.setdefault(nome, Segment(os.path.join(directory, nome)))
+                self._segmenti = aperti
+        return sorted((aperti[nome] for nome in nomi), key=lambda s: s.primo)
+
+    def archived_until(self):
+        """Ultimo ID archiviato (0 se l'archivio è vuoto)"""
+        segmenti = self.segments()
+        return segmenti[-1].ultimo if segmenti else 0
+
+    def user_operations(self, user_id, before=None, dal=None, al=None, limit=None):
+        """Operazioni archiviate di un utente dalla più recente, come to_dict()"""
+        risultato = []
+        for segmento in reversed(self.segments()):
+            if limit is not None and len(risultato) >= limit:
+                break
+            if before is not None and segmento.primo >= before:
+                continue
+            indici = segmento.user_rows(user_id, before, dal, al)[::-1]
+            if limit is not None:
+                indici = indici[: limit - len(risultato)]
+            risultato.extend(segmento.dicts(indici))
+        return risultato
+
+    def write_segment(self, rows):
+        """Scrive le righe (ordinate per ID) in un nuovo segmento e lo rende visibile"""
+        os.makedirs(self.directory, exist_ok=True)
+        colonne = _columns(rows)
+        nome = f"{rows[0].ID:012d}-{rows[-1].ID:012d}"
+        provvisoria = tempfile.mkdtemp(prefix=".", dir=self.directory)
+        try:
+            for colonna, valori in colonne.items():
+                percorso = os.path.join(provvisoria, f"{colonna}.npy")
+                np.save(percorso, valori.astype(COLONNE[colonna], copy=False))
+                _fsync(percorso)
+            os.rename(provvisoria, os.path.join(self.directory, nome))
+        except BaseException:
+            shutil.rmtree(provvisoria, ignore_errors=True)
+            raise
+        _fsync(self.directory)
+        return nome
+
+
+def _lock_watermark(session):
+    """Blocca e legge la riga del contatore (creandola se manca)"""
+    valore = session.scalar(
+        sa.select(Sequenza.valore).where(Sequenza.nome == SEQUENZA_ARCHIVIO).with_for_update()
+    )
+    if valore is None:
+        session.add(Sequenza(nome=SEQUENZA_ARCHIVIO, valore=0))
+        session.flush()
+        valore = 0
+    return valore
+
+
+def _delete_range(session, primo, ultimo):
+    """Cancella dalla tabella le operazioni con primo <= ID <= ultimo"""
+    return session.execute(
+        sa.delete(Operazione)
+        .where(Operazione.ID.between(primo, ultimo))
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+
+def archivable_limit(session, prima_del):
+    """Primo ID da non archiviare: le operazioni precedenti sono tutte più
+    vecchie di ``prima_del``, già elaborate nei viaggi (oltre la finestra
+    di ritardo) e precedenti a ogni viaggio in corso"""
+    limiti = [
+        session.scalar(sa.select(sa.func.min(Operazione.ID)).where(Operazione.data >= prima_del)),
+        session.scalar(
+            sa.select(sa.func.min(Viaggio.idNoleggio)).where(Viaggio.stato == "in_corso")
+        ),
+    ]
+    viaggi = session.scalar(sa.select(Sequenza.valore).where(Sequenza.nome == SEQUENZA_VIAGGI)) or 0
+    limiti.append(viaggi - FINESTRA_RITARDO + 1)
+
+    ultimo = session.scalar(sa.select(sa.func.max(Operazione.ID))) or 0
+    return min(limite for limite in limiti + [ultimo + 1] if limite is not None)
+
+
+def archive_operations(session, archivio, eta_giorni=None, oggi=None):
+    """Sposta nei segmenti le operazioni più vecchie di ``eta_giorni``
+    (default ``archivio.eta_giorni``).
+
+    Scrive un segmento ogni ``archivio.segment_rows`` operazioni e cancella
+    dalla tabella le righe archiviate. Non esegue il commit: è compito del
+    chiamante, che tiene il lock sul contatore fino ad allora.
+    """
+    if archivio.directory is None:
+        raise ValueError("ARCHIVE_DIR non impostato")
+    if eta_giorni is None:
+        eta_giorni = archivio.eta_giorni
+
+    _lock_watermark(session)
+    archiviate = archivio.archived_until()
+    # Righe rimaste da un'archiviazione interrotta dopo il rename
+    cancellate = _delete_range(session, 0, archiviate) if archiviate else 0
+
+    prima_del = (oggi or date.today()) - timedelta(days=eta_giorni)
+    limite = archivable_limit(session, prima_del)
+
+    segmenti = []
+    operazioni = 0
+    while True:
+        rows = session.execute(
+            sa.select(
+                Operazione.ID, Operazione.tipo, Operazione.data, Operazione.ora,
+                Operazione.distanzaPercorsa, Operazione.idUtente, Operazione.idBicicletta,
+                Operazione.idStazione, Operazione.tariffa,
+            )
+            .where(Operazione.ID > archiviate, Operazione.ID < limite)
+            .order_by(Operazione.ID)
+            .limit(archivio.segment_rows)
+        ).all()
+        if not rows:
+            break
+        segmenti.append(archivio.write_segment(rows))
+        archiviate = rows[-1].ID
+        operazioni += len(rows)
+        for inizio in range(0, len(rows), _DELETE_BATCH):
+            blocco = rows[inizio:inizio + _DELETE_BATCH]
+            cancellate += _delete_range(session, blocco[0].ID, blocco[-1].ID)
+
+    session.execute(
+        sa.update(Sequenza).where(Sequenza.nome == SEQUENZA_ARCHIVIO).values(valore=archiviate)
+    )
+    return {
+        "operazioni": operazioni,
+        "cancellate": cancellate,
+        "segmenti": segmenti,
+        "archiviateFinoA": archiviate,
+    }
+
+
+archivio = OperationArchive(**settings_from_env())
@@ -0,0 +1,339 @@
+"""Modalità di servizio asincrona (ASGI).
+
+Le route più frequenti e legate all'I/O (telemetria, stato e ricerca delle
+biciclette, noleggi, storico e login) sono servite da handler asincroni che
+eseguono gli stessi servizi di services.py su un'AsyncSession: mentre una
+richiesta attende il database il loop serve le altre. Anche lo stream SSE
+della disponibilità delle stazioni è servito dal loop, così i client
+connessi non occupano i thread del pool di Flask. Tutte le altre route
+passano all'applicazione Flask, eseguita in un pool di thread.
+
+Avvio::
+
+    uvicorn --factory asgi:create_asgi_app --workers 4
+"""
+from contextlib import asynccontextmanager
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+from app import create_app
+from availability import stream_events_async
+from metrics import ASGIMetricsMiddleware
+from geo import parse_nearby_args
+from models import async_session, bind_session, get_async_engine
+from passwords import dummy_hash_async, hash_password_async, needs_rehash, verify_password_async
+from services import (
+    AuthService,
+    BikeRentalService,
+    StationService,
+    TelemetryService,
+    disponibilita,
+)
+from telemetry import TelemetryError, decode_fixes_body
+
+
+def _call_bound(session, service, args, kwargs):
+    with bind_session(session):
+        return service(*args, **kwargs)
+
+
+async def run_service(service, *args, **kwargs):
+    """Esegue un metodo di servizio sincrono su una nuova AsyncSession.
+
+    Il servizio gira dentro AsyncSession.run_sync: le sue query passano dal
+    driver asincrono senza bloccare il loop, e session_scope() restituisce
+    la sessione legata qui.
+    """
+    async with async_session() as session:
+        return await session.run_sync(_call_bound, service, args, kwargs)
+
+
+def _error(message, status_code):
+    return JSONResponse({"status": "error", "message": message}, status_code=status_code)
+
+
+async def _json_body(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+def _mimetype(request):
+    return request.headers.get("content-type", "").split(";")[0].strip().lower()
+
+
+# ==================== API AUTENTICAZIONE ====================
+
+
+async def login(request):
+    """Endpoint per il login di admin e utenti"""
+    try:
+        data = await _json_body(request)
+        email, password = data["email"], data["password"]
+
+        # Query nella sessione asincrona, hash nel pool di passwords: il
+        # loop non resta mai bloccato sul calcolo
+        candidati = await run_service(AuthService.credentials, email)
+        if not candidati:
+            # Stesso costo di una password sbagliata (vedi AuthService.authenticate)
+            await verify_password_async(await dummy_hash_async(), password)
+        for ruolo, user_id, password_hash in candidati:
+            if await verify_password_async(password_hash, password):
+                profilo = await run_service(AuthService.profile, ruolo, user_id, email)
+                if profilo is None:
+                    break
+                if needs_rehash(password_hash):
+                    nuovo = await hash_password_async(password)
+                    await run_service(
+                        AuthService.store_hash, ruolo, user_id, email, password_hash, nuovo
+                    )
+                return JSONResponse(
+                    {
+                        "status": "ok",
+                        "tipoUtente": ruolo,
+                        "message": "Login avvenuto con successo",
+                        "data": profilo,
+                    }
+                )
+
+        return _error("Credenziali non valide. Riprova.", 401)
+
+    except Exception as e:
+        return _error(str(e), 500)
+
+
+# ==================== API BICICLETTE ====================
+
+
+async def get_biciclette_nearby(request):
+    """Ottieni le biciclette disponibili più vicine (lat, lon, k, radius in km)"""
+    try:
+        try:
+            lat, lon, k, radius = parse_nearby_args(request.query_params)
+        except ValueError as e:
+            return _error(str(e), 400)
+
+        result = await run_service(BikeRentalService.get_nearby_bikes, lat, lon, k=k, radius=radius)
+        return JSONResponse(result, status_code=200 if result["status"] == "success" else 500)
+
+    except Exception as e:
+        return _error(str(e), 500)
+
+
+async def update_bicicletta(request):
+    """Aggiorna una bicicletta in base al movimento"""
+    bici_id = request.path_params["bici_id"]
+    try:
+        data = await _json_body(request)
+        if not data:
+            return _error("Dati richiesti", 400)
+
+        result = await run_service(TelemetryService.ingest_fixes, [data], bike_id=bici_id)
+        if result["status"] != "success":
+            return JSONResponse(result, status_code=500)
+
+        result = await run_service(BikeRentalService.get_bike_status, bici_id)
+        return JSONResponse(result, status_code=200 if result["status"] == "success" else 404)
+
+    except TelemetryError as e:
+        return _error(str(e), 400)
+    except Exception as e:
+        return _error(str(e), 500)
+
+
+async def get_bike_status(request):
+    """Ottieni lo stato di una bicicletta"""
+    try:
+        result = await run_service(BikeRentalService.get_bike_status, request.path_params["bike_id"])
+        return JSONResponse(result, status_code=200 if result["status"] == "success" else 400)
+    except Exception as e:
+        return _error(str(e), 500)
+
+
+# ==================== API STAZIONI ====================
+
+
+async def get_stazioni_nearby(request):
+    """Ottieni le stazioni più vicine a una posizione (lat, lon, k, radius in km)"""
+    try:
+        try:
+            lat, lon, k, radius = parse_nearby_args(request.query_params)
+        except ValueError as e:
+            return _error(str(e), 400)
+
+        result = await run_service(StationService.get_nearby_stations, lat, lon, k=k, radius=radius)
+        return JSONResponse(result, status_code=200 if result["status"] == "success" else 500)
+
+    except Exception as e:
+        return _error(str(e), 500)
+
+
+async def get_stazioni_stream(request):
+    """Disponibilità delle stazioni in tempo reale (Server-Sent Events).
+
+    Stesso stream della route Flask, ma ogni client attende gli eventi sul
+    loop invece che in un thread: gli stream aperti non sottraggono thread
+    alle route servite da Flask e non hanno il limite SSE_MAX_SUBSCRIBERS.
+    """
+    try:
+        last_event_id = int(request.headers["last-event-id"])
+    except (KeyError, ValueError):
+        last_event_id = None
+    return StreamingResponse(
+        stream_events_async(disponibilita, last_event_id=last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# ==================== API OPERAZIONI ====================
+
+
+async def create_operazione(request):
+    """Crea una nuova operazione (noleggio o riconsegna)"""
+    try:
+        data = await _json_body(request)
+        if not data:
+            return _error("Dati richiesti", 400)
+
+        for field in ("tipo", "idUtente", "idBicicletta", "idStazione"):
+            if field not in data:
+                return _error(f"Campo {field} richiesto", 400)
+
+        if data["tipo"] == "noleggio":
+            result = await run_service(
+                BikeRentalService.rent_bike,
+                data["idUtente"],
+                data["idBicicletta"],
+                data["idStazione"],
+                tariffa=data.get("tariffa"),
+            )
+        elif data["tipo"] == "riconsegna":
+            result = await run_service(
+                BikeRentalService.return_bike,
+                data["idUtente"],
+                data["idBicicletta"],
+                data["idStazione"],
+                distanzaPercorsa=data.get("distanzaPercorsa", 0),
+                tariffa=data.get("tariffa"),
+            )
+        else:
+            return _error("Tipo operazione non valido", 400)
+
+        status_code = result.pop("code", 400)
+        if result["status"] == "success":
+            return JSONResponse(result, status_code=201)
+        return JSONResponse(result, status_code=status_code)
+
+    except Exception as e:
+        return _error(str(e), 500)
+
+
+async def get_user_operations(request):
+    """Ottieni le operazioni di un utente (limit, cursor, dal, al, dettagli opzionali)"""
+    try:
+        args = request.query_params
+        result = await run_service(
+            BikeRentalService.get_user_operations,
+            request.path_params["user_id"],
+            limit=args.get("limit"),
+            cursor=args.get("cursor"),
+            dal=args.get("dal"),
+            al=args.get("al"),
+            dettagli=args.get("dettagli", "").lower() in ("1", "true", "yes"),
+        )
+        status_code = result.pop("code", 400)
+        return JSONResponse(result, status_code=200 if result["status"] == "success" else status_code)
+    except Exception as e:
+        return _error(str(e), 500)
+
+
+# ==================== API SIMULAZIONE ====================
+
+
+async def _read_fixes_body(request):
+    body = await request.body()
+    return decode_fixes_body(body.decode("utf-8", errors="replace"), _mimetype(request))
+
+
+async def ingest_telemetria(request):
+    """Acquisisce un batch di fix GPS (idBicicletta, latitudine, longitudine, timestamp)"""
+    try:
+        result = await run_service(TelemetryService.ingest_fixes, await _read_fixes_body(request))
+        return JSONResponse(result, status_code=200 if result["status"] == "success" else 500)
+    except TelemetryError as e:
+        return _error(str(e), 400)
+    except Exception as e:
+        return _error(str(e), 500)
+
+
+async def simula_movimento(request):
+    """Applica uno o più fix GPS a una singola bicicletta"""
+    try:
+        result = await run_service(
+            TelemetryService.ingest_fixes,
+            await _read_fixes_body(request),
+            bike_id=request.path_params["bike_id"],
+        )
+
+        if result["status"] == "success":
+            if result["data"]["biciclette"] == 0 and result["data"]["ricevuti"] > 0:
+                return _error("Bicicletta non trovata o fix non validi", 404)
+            return JSONResponse(result)
+        return JSONResponse(result, status_code=500)
+
+    except TelemetryError as e:
+        return _error(str(e), 400)
+    except Exception as e:
+        return _error(str(e), 500)
+
+
+# ==================== APPLICAZIONE ====================
+
+
+ROUTES = [
+    Route("/api/auth/login", login, methods=["POST"]),
+    Route("/api/biciclette/nearby", get_biciclette_nearby, methods=["GET"]),
+    Route("/api/biciclette/{bici_id:int}", update_bicicletta, methods=["PUT"]),
+    Route("/api/biciclette/{bike_id:int}/status", get_bike_status, methods=["GET"]),
+    Route("/api/stazioni/nearby", get_stazioni_nearby, methods=["GET"]),
+    Route("/api/stazioni/stream", get_stazioni_stream, methods=["GET"]),
+    Route("/api/operazioni", create_operazione, methods=["POST"]),
+    Route("/api/operazioni/utente/{user_id:int}", get_user_operations, methods=["GET"]),
+    Route("/api/simulazione", ingest_telemetria, methods=["POST"]),
+    Route("/api/simulazione/{bike_id:int}", simula_movimento, methods=["POST"]),
+]
+
+
+def create_asgi_app(config=None):
+    """Crea l'applicazione ASGI.
+
+    ``config`` è passato a create_app per l'applicazione Flask che serve le
+    route non asincrone; i due engine puntano allo stesso database.
+    ``METRICS_SAMPLE_RATE`` e ``QUERY_BUDGET`` valgono anche per le route
+    asincrone, le cui metriche compaiono nello stesso /metrics.
+    """
+    flask_app = create_app(config)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        yield
+        await get_async_engine().dispose()
+
+    # Le route native sono misurate qui, quelle di Flask dai suoi hook
+    misure = Middleware(
+        ASGIMetricsMiddleware,
+        routes=ROUTES,
+        sample_rate=flask_app.config.get("METRICS_SAMPLE_RATE"),
+        budget=flask_app.config.get("QUERY_BUDGET"),
+    )
+    return Starlette(
+        routes=ROUTES + [Mount("/", app=WSGIMiddleware(flask_app))],
+        middleware=[misure],
+        lifespan=lifespan,
+    )
@@ -0,0 +1,396 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+# Secondi senza eventi dopo i quali si invia un commento di keep-alive
+HEARTBEAT_SECONDS = 15
+
+# Delta conservati per chi si riconnette con Last-Event-ID
+DEFAULT_HISTORY = 1000
+
+# Stream aperti al massimo per processo: sotto WSGI ognuno occupa un thread
+# del worker per tutta la connessione
+DEFAULT_MAX_SUBSCRIBERS = 50
+
+# Intervallo minimo (secondi) tra due riallineamenti del timer
+MIN_REFRESH_SECONDS = 0.1
+
+logger = logging.getLogger(__name__)
+
+
+class AvailabilityFeed:
+    """Disponibilità delle stazioni in memoria, con un log di delta versionati.
+
+    La tabella associa l'ID di ogni stazione a (biciclette, posti liberi).
+    Ogni modifica produce un evento con un numero di versione crescente;
+    tutti gli abbonati leggono lo stesso log, quindi ogni aggiornamento è
+    serializzato una sola volta qualunque sia il numero di client.
+
+    ``loader`` restituisce un iterabile di (id, numBiciclette, numSlot).
+    Finché c'è almeno uno stream aperto un thread confronta la tabella con
+    il database ogni ``max_age`` secondi, così arrivano anche le modifiche
+    fatte da altri processi e si corregge qualunque valore sbagliato; uno
+    snapshot di una tabella più vecchia di ``max_age`` la riallinea prima.
+    Il loader è sempre chiamato senza tenere il lock: pubblicazioni e
+    attese non si fermano dietro la query.
+
+    Noleggi e riconsegne pubblicano il conteggio con la versione della
+    stazione (l'ID dell'operazione, crescente nell'ordine dei commit sulla
+    stessa stazione): un aggiornamento più vecchio di quello già applicato,
+    arrivato in ritardo da un thread concorrente, viene ignorato.
+
+    Sotto WSGI ogni stream occupa un thread del worker per tutta la
+    connessione: ``max_subscribers`` (``SSE_MAX_SUBSCRIBERS``) limita gli
+    stream aperti nel processo, così i client del feed non esauriscono i
+    thread che servono le altre richieste.
+    """
+
+    def __init__(self, loader, history=DEFAULT_HISTORY, max_age=30, max_subscribers=None):
+        self._loader = loader
+        self._max_age = max_age
+        self._table = None
+        self._loaded_at = 0.0
+        self._version = 0
+        self._events = deque(maxlen=history)
+        self._cond = threading.Condition()
+        self._refresh_lock = threading.Lock()
+        # Modifiche arrivate mentre la tabella è in caricamento
+        self._pending = None
+        # Modifiche arrivate durante un riallineamento (vedi refresh)
+        self._recenti = None
+        # Ultima versione applicata per stazione (vedi update)
+        self._versioni = {}
+        # Thread di riallineamento, attivo finché ci sono stream aperti
+        self._timer = None
+        # Stream asincroni in attesa: (loop, asyncio.Event)
+        self._async_waiters = set()
+        self._subscribers = 0
+        # Stream asincroni, che non contano per max_subscribers
+        self._illimitati = 0
+        if max_subscribers is None:
+            max_subscribers = int(os.environ.get("SSE_MAX_SUBSCRIBERS", DEFAULT_MAX_SUBSCRIBERS))
+        self.max_subscribers = max_subscribers
+
+    @property
+    def version(self):
+        return self._version
+
+    def _load(self):
+        return {
+            stazione_id: (bici, slot - bici)
+            for stazione_id, bici, slot in self._loader()
+        }
+
+    @property
+    def subscribers(self):
+        return self._subscribers
+
+    def subscribe(self, limitato=True):
+        """Registra uno stream; False se ce ne sono già max_subscribers.
+
+        Gli stream asincroni non occupano thread e si registrano con
+        ``limitato=False``: non contano per il limite e tengono solo attivo
+        il riallineamento.
+        """
+        with self._cond:
+            if not limitato:
+                self._illimitati += 1
+            elif self._subscribers >= self.max_subscribers:
+                return False
+            else:
+                self._subscribers += 1
+            if self._timer is None or not self._timer.is_alive():
+                # Dopo un fork il thread del padre non esiste nel figlio
+                self._timer = threading.Thread(
+                    target=self._riallinea_periodicamente, name="disponibilita", daemon=True
+                )
+                self._timer.start()
+            return True
+
+    def unsubscribe(self, limitato=True):
+        with self._cond:
+            if limitato:
+                self._subscribers = max(0, self._subscribers - 1)
+            else:
+                self._illimitati = max(0, self._illimitati - 1)
+
+    def snapshot(self):
+        """(versione, lista completa della disponibilità)"""
+        self.refresh_if_stale()
+        with self._cond:
+            # Un solo caricamento alla volta; gli altri attendono il risultato
+            self._cond.wait_for(lambda: self._table is not None or self._pending is None)
+            if self._table is None:
+                self._pending = {}
+                caricare = True
+            else:
+                caricare = False
+                righe = self._righe()
+
+        if caricare:
+            try:
+                table = self._load()
+            except BaseException:
+                with self._cond:
+                    self._pending = None
+                    self._cond.notify_all()
+                raise
+            with self._cond:
+                # Le modifiche arrivate durante la query sono più recenti
+                for stazione_id, valori in self._pending.items():
+                    if valori is None:
+                        table.pop(stazione_id, None)
+                    else:
+                        table[stazione_id] = valori
+                self._pending = None
+                self._table = table
+                self._loaded_at = time.monotonic()
+                self._cond.notify_all()
+                righe = self._righe()
+        return righe
+
+    def _righe(self):
+        """(versione, righe della tabella) da chiamare con il lock"""
+        return self._version, [
+            _riga(stazione_id, valori) for stazione_id, valori in sorted(self._table.items())
+        ]
+
+    def _publish(self, changes):
+        """Registra un evento e sveglia gli abbonati (da chiamare con il lock)"""
+        self._version += 1
+        self._events.append((self._version, json.dumps(changes)))
+        self._notify()
+
+    def _notify(self):
+        """Sveglia i thread e i loop in attesa (da chiamare con il lock)"""
+        self._cond.notify_all()
+        for loop, event in self._async_waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # Loop già chiuso: lo stream non esiste più
+
+    def update(self, stazione_id, num_biciclette, num_slot, versione=None):
+        """Aggiorna una stazione; pubblica un delta solo se qualcosa è cambiato.
+
+        Con ``versione`` l'aggiornamento è ignorato se la stazione ne ha già
+        ricevuto uno con versione uguale o maggiore.
+        """
+        valori = (num_biciclette, num_slot - num_biciclette)
+        with self._cond:
+            if versione is not None:
+                if versione <= self._versioni.get(stazione_id, 0):
+                    return
+                self._versioni[stazione_id] = versione
+            if self._table is None:
+                if self._pending is not None:
+                    self._pending[stazione_id] = valori
+                return
+            if self._recenti is not None:
+                self._recenti[stazione_id] = valori
+            if self._table.get(stazione_id) == valori:
+                return
+            self._table[stazione_id] = valori
+            self._publish([_riga(stazione_id, valori)])
+
+    def remove(self, stazione_id):
+        with self._cond:
+            self._versioni.pop(stazione_id, None)
+            if self._table is None:
+                if self._pending is not None:
+                    self._pending[stazione_id] = None
+                return
+            if self._recenti is not None:
+                self._recenti[stazione_id] = None
+            if self._table.pop(stazione_id, None) is None:
+                return
+            self._publish([{"ID": stazione_id, "rimossa": True}])
+
+    def refresh_if_stale(self):
+        """Riallinea la tabella al database se è più vecchia di max_age"""
+        if self._table is None or time.monotonic() - self._loaded_at < self._max_age:
+            return
+        self.refresh()
+
+    def refresh(self):
+        """Confronta la tabella con il database e pubblica le differenze"""
+        if not self._refresh_lock.acquire(blocking=False):
+            return  # Un altro abbonato sta già aggiornando
+        try:
+            with self._cond:
+                self._recenti = {}
+            try:
+                nuova = self._load()
+            finally:
+                with self._cond:
+                    recenti, self._recenti = self._recenti, None
+            with self._cond:
+                if self._table is None:
+                    return
+                # Come in snapshot: le modifiche arrivate durante la query
+                # sono più recenti della lettura
+                for stazione_id, valori in recenti.items():
+                    if valori is None:
+                        nuova.pop(stazione_id, None)
+                    else:
+                        nuova[stazione_id] = valori
+                changes = [
+                    _riga(stazione_id, valori)
+                    for stazione_id, valori in sorted(nuova.items())
+                    if self._table.get(stazione_id) != valori
+                ]
+                changes += [
+                    {"ID": stazione_id, "rimossa": True}
+                    for stazione_id in sorted(self._table.keys() - nuova.keys())
+                ]
+                self._table = nuova
+                self._loaded_at = time.monotonic()
+                if changes:
+                    self._publish(changes)
+        finally:
+            self._refresh_lock.release()
+
+    def _riallinea_periodicamente(self):
+        """Corpo del thread di riallineamento: termina senza stream aperti"""
+        while True:
+            time.sleep(max(self._max_age, MIN_REFRESH_SECONDS))
+            with self._cond:
+                if self._subscribers == 0 and self._illimitati == 0:
+                    self._timer = None
+                    return
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Riallineamento della disponibilità non riuscito")
+
+    def events_since(self, version):
+        """Eventi successivi a version, None se non sono più tutti nel log"""
+        with self._cond:
+            if version == self._version:
+                return []
+            if version > self._version or not self._events or self._events[0][0] > version + 1:
+                return None
+            return [(v, payload) for v, payload in self._events if v > version]
+
+    def wait(self, version, timeout):
+        """Attende un evento successivo a version; False allo scadere del timeout"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._version != version, timeout)
+
+    async def wait_async(self, version, timeout):
+        """Come wait, senza occupare un thread.
+
+        Gli eventi pubblicati da qualunque thread svegliano il loop con
+        call_soon_threadsafe.
+        """
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._cond:
+            if self._version != version:
+                return True
+            self._async_waiters.add(waiter)
+        try:
+            await asyncio.wait_for(waiter[1].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._cond:
+                self._async_waiters.discard(waiter)
+        return self._version != version
+
+    def reset(self):
+        # La versione non riparte da zero: chi è connesso riceve un nuovo snapshot
+        with self._cond:
+            self._table = None
+            self._versioni.clear()
+            self._events.clear()
+            self._version += 1
+            self._notify()
+
+
+def _riga(stazione_id, valori):
+    num_biciclette, posti_liberi = valori
+    return {"ID": stazione_id, "numBiciclette": num_biciclette, "postiLiberi": posti_liberi}
+
+
+def _evento(version, tipo, payload):
+    return f"id: {version}\nevent: {tipo}\ndata: {payload}\n\n"
+
+
+def stream_events(feed, last_event_id=None, heartbeat=HEARTBEAT_SECONDS):
+    """Genera lo stream SSE: uno snapshot iniziale e poi solo i delta.
+
+    Con ``last_event_id`` (riconnessione) invia i delta persi se sono
+    ancora nel log, altrimenti un nuovo snapshot.
+    """
+    yield "retry: 3000\n\n"
+
+    version = None
+    if last_event_id is not None:
+        eventi = feed.events_since(last_event_id)
+        if eventi is not None:
+            version = last_event_id
+            for version, payload in eventi:
+                yield _evento(version, "delta", payload)
+
+    while True:
+        if version is None:
+            version, righe = feed.snapshot()
+            yield _evento(version, "snapshot", json.dumps(righe))
+
+        if not feed.wait(version, heartbeat):
+            yield ": ping\n\n"
+            continue
+
+        eventi = feed.events_since(version)
+        if eventi is None:
+            version = None
+            continue
+        for version, payload in eventi:
+            yield _evento(version, "delta", payload)
+
+
+async def stream_events_async(feed, last_event_id=None, heartbeat=HEARTBEAT_SECONDS):
+    """Come stream_events, per un handler ASGI.
+
+    L'attesa degli eventi non occupa thread; solo lo snapshot gira per il
+    tempo della query in un thread del pool di asyncio. Lo stream si
+    registra senza limite di abbonati, per tenere attivo il riallineamento.
+    """
+    feed.subscribe(limitato=False)
+    try:
+        async for chunk in _stream_async(feed, last_event_id, heartbeat):
+            yield chunk
+    finally:
+        feed.unsubscribe(limitato=False)
+
+
+async def _stream_async(feed, last_event_id, heartbeat):
+    yield "retry: 3000\n\n"
+
+    version = None
+    if last_event_id is not None:
+        eventi = feed.events_since(last_event_id)
+        if eventi is not None:
+            version = last_event_id
+            for version, payload in eventi:
+                yield _evento(version, "delta", payload)
+
+    while True:
+        if version is None:
+            version, righe = await asyncio.to_thread(feed.snapshot)
+            yield _evento(version, "snapshot", json.dumps(righe))
+
+        if not await feed.wait_async(version, heartbeat):
+            yield ": ping\n\n"
+            continue
+
+        eventi = feed.events_since(version)
+        if eventi is None:
+            version = None
+            continue
+        for version, payload in eventi:
+            yield _evento(version, "delta", payload)
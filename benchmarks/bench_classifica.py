@@ -0,0 +1,82 @@
+"""Benchmark della classifica per distanza percorsa.
+
+Misura gli aggiornamenti al secondo di ``leaderboard.Leaderboard`` (lista
+ordinata a blocchi) a dimensioni di flotta crescenti e, per confronto,
+di un'unica lista ordinata con ``bisect.insort``, che sposta in memoria
+l'intera flotta a ogni aggiornamento. Ogni aggiornamento porta una
+bicicletta a caso a una nuova distanza, come ``set`` dopo un noleggio.
+
+Esempio:
+    python benchmarks/bench_classifica.py --bikes 10000 100000 1000000
+    python benchmarks/bench_classifica.py --bikes 100000 --updates 500000 --no-baseline
+"""
+import argparse
+import bisect
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from leaderboard import Leaderboard  # noqa: E402
+
+
+class ListaOrdinata:
+    """La classifica precedente: una sola lista ordinata"""
+
+    def __init__(self):
+        self._ordinati = []
+        self._distanze = {}
+
+    def set(self, item_id, distanza):
+        vecchia = self._distanze.pop(item_id, None)
+        if vecchia is not None:
+            del self._ordinati[bisect.bisect_left(self._ordinati, (vecchia, item_id))]
+        bisect.insort(self._ordinati, (distanza, item_id))
+        self._distanze[item_id] = distanza
+
+
+def popola(board, distanze):
+    for bici_id, distanza in enumerate(distanze):
+        board.set(bici_id, distanza)
+
+
+def bench(board, aggiornamenti):
+    start = time.perf_counter()
+    for bici_id, distanza in aggiornamenti:
+        board.set(bici_id, distanza)
+    return len(aggiornamenti) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bikes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--updates", type=int, default=200_000)
+    parser.add_argument("--no-baseline", action="store_true",
+                        help="salta il confronto con la lista ordinata unica")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for n_bikes in args.bikes:
+        rng = random.Random(args.seed)
+        distanze = [rng.uniform(0, 5000) for _ in range(n_bikes)]
+        aggiornamenti = [
+            (rng.randrange(n_bikes), rng.uniform(0, 5000)) for _ in range(args.updates)
+        ]
+
+        board = Leaderboard()
+        popola(board, distanze)
+        blocchi = bench(board, aggiornamenti)
+        print(f"{n_bikes:>9,} bici  blocchi: {blocchi:12,.0f} agg/s", end="")
+
+        if not args.no_baseline:
+            lista = ListaOrdinata()
+            popola(lista, distanze)
+            unica = bench(lista, aggiornamenti)
+            print(f"  lista unica: {unica:12,.0f} agg/s  speedup: {blocchi / unica:6.1f}x", end="")
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timezone
+
+# Registro delle strutture in memoria del processo (indici, cache).
+# Ogni oggetto registrato espone reset(): serve quando il database
+# sottostante cambia, ad esempio tra un test e l'altro.
+
+_registry = []
+
+
+def register(obj):
+    """Registra una struttura in memoria e la restituisce"""
+    _registry.append(obj)
+    return obj
+
+
+def reset_all():
+    """Svuota tutte le strutture registrate"""
+    for obj in _registry:
+        obj.reset()
+
+
+class LRUCache:
+    """Cache LRU limitata e thread-safe, con scadenza opzionale delle voci.
+
+    La scadenza limita quanto a lungo un processo può servire un valore
+    invalidato da un altro processo.
+    """
+
+    _MISSING = object()
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, self._MISSING)
+            if item is self._MISSING:
+                return default
+            value, expires = item
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def reset(self):
+        with self._lock:
+            self._data.clear()
+
+
+CachedBody = namedtuple("CachedBody", "body etag last_modified version built_at")
+
+
+class CachedResponse:
+    """Corpo di una risposta già codificato, ricostruito solo quando serve.
+
+    invalidate() va chiamato da chi modifica i dati: incrementa la versione
+    e la prossima richiesta ricostruisce il corpo. L'ETag è derivato dal
+    contenuto, quindi è lo stesso in tutti i processi che servono gli stessi
+    dati; ``max_age`` limita quanto un processo può restare indietro rispetto
+    alle modifiche fatte da un altro.
+    """
+
+    def __init__(self, max_age=None):
+        self.max_age = max_age
+        self._version = 0
+        self._entry = None
+        self._lock = threading.Lock()
+
+    def _fresh(self, entry):
+        if entry is None or entry.version != self._version:
+            return False
+        return self.max_age is None or time.monotonic() - entry.built_at < self.max_age
+
+    def get(self, build):
+        """Restituisce il CachedBody corrente; build() produce i byte del corpo"""
+        entry = self._entry
+        if self._fresh(entry):
+            return entry
+
+        with self._lock:
+            version = self._version
+            previous = self._entry
+
+        body = build()
+        etag = hashlib.blake2b(body, digest_size=12).hexdigest()
+        if previous is not None and previous.etag == etag:
+            last_modified = previous.last_modified
+        else:
+            last_modified = datetime.now(timezone.utc).replace(microsecond=0)
+        entry = CachedBody(body, etag, last_modified, version, time.monotonic())
+
+        with self._lock:
+            if version == self._version:
+                self._entry = entry
+        return entry
+
+    def invalidate(self):
+        with self._lock:
+            self._version += 1
+
+    def reset(self):
+        with self._lock:
+            self._version += 1
+            self._entry = None
@@ -0,0 +1,67 @@
+import math
+
+import numpy as np
+
+# Raggio medio terrestre in chilometri
+EARTH_RADIUS_KM = 6371.0088
+
+# Chilometri per grado di latitudine
+KM_PER_DEG = math.pi * EARTH_RADIUS_KM / 180.0
+
+# Raggio massimo (km) di una ricerca di prossimità
+MAX_RADIUS_KM = 100.0
+
+# Spostamenti più brevi sono rumore del GPS di una bici ferma (km)
+MIN_SEGMENT_KM = 0.005
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Distanza ortodromica in km tra due punti espressi in gradi"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lon2 - lon1)
+
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def valid_coordinates(lat, lon):
+    """Verifica che latitudine e longitudine siano nei limiti"""
+    return -90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0
+
+
+def parse_nearby_args(args):
+    """Legge lat, lon, k e radius (km) dai parametri di una ricerca di prossimità"""
+    try:
+        lat = float(args["lat"])
+        lon = float(args["lon"])
+        k = int(args.get("k", 5))
+        radius = args.get("radius")
+        radius = float(radius) if radius is not None else None
+    except (KeyError, ValueError):
+        raise ValueError("Parametri lat/lon/k/radius non validi")
+
+    if not valid_coordinates(lat, lon) or not 1 <= k <= 100 or (radius is not None and not 0 < radius <= MAX_RADIUS_KM):
+        raise ValueError("Parametri lat/lon/k/radius non validi")
+    return lat, lon, k, radius
+
+
+def haversine_np(lat1, lon1, lat2, lon2):
+    """Versione vettoriale di haversine su array NumPy (risultato in km)"""
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = np.radians(np.asarray(lon2) - np.asarray(lon1))
+
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+
+def movement_km(lat1, lon1, lat2, lon2):
+    """Distanza da contare per uno spostamento (km): 0 se il punto di
+    partenza è (0, 0), cioè mai localizzato, o sotto MIN_SEGMENT_KM"""
+    if lat1 == 0 and lon1 == 0:
+        return 0.0
+    d = haversine(lat1, lon1, lat2, lon2)
+    return d if d >= MIN_SEGMENT_KM else 0.0
@@ -0,0 +1,127 @@
+import bisect
+import threading
+
+from spatial import LazyIndex
+
+
+# Coppie per blocco: un blocco che supera il doppio viene diviso a metà
+_CARICO = 512
+
+
+class Leaderboard:
+    """Classifica delle biciclette per distanza percorsa.
+
+    Le coppie (distanza, id) sono ordinate in blocchi di al massimo
+    2 * ``_CARICO`` elementi, a loro volta in ordine; ``_massimi`` tiene
+    l'ultima coppia di ogni blocco. Un aggiornamento cerca il blocco con
+    una bisezione su ``_massimi`` e sposta solo gli elementi di quel
+    blocco, invece dell'intera flotta come farebbe un'unica lista
+    ordinata. Un dizionario id -> distanza trova la coppia da rimuovere.
+    Le prime e le ultime N si leggono dai blocchi alle due estremità.
+    """
+
+    def __init__(self):
+        self._blocchi = []
+        self._massimi = []
+        self._distanze = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._distanze)
+
+    def __contains__(self, item_id):
+        return item_id in self._distanze
+
+    def _inserisci(self, voce):
+        if not self._blocchi:
+            self._blocchi.append([voce])
+            self._massimi.append(voce)
+            return
+
+        b = bisect.bisect_left(self._massimi, voce)
+        if b == len(self._blocchi):
+            # Oltre il massimo: in coda all'ultimo blocco
+            b -= 1
+            self._blocchi[b].append(voce)
+            self._massimi[b] = voce
+        else:
+            bisect.insort(self._blocchi[b], voce)
+
+        blocco = self._blocchi[b]
+        if len(blocco) > 2 * _CARICO:
+            metà = blocco[_CARICO:]
+            del blocco[_CARICO:]
+            self._blocchi.insert(b + 1, metà)
+            self._massimi[b] = blocco[-1]
+            self._massimi.insert(b + 1, metà[-1])
+
+    def _elimina(self, voce):
+        b = bisect.bisect_left(self._massimi, voce)
+        blocco = self._blocchi[b]
+        i = bisect.bisect_left(blocco, voce)
+        del blocco[i]
+        if not blocco:
+            del self._blocchi[b]
+            del self._massimi[b]
+        elif i == len(blocco):
+            self._massimi[b] = blocco[-1]
+
+    def set(self, item_id, distanza):
+        """Inserisce una bicicletta o ne aggiorna la distanza totale"""
+        distanza = float(distanza)
+        with self._lock:
+            self.remove(item_id)
+            self._inserisci((distanza, item_id))
+            self._distanze[item_id] = distanza
+
+    def remove(self, item_id):
+        """Rimuove una bicicletta, se presente"""
+        with self._lock:
+            distanza = self._distanze.pop(item_id, None)
+            if distanza is None:
+                return False
+            self._elimina((distanza, item_id))
+            return True
+
+    def distance(self, item_id):
+        """Distanza registrata per una bicicletta, None se assente"""
+        return self._distanze.get(item_id)
+
+    def top(self, n):
+        """Le n biciclette con più chilometri, come lista di (distanza, id)"""
+        with self._lock:
+            risultato = []
+            for blocco in reversed(self._blocchi):
+                if len(risultato) >= n:
+                    break
+                risultato += blocco[: -(n - len(risultato)) - 1 : -1]
+            return risultato
+
+    def bottom(self, n):
+        """Le n biciclette con meno chilometri, come lista di (distanza, id)"""
+        with self._lock:
+            risultato = []
+            for blocco in self._blocchi:
+                if len(risultato) >= n:
+                    break
+                risultato += blocco[: n - len(risultato)]
+            return risultato
+
+
+class LazyLeaderboard(LazyIndex):
+    """Leaderboard costruita al primo utilizzo a partire dal database.
+
+    ``loader`` restituisce un iterabile di tuple (id, distanza).
+    """
+
+    def _build(self, rows):
+        board = Leaderboard()
+        for item_id, distanza in rows:
+            board.set(item_id, distanza)
+        return board
+
+    def set(self, item_id, distanza):
+        """Aggiorna la classifica se già costruita"""
+        board = self._index
+        if board is not None:
+            board.set(item_id, distanza)
@@ -0,0 +1,427 @@
+"""Metriche delle richieste in formato Prometheus.
+
+Per ogni richiesta campionata registra durata, numero e tempo delle query
+SQL e attesa del pool, per route (il modello della regola, non l'URL, così
+le etichette restano poche). Il conteggio delle richieste e degli errori
+del database è sempre registrato; con ``METRICS_SAMPLE_RATE`` basso le
+altre richieste costano un controllo su una ContextVar per query.
+
+In modalità ASGI le route native di asgi.py sono misurate da
+ASGIMetricsMiddleware con le stesse metriche (etichetta ``route`` nel
+formato di Starlette, es. ``/api/biciclette/{bike_id:int}/status``); le
+route che passano a Flask restano misurate dagli hook di init_app.
+
+Con ``QUERY_BUDGET`` ogni richiesta che esegue più query di così (tipico
+segnale di un N+1) viene registrata e segnalata nel log; con
+``QUERY_BUDGET_STRICT`` (attivo di default in TESTING) solleva
+QueryBudgetExceeded e il test fallisce.
+"""
+import bisect
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import sqlalchemy as sa
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+from models import TimedQueuePool, get_engine
+
+# Limiti superiori dei bucket degli istogrammi
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 500)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Statistiche della richiesta in corso; None se non misurata
+_current = ContextVar("metrics_current", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=""):
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Contatore monotono con etichette"""
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    """Istogramma a bucket fissi con etichette (bucket cumulativi nel testo)"""
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # etichette -> [conteggi per bucket (+Inf in fondo), somma, numero]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            serie = self._series.get(labels)
+            if serie is None:
+                serie = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            serie[0][i] += 1
+            serie[1] += value
+            serie[2] += 1
+
+    def count(self, *labels):
+        serie = self._series.get(labels)
+        return serie[2] if serie else 0
+
+    def sum(self, *labels):
+        serie = self._series.get(labels)
+        return serie[1] if serie else 0.0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (conteggi, somma, numero) in sorted(self._series.items()):
+                cumulato = 0
+                for limite, n in zip(self.buckets + (float("inf"),), conteggi):
+                    cumulato += n
+                    le = _labels(self.labels, labels, f'le="{_number(limite)}"')
+                    lines.append(f"{self.name}_bucket{le} {cumulato}")
+                lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {_number(somma)}")
+                lines.append(f"{self.name}_count{_labels(self.labels, labels)} {numero}")
+        return lines
+
+
+REQUESTS = Counter(
+    "http_requests_total", "Richieste HTTP servite", ("method", "route", "status")
+)
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Durata delle richieste HTTP campionate", ("method", "route", "status")
+)
+SQL_STATEMENTS = Histogram(
+    "http_request_sql_statements", "Query SQL per richiesta campionata", ("route",), STATEMENT_BUCKETS
+)
+SQL_SECONDS = Histogram(
+    "http_request_sql_seconds", "Tempo speso nelle query SQL per richiesta campionata", ("route",)
+)
+POOL_WAIT_SECONDS = Histogram(
+    "http_request_pool_wait_seconds", "Attesa di una connessione dal pool per richiesta campionata", ("route",)
+)
+SQL_ERRORS = Counter(
+    "db_errors_total", "Errori del database per route e tipo di eccezione", ("route", "error")
+)
+QUERY_BUDGET_EXCEEDED = Counter(
+    "http_query_budget_exceeded_total", "Richieste oltre il budget di query SQL", ("method", "route")
+)
+
+_METRICS = (
+    REQUESTS, REQUEST_SECONDS, SQL_STATEMENTS, SQL_SECONDS, POOL_WAIT_SECONDS, SQL_ERRORS,
+    QUERY_BUDGET_EXCEEDED,
+)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Una richiesta (o un blocco di codice) ha eseguito troppe query SQL"""
+
+
+class _RequestStats:
+    __slots__ = ("route", "start", "sampled", "statements", "sql", "sql_start", "pool_wait")
+
+    def __init__(self, route, start, sampled=True):
+        self.route = route
+        self.start = start
+        self.sampled = sampled
+        self.statements = 0
+        self.sql = 0.0
+        self.sql_start = None
+        self.pool_wait = 0.0
+
+
+# ==================== EVENTI SQLALCHEMY ====================
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    if stats is not None:
+        stats.sql_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    if stats is not None and stats.sql_start is not None:
+        stats.statements += 1
+        stats.sql += time.perf_counter() - stats.sql_start
+        stats.sql_start = None
+
+
+def _handle_error(context):
+    stats = _current.get()
+    route = stats.route if stats is not None else _route_name()
+    SQL_ERRORS.inc(route, type(context.original_exception).__name__)
+    if stats is not None and stats.sql_start is not None:
+        stats.statements += 1
+        stats.sql += time.perf_counter() - stats.sql_start
+        stats.sql_start = None
+
+
+def _pool_wait(waited, error):
+    stats = _current.get()
+    if stats is not None:
+        stats.pool_wait += waited
+    if error is not None:
+        # Timeout del pool: la richiesta non arriva mai a eseguire SQL
+        SQL_ERRORS.inc(stats.route if stats is not None else _route_name(), type(error).__name__)
+
+
+_installed = False
+_install_lock = threading.Lock()
+
+
+def install_sql_listeners():
+    """Registra (una volta) gli eventi su tutti gli engine, compreso models.db"""
+    global _installed
+    with _install_lock:
+        if _installed:
+            return
+        sa.event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        sa.event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        sa.event.listen(Engine, "handle_error", _handle_error)
+        TimedQueuePool.observers.append(_pool_wait)
+        _installed = True
+
+
+# ==================== MIDDLEWARE FLASK ====================
+
+
+def _route_name():
+    from flask import has_request_context, request
+
+    if not has_request_context():
+        return ""
+    rule = request.url_rule
+    return rule.rule if rule is not None else "<non trovata>"
+
+
+def _setting(app, name, default=None):
+    return app.config.get(name, os.environ.get(name, default))
+
+
+def init_app(app):
+    """Registra gli hook di misura delle richieste sull'applicazione Flask"""
+    from flask import g, request
+
+    install_sql_listeners()
+    rate = float(_setting(app, "METRICS_SAMPLE_RATE", 1.0))
+    budget = _setting(app, "QUERY_BUDGET")
+    budget = int(budget) if budget not in (None, "") else None
+    strict = app.config.get("QUERY_BUDGET_STRICT", app.testing)
+
+    @app.before_request
+    def _start_request():
+        sampled = rate >= 1.0 or (rate > 0 and random.random() < rate)
+        # Con il budget attivo le query si contano in ogni richiesta
+        if sampled or budget is not None:
+            stats = _RequestStats(_route_name(), time.perf_counter(), sampled)
+            g._metrics = (stats, _current.set(stats))
+
+    @app.after_request
+    def _record_status(response):
+        g._metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def _end_request(exc=None):
+        status = g.pop("_metrics_status", 500)
+        REQUESTS.inc(request.method, _route_name(), str(status))
+
+        campionata = g.pop("_metrics", None)
+        if campionata is None:
+            return
+        stats, token = campionata
+        _current.reset(token)
+        if stats.sampled:
+            labels = (request.method, stats.route, str(status))
+            REQUEST_SECONDS.observe(time.perf_counter() - stats.start, *labels)
+            SQL_STATEMENTS.observe(stats.statements, stats.route)
+            SQL_SECONDS.observe(stats.sql, stats.route)
+            POOL_WAIT_SECONDS.observe(stats.pool_wait, stats.route)
+
+        if budget is not None and stats.statements > budget:
+            QUERY_BUDGET_EXCEEDED.inc(request.method, stats.route)
+            messaggio = f"{request.method} {request.path}: {stats.statements} query SQL (budget {budget})"
+            app.logger.warning(messaggio)
+            if strict:
+                raise QueryBudgetExceeded(messaggio)
+
+
+# ==================== MIDDLEWARE ASGI ====================
+
+
+class ASGIMetricsMiddleware:
+    """Middleware ASGI con le metriche di init_app per le route native.
+
+    ``routes`` sono le Route di Starlette da misurare; le richieste che non
+    ne corrispondono a nessuna (l'applicazione Flask montata) passano senza
+    essere contate, perché le misurano già gli hook di Flask. Con
+    ``QUERY_BUDGET`` le richieste oltre il budget sono contate e segnalate
+    nel log, senza sollevare eccezioni.
+    """
+
+    def __init__(self, app, routes, sample_rate=None, budget=None):
+        from starlette.routing import Match
+
+        install_sql_listeners()
+        self.app = app
+        self._routes = list(routes)
+        self._full = Match.FULL
+        if sample_rate is None:
+            sample_rate = os.environ.get("METRICS_SAMPLE_RATE", 1.0)
+        self._rate = float(sample_rate)
+        if budget is None:
+            budget = os.environ.get("QUERY_BUDGET")
+        self._budget = int(budget) if budget not in (None, "") else None
+        self._logger = logging.getLogger(__name__)
+
+    def _route(self, scope):
+        for route in self._routes:
+            if route.matches(scope)[0] == self._full:
+                return route.path
+        return None
+
+    async def __call__(self, scope, receive, send):
+        route = self._route(scope) if scope["type"] == "http" else None
+        if route is None:
+            await self.app(scope, receive, send)
+            return
+
+        rate = self._rate
+        sampled = rate >= 1.0 or (rate > 0 and random.random() < rate)
+        stats = None
+        if sampled or self._budget is not None:
+            stats = _RequestStats(route, time.perf_counter(), sampled)
+        token = _current.set(stats)
+        status = [500]
+
+        async def send_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            _current.reset(token)
+            self._record(scope["method"], route, str(status[0]), stats, scope.get("path", ""))
+
+    def _record(self, method, route, status, stats, path):
+        REQUESTS.inc(method, route, status)
+        if stats is None:
+            return
+        if stats.sampled:
+            REQUEST_SECONDS.observe(time.perf_counter() - stats.start, method, route, status)
+            SQL_STATEMENTS.observe(stats.statements, route)
+            SQL_SECONDS.observe(stats.sql, route)
+            POOL_WAIT_SECONDS.observe(stats.pool_wait, route)
+        if self._budget is not None and stats.statements > self._budget:
+            QUERY_BUDGET_EXCEEDED.inc(method, route)
+            self._logger.warning(f"{method} {path}: {stats.statements} query SQL (budget {self._budget})")
+
+
+@contextmanager
+def query_budget(limit):
+    """Fallisce se il blocco esegue più di ``limit`` query SQL (per i test).
+
+    Conta le query di tutti gli engine eseguite nel blocco, comprese
+    quelle delle richieste del test client. Restituisce una lista il cui
+    unico elemento è il conteggio corrente.
+    """
+    conteggio = [0]
+
+    def _conta(*args):
+        conteggio[0] += 1
+
+    sa.event.listen(Engine, "after_cursor_execute", _conta)
+    try:
+        yield conteggio
+    finally:
+        sa.event.remove(Engine, "after_cursor_execute", _conta)
+    if conteggio[0] > limit:
+        raise QueryBudgetExceeded(f"{conteggio[0]} query SQL (budget {limit})")
+
+
+# ==================== ESPOSIZIONE ====================
+
+
+def _pool_lines():
+    pool = get_engine().pool
+    if not isinstance(pool, QueuePool):
+        return []
+
+    gauges = [
+        ("db_pool_size", "Connessioni tenute aperte nel pool", pool.size()),
+        ("db_pool_checked_out", "Connessioni in uso", pool.checkedout()),
+        ("db_pool_overflow", "Connessioni oltre la dimensione del pool", max(0, pool.overflow())),
+    ]
+    lines = []
+    for name, help, value in gauges:
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge", f"{name} {value}"]
+
+    if isinstance(pool, TimedQueuePool):
+        with pool._wait_lock:
+            totali = [
+                ("db_pool_waits_total", "Connessioni richieste al pool", pool.wait_count),
+                ("db_pool_wait_seconds_total", "Attesa totale per le connessioni del pool", pool.wait_total),
+            ]
+            massima = pool.wait_max
+        for name, help, value in totali:
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} counter", f"{name} {_number(value)}"]
+        lines += [
+            "# HELP db_pool_wait_max_seconds Attesa massima per una connessione del pool",
+            "# TYPE db_pool_wait_max_seconds gauge",
+            f"db_pool_wait_max_seconds {_number(massima)}",
+        ]
+    return lines
+
+
+def render():
+    """Tutte le metriche nel formato testuale di Prometheus"""
+    lines = []
+    for metric in _METRICS:
+        lines += metric.render()
+    lines += _pool_lines()
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,9 @@
+-- Paginazione keyset di GET /api/biciclette su (distanzaPercorsa, ID).
+--
+-- La colonna passa da FLOAT a DOUBLE: con FLOAT il valore restituito al
+-- client non coincide con quello memorizzato e il confronto sul cursore
+-- salterebbe o duplicherebbe righe.
+
+ALTER TABLE `biciclette`
+  MODIFY `distanzaPercorsa` double DEFAULT 0,
+  ADD KEY `ix_biciclette_distanza_id` (`distanzaPercorsa`, `ID`);
@@ -0,0 +1,18 @@
+-- Coordinate delle biciclette da VARCHAR(32) a DOUBLE.
+--
+-- I valori non numerici (stringhe vuote o sporche) vengono riportati a '0'
+-- prima della conversione, così l'ALTER non fallisce in modalità strict.
+-- Le biciclette a (0, 0) restano "mai localizzate".
+
+UPDATE `biciclette`
+  SET `latitudine` = '0'
+  WHERE `latitudine` IS NULL OR TRIM(`latitudine`) NOT REGEXP '^-?[0-9]+(\\.[0-9]+)?$';
+
+UPDATE `biciclette`
+  SET `longitudine` = '0'
+  WHERE `longitudine` IS NULL OR TRIM(`longitudine`) NOT REGEXP '^-?[0-9]+(\\.[0-9]+)?$';
+
+ALTER TABLE `biciclette`
+  MODIFY `latitudine` double DEFAULT 0,
+  MODIFY `longitudine` double DEFAULT 0,
+  ADD KEY `ix_biciclette_posizione` (`latitudine`, `longitudine`);
@@ -0,0 +1,16 @@
+-- Stato di noleggio sulla bicicletta, usato dagli UPDATE condizionali
+-- del motore di noleggio/riconsegna (POST /api/operazioni).
+--
+-- Lo stato iniziale è ricostruito dal log: una bicicletta è noleggiata se
+-- la sua ultima operazione è un noleggio.
+
+ALTER TABLE `biciclette`
+  ADD `idUtenteNoleggio` int(11) DEFAULT NULL,
+  ADD KEY `idUtenteNoleggio` (`idUtenteNoleggio`),
+  ADD CONSTRAINT `biciclette_ibfk_1` FOREIGN KEY (`idUtenteNoleggio`) REFERENCES `utenti` (`id`);
+
+UPDATE `biciclette` b
+  JOIN `operazioni` o
+    ON o.`ID` = (SELECT MAX(o2.`ID`) FROM `operazioni` o2 WHERE o2.`idBicicletta` = b.`ID`)
+  SET b.`idUtenteNoleggio` = o.`idUtente`
+  WHERE o.`tipo` = 'noleggio';
@@ -0,0 +1,4 @@
+-- Indice su admin.email per la ricerca unificata delle credenziali al login.
+
+ALTER TABLE `admin`
+  ADD KEY `ix_admin_email` (`email`);
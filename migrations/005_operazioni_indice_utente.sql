@@ -0,0 +1,9 @@
+-- Indice composto (idUtente, ID) per lo storico operazioni paginato
+-- (GET /api/operazioni/utente/<id>?limit=...&cursor=...).
+--
+-- Sostituisce la chiave su solo idUtente: il vincolo operazioni_ibfk_3
+-- resta coperto perché idUtente è la prima colonna del nuovo indice.
+
+ALTER TABLE `operazioni`
+  ADD KEY `ix_operazioni_utente_id` (`idUtente`, `ID`),
+  DROP KEY `idUtente`;
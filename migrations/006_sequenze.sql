@@ -0,0 +1,11 @@
+-- Contatori condivisi per l'allocazione dei codici delle biciclette
+-- (codiceTag, gps) senza collisioni: ogni processo riserva un blocco di
+-- valori con un UPDATE sulla riga del contatore.
+--
+-- Le righe vengono create al primo utilizzo.
+
+CREATE TABLE `sequenze` (
+  `nome` varchar(32) NOT NULL,
+  `valore` bigint(20) NOT NULL DEFAULT 0,
+  PRIMARY KEY (`nome`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
@@ -0,0 +1,30 @@
+-- Viaggi ricostruiti dal log delle operazioni (noleggio -> riconsegna
+-- della stessa bicicletta). Popolata da `flask --app app build-trips`;
+-- gli eventi senza controparte sono salvati con stato *_orfano/_orfana.
+
+CREATE TABLE `viaggi` (
+  `ID` int(11) NOT NULL AUTO_INCREMENT,
+  `stato` enum('completo','in_corso','noleggio_orfano','riconsegna_orfana') NOT NULL,
+  `idBicicletta` int(11) NOT NULL,
+  `idUtente` int(11) NOT NULL,
+  `idStazionePartenza` int(11) DEFAULT NULL,
+  `idStazioneArrivo` int(11) DEFAULT NULL,
+  `idNoleggio` int(11) DEFAULT NULL,
+  `idRiconsegna` int(11) DEFAULT NULL,
+  `inizio` datetime DEFAULT NULL,
+  `fine` datetime DEFAULT NULL,
+  `durata` int(11) DEFAULT NULL,
+  `distanzaPercorsa` int(11) NOT NULL DEFAULT 0,
+  PRIMARY KEY (`ID`),
+  UNIQUE KEY `idNoleggio` (`idNoleggio`),
+  UNIQUE KEY `idRiconsegna` (`idRiconsegna`),
+  KEY `ix_viaggi_stato` (`stato`),
+  KEY `ix_viaggi_bicicletta_inizio` (`idBicicletta`, `inizio`),
+  KEY `ix_viaggi_utente_id` (`idUtente`, `ID`),
+  CONSTRAINT `viaggi_ibfk_1` FOREIGN KEY (`idBicicletta`) REFERENCES `biciclette` (`ID`),
+  CONSTRAINT `viaggi_ibfk_2` FOREIGN KEY (`idUtente`) REFERENCES `utenti` (`id`),
+  CONSTRAINT `viaggi_ibfk_3` FOREIGN KEY (`idStazionePartenza`) REFERENCES `stazioni` (`ID`),
+  CONSTRAINT `viaggi_ibfk_4` FOREIGN KEY (`idStazioneArrivo`) REFERENCES `stazioni` (`ID`),
+  CONSTRAINT `viaggi_ibfk_5` FOREIGN KEY (`idNoleggio`) REFERENCES `operazioni` (`ID`),
+  CONSTRAINT `viaggi_ibfk_6` FOREIGN KEY (`idRiconsegna`) REFERENCES `operazioni` (`ID`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
@@ -0,0 +1,14 @@
+-- Contatori orari di noleggi e riconsegne per stazione, aggiornati nella
+-- stessa transazione di ogni operazione. Per popolarla dallo storico
+-- esistente: `flask --app app build-rollups`.
+
+CREATE TABLE `domanda_oraria` (
+  `idStazione` int(11) NOT NULL,
+  `giorno` date NOT NULL,
+  `ora` smallint(6) NOT NULL,
+  `tipo` enum('noleggio','riconsegna') NOT NULL,
+  `conteggio` int(11) NOT NULL DEFAULT 0,
+  PRIMARY KEY (`idStazione`, `giorno`, `ora`, `tipo`),
+  KEY `ix_domanda_oraria_giorno` (`giorno`, `ora`),
+  CONSTRAINT `domanda_oraria_ibfk_1` FOREIGN KEY (`idStazione`) REFERENCES `stazioni` (`ID`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
@@ -0,0 +1,8 @@
+-- Hash delle password PBKDF2-SHA256 con sale (pbkdf2_sha256$<iterazioni>$<sale>$<hash>).
+-- Gli hash MD5 esistenti restano validi e sono sostituiti al primo login.
+
+ALTER TABLE `admin`
+  MODIFY `password` varchar(128) NOT NULL;
+
+ALTER TABLE `utenti`
+  MODIFY `password` varchar(128) NOT NULL;
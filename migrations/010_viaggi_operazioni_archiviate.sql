@@ -0,0 +1,7 @@
+-- I viaggi possono riferirsi a operazioni spostate nell'archivio su disco
+-- (`flask --app app archive-operations`): niente più chiavi esterne verso
+-- `operazioni` per idNoleggio e idRiconsegna (restano gli indici UNIQUE).
+
+ALTER TABLE `viaggi`
+  DROP FOREIGN KEY `viaggi_ibfk_5`,
+  DROP FOREIGN KEY `viaggi_ibfk_6`;
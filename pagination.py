@@ -0,0 +1,65 @@
+import base64
+import json
+
+# Limiti per la paginazione delle liste
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+# Numero di righe lette dal cursore lato server per ogni blocco in streaming
+STREAM_BATCH_SIZE = 500
+
+
+class PaginationError(ValueError):
+    """Parametri di paginazione non validi"""
+
+
+def encode_cursor(values):
+    """Codifica la chiave dell'ultima riga restituita in un cursore opaco"""
+    raw = json.dumps(list(values), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token, size):
+    """Decodifica un cursore prodotto da encode_cursor"""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise PaginationError("Cursore non valido")
+
+    if not isinstance(values, list) or len(values) != size:
+        raise PaginationError("Cursore non valido")
+    return values
+
+
+def parse_limit(value, default=DEFAULT_LIMIT):
+    """Legge il parametro limit dalla query string"""
+    if value is None:
+        return default
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise PaginationError("Parametro limit non valido")
+
+    if limit < 1:
+        raise PaginationError("Parametro limit non valido")
+    return min(limit, MAX_LIMIT)
+
+
+def stream_json_array(rows, envelope_key="data"):
+    """Genera un oggetto JSON {status, data: [...]} un elemento alla volta"""
+    yield '{"status":"success","%s":[' % envelope_key
+    first = True
+    for row in rows:
+        if first:
+            first = False
+            yield json.dumps(row)
+        else:
+            yield "," + json.dumps(row)
+    yield "]}"
+
+
+def stream_ndjson(rows):
+    """Genera una riga JSON per ogni elemento (application/x-ndjson)"""
+    for row in rows:
+        yield json.dumps(row) + "\n"
@@ -0,0 +1,243 @@
+"""Hash delle password fuori dal thread della richiesta.
+
+Le password sono derivate con PBKDF2-SHA256 con sale casuale e memorizzate
+come ``pbkdf2_sha256$<iterazioni>$<sale>$<hash>``: il costo (numero di
+iterazioni) è scritto nell'hash, quindi si può alzare senza invalidare
+quelli esistenti. Gli hash MD5 senza sale della versione precedente sono
+ancora verificati e vanno sostituiti al primo login riuscito
+(``needs_rehash``).
+
+Il calcolo è eseguito in un pool di ``PASSWORD_WORKERS`` processi: i
+worker Flask attendono il risultato senza occupare CPU e al massimo
+``PASSWORD_WORKERS`` hash sono calcolati insieme, qualunque sia il numero
+di login concorrenti. Con ``PASSWORD_WORKERS=0`` il calcolo avviene nel
+thread chiamante (test e script).
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# Iterazioni PBKDF2-SHA256 per i nuovi hash (raccomandazione OWASP 2023)
+DEFAULT_COST = 600000
+MIN_COST = 1000
+
+
+def _b64(data):
+    return base64.b64encode(data).decode("ascii").rstrip("=")
+
+
+def _unb64(text):
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+
+class Pbkdf2Hasher:
+    """PBKDF2-SHA256 con sale di 16 byte; ``cost`` è il numero di iterazioni"""
+
+    algorithm = "pbkdf2_sha256"
+
+    def __init__(self, cost=DEFAULT_COST):
+        if cost < MIN_COST:
+            raise ValueError(f"Il costo deve essere almeno {MIN_COST}")
+        self.cost = cost
+
+    def _derive(self, password, salt, cost):
+        return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, cost)
+
+    def hash(self, password):
+        salt = secrets.token_bytes(16)
+        digest = self._derive(password, salt, self.cost)
+        return f"{self.algorithm}${self.cost}${_b64(salt)}${_b64(digest)}"
+
+    def verify(self, stored_hash, password):
+        try:
+            _, cost, salt, digest = stored_hash.split("$")
+            cost, salt, digest = int(cost), _unb64(salt), _unb64(digest)
+        except ValueError:
+            return False
+        return hmac.compare_digest(self._derive(password, salt, cost), digest)
+
+    def needs_rehash(self, stored_hash):
+        return int(stored_hash.split("$")[1]) < self.cost
+
+
+class Md5Hasher:
+    """Hash MD5 senza sale della versione precedente: solo verifica"""
+
+    algorithm = "md5"
+
+    def hash(self, password):
+        raise ValueError("MD5 non è più usato per i nuovi hash")
+
+    def verify(self, stored_hash, password):
+        return hmac.compare_digest(stored_hash, hashlib.md5(password.encode()).hexdigest())
+
+    def needs_rehash(self, stored_hash):
+        return True
+
+
+def identify(stored_hash):
+    """Nome dell'algoritmo di un hash memorizzato"""
+    if "$" not in stored_hash:
+        return Md5Hasher.algorithm
+    return stored_hash.split("$", 1)[0]
+
+
+def _settings_from_env(environ=os.environ):
+    return {
+        "cost": int(environ.get("PASSWORD_COST", DEFAULT_COST)),
+        "workers": int(environ.get("PASSWORD_WORKERS", os.cpu_count() or 1)),
+    }
+
+
+_lock = threading.Lock()
+_hasher = None
+_hashers = {Md5Hasher.algorithm: Md5Hasher()}
+_workers = None
+_executor = None
+
+
+def configure(hasher=None, cost=None, workers=None):
+    """Imposta l'hasher dei nuovi hash (o il costo di PBKDF2) e i processi.
+
+    I valori non indicati restano quelli correnti o, la prima volta,
+    quelli di ``PASSWORD_COST`` e ``PASSWORD_WORKERS``. Un hasher diverso
+    da PBKDF2 deve avere ``algorithm``, ``hash``, ``verify`` e
+    ``needs_rehash`` ed essere serializzabile con pickle.
+    """
+    global _hasher, _workers, _executor
+
+    env = _settings_from_env()
+    with _lock:
+        if hasher is None and (cost is not None or _hasher is None):
+            hasher = Pbkdf2Hasher(cost or env["cost"])
+        if hasher is not None:
+            _hasher = hasher
+            _hashers[hasher.algorithm] = hasher
+        if workers is not None or _workers is None:
+            workers = env["workers"] if workers is None else workers
+            if workers < 0:
+                raise ValueError("PASSWORD_WORKERS non può essere negativo")
+            if workers != _workers and _executor is not None:
+                _executor.shutdown(wait=False)
+                _executor = None
+            _workers = workers
+
+
+def get_hasher():
+    """Hasher usato per i nuovi hash"""
+    if _hasher is None:
+        configure()
+    return _hasher
+
+
+def _hasher_for(stored_hash):
+    get_hasher()
+    hasher = _hashers.get(identify(stored_hash))
+    if hasher is None:
+        raise ValueError(f"Algoritmo di hash sconosciuto: {identify(stored_hash)}")
+    return hasher
+
+
+def _get_executor():
+    """Pool di processi, creato al primo hash; None se il calcolo è locale"""
+    global _executor
+
+    get_hasher()
+    if not _workers:
+        return None
+    executor = _executor
+    if executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ProcessPoolExecutor(max_workers=_workers)
+            executor = _executor
+    return executor
+
+
+def _reset_after_fork():
+    # I processi del pool appartengono al padre
+    global _executor
+    _executor = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _call(hasher, method, *args):
+    return getattr(hasher, method)(*args)
+
+
+def _run(hasher, method, *args):
+    executor = _get_executor()
+    if executor is None:
+        return _call(hasher, method, *args)
+    return executor.submit(_call, hasher, method, *args).result()
+
+
+async def _run_async(hasher, method, *args):
+    executor = _get_executor()
+    if executor is None:
+        return await asyncio.to_thread(_call, hasher, method, *args)
+    return await asyncio.wrap_future(executor.submit(_call, hasher, method, *args))
+
+
+def hash_password(password):
+    """Hash della password memorizzato nel database"""
+    hasher = get_hasher()
+    return _run(hasher, "hash", password)
+
+
+def verify_password(stored_hash, password):
+    """Verifica una password contro l'hash memorizzato"""
+    return _run(_hasher_for(stored_hash), "verify", stored_hash, password)
+
+
+async def hash_password_async(password):
+    """Come hash_password, senza bloccare il loop"""
+    return await _run_async(get_hasher(), "hash", password)
+
+
+async def verify_password_async(stored_hash, password):
+    """Come verify_password, senza bloccare il loop"""
+    return await _run_async(_hasher_for(stored_hash), "verify", stored_hash, password)
+
+
+# (hasher, hash) della password fittizia; ricalcolato se cambia l'hasher
+_dummy = None
+
+
+def dummy_hash():
+    """Hash di una password casuale, da verificare per le email sconosciute.
+
+    È calcolato con l'hasher e il costo correnti (``PASSWORD_COST``), così
+    un login con un'email non registrata dura quanto uno con la password
+    sbagliata e i tempi di risposta non rivelano le email.
+    """
+    global _dummy
+    hasher = get_hasher()
+    if _dummy is None or _dummy[0] is not hasher:
+        _dummy = (hasher, _run(hasher, "hash", secrets.token_hex(16)))
+    return _dummy[1]
+
+
+async def dummy_hash_async():
+    """Come dummy_hash, senza bloccare il loop"""
+    global _dummy
+    hasher = get_hasher()
+    if _dummy is None or _dummy[0] is not hasher:
+        _dummy = (hasher, await _run_async(hasher, "hash", secrets.token_hex(16)))
+    return _dummy[1]
+
+
+def needs_rehash(stored_hash):
+    """True se l'hash va ricalcolato con l'hasher e il costo correnti"""
+    hasher = get_hasher()
+    if identify(stored_hash) != hasher.algorithm:
+        return True
+    return hasher.needs_rehash(stored_hash)
@@ -0,0 +1,133 @@
+import json
+
+import sqlalchemy as sa
+
+from models import Bicicletta, Operazione, Stazione, Utente, Viaggio
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+def _not_none(value):
+    return value is not None
+
+
+class Projection:
+    """Percorso di sola lettura per le liste: colonne invece di istanze ORM.
+
+    Seleziona solo le colonne che compaiono in ``to_dict()`` del modello,
+    con le stesse chiavi, e produce direttamente dizionari (o JSON) dalle
+    tuple del risultato: niente identity map, strumentazione degli
+    attributi o oggetti intermedi. ``converters`` associa a una chiave la
+    funzione che ne adatta il valore, come fa ``to_dict()``.
+    """
+
+    def __init__(self, columns, converters=None):
+        self.columns = [column.label(key) for key, column in columns]
+        self.keys = tuple(key for key, _ in columns)
+        self._converters = [
+            (self.keys.index(key), function) for key, function in (converters or {}).items()
+        ]
+
+    def select(self):
+        """SELECT delle colonne proiettate, da completare con where/order_by"""
+        return sa.select(*self.columns)
+
+    def dicts(self, rows):
+        """Converte un iterabile di tuple (nell'ordine di keys) in dizionari"""
+        keys = self.keys
+        if not self._converters:
+            for row in rows:
+                yield dict(zip(keys, row))
+            return
+        for row in rows:
+            row = list(row)
+            for i, function in self._converters:
+                row[i] = function(row[i])
+            yield dict(zip(keys, row))
+
+    def all(self, session, query):
+        """Esegue query (costruita da select()) e restituisce la lista di dizionari"""
+        return list(self.dicts(session.execute(query)))
+
+    def json(self, session, query):
+        """Come all(), ma già codificato in JSON (bytes)"""
+        return json.dumps(self.all(session, query)).encode()
+
+
+BICICLETTA = Projection(
+    [
+        ("ID", Bicicletta.ID),
+        ("codiceTag", Bicicletta.codiceTag),
+        ("latitudine", Bicicletta.latitudine),
+        ("longitudine", Bicicletta.longitudine),
+        ("distanzaPercorsa", Bicicletta.distanzaPercorsa),
+        ("gps", Bicicletta.gps),
+        ("noleggiata", Bicicletta.idUtenteNoleggio),
+    ],
+    converters={"noleggiata": _not_none},
+)
+
+STAZIONE = Projection(
+    [
+        ("ID", Stazione.ID),
+        ("numSlot", Stazione.numSlot),
+        ("numBiciclette", Stazione.numBiciclette),
+        ("via", Stazione.via),
+        ("città", Stazione.città),
+        ("provincia", Stazione.provincia),
+        ("regione", Stazione.regione),
+        ("latitudine", Stazione.latitudine),
+        ("longitudine", Stazione.longitudine),
+    ]
+)
+
+UTENTE = Projection(
+    [
+        ("id", Utente.id),
+        ("nome", Utente.nome),
+        ("cognome", Utente.cognome),
+        ("email", Utente.email),
+        ("numTelefono", Utente.numTelefono),
+        ("cartaCredito", Utente.cartaCredito),
+        ("smartCard", Utente.smartCard),
+        ("via", Utente.via),
+        ("città", Utente.città),
+        ("provincia", Utente.provincia),
+        ("regione", Utente.regione),
+    ]
+)
+
+OPERAZIONE = Projection(
+    [
+        ("ID", Operazione.ID),
+        ("tipo", Operazione.tipo),
+        ("data", Operazione.data),
+        ("ora", Operazione.ora),
+        ("distanzaPercorsa", Operazione.distanzaPercorsa),
+        ("idUtente", Operazione.idUtente),
+        ("idBicicletta", Operazione.idBicicletta),
+        ("idStazione", Operazione.idStazione),
+        ("tariffa", Operazione.tariffa),
+    ],
+    converters={"data": _isoformat, "ora": _isoformat},
+)
+
+VIAGGIO = Projection(
+    [
+        ("ID", Viaggio.ID),
+        ("stato", Viaggio.stato),
+        ("idBicicletta", Viaggio.idBicicletta),
+        ("idUtente", Viaggio.idUtente),
+        ("idStazionePartenza", Viaggio.idStazionePartenza),
+        ("idStazioneArrivo", Viaggio.idStazioneArrivo),
+        ("idNoleggio", Viaggio.idNoleggio),
+        ("idRiconsegna", Viaggio.idRiconsegna),
+        ("inizio", Viaggio.inizio),
+        ("fine", Viaggio.fine),
+        ("durata", Viaggio.durata),
+        ("distanzaPercorsa", Viaggio.distanzaPercorsa),
+    ],
+    converters={"inizio": _isoformat, "fine": _isoformat},
+)
@@ -0,0 +1,148 @@
+import numpy as np
+
+from geo import haversine_np, valid_coordinates
+
+PRELIEVO = "prelievo"
+CONSEGNA = "consegna"
+
+# Quota di slot occupati considerata equilibrata
+DEFAULT_TARGET = 0.5
+
+# Limiti dei parametri della richiesta
+MAX_FURGONI = 50
+MAX_CAPACITA = 200
+
+# Km aggiunti alla distanza nel punteggio delle fermate: a parità di
+# biciclette spostate vince la più vicina, ma una fermata a pochi metri
+# con una sola bicicletta non batte sempre una poco più lontana con dieci
+_SMORZAMENTO_KM = 0.5
+
+
+def parse_plan_args(args):
+    """Legge furgoni, capacita, target e il deposito opzionale (lat, lon)"""
+    try:
+        furgoni = int(args.get("furgoni", 3))
+        capacita = int(args.get("capacita", 20))
+        target = float(args.get("target", DEFAULT_TARGET))
+        deposito = None
+        if "lat" in args or "lon" in args:
+            deposito = (float(args["lat"]), float(args["lon"]))
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("Parametri furgoni/capacita/target/lat/lon non validi")
+
+    if (
+        not 1 <= furgoni <= MAX_FURGONI
+        or not 1 <= capacita <= MAX_CAPACITA
+        or not 0 <= target <= 1
+        or (deposito is not None and not valid_coordinates(*deposito))
+    ):
+        raise ValueError("Parametri furgoni/capacita/target/lat/lon non validi")
+    return furgoni, capacita, target, deposito
+
+
+def imbalance(num_biciclette, num_slot, target=DEFAULT_TARGET):
+    """Saldo di ogni stazione rispetto all'obiettivo round(numSlot * target).
+
+    Positivo: biciclette in eccesso da prelevare; negativo: biciclette
+    mancanti da consegnare.
+    """
+    obiettivo = np.rint(np.asarray(num_slot) * target).astype(np.int64)
+    return np.asarray(num_biciclette, dtype=np.int64) - obiettivo
+
+
+def distance_matrix(lat, lon):
+    """Matrice n x n delle distanze in km, in un'unica passata vettoriale"""
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    return haversine_np(lat[:, None], lon[:, None], lat[None, :], lon[None, :])
+
+
+def _semi(dist, saldo, k):
+    """Stazioni di partenza dei furgoni senza deposito: la più in eccesso e
+    poi, a turno, quella in eccesso più lontana dalle già scelte"""
+    eccesso = np.flatnonzero(saldo > 0)
+    if len(eccesso) == 0:
+        return []
+    semi = [int(eccesso[np.argmax(saldo[eccesso])])]
+    vicinanza = dist[semi[0], eccesso].copy()
+    while len(semi) < min(k, len(eccesso)):
+        scelta = int(eccesso[np.argmax(vicinanza)])
+        semi.append(scelta)
+        vicinanza = np.minimum(vicinanza, dist[scelta, eccesso])
+    return semi
+
+
+def plan_routes(lat, lon, saldo, furgoni, capacita, deposito=None):
+    """Giri di prelievo e consegna per ``furgoni`` furgoni da ``capacita`` posti.
+
+    Euristica golosa: a ogni passo il furgone con il giro più corto sceglie
+    la fermata con il miglior rapporto biciclette spostate / distanza tra
+    le stazioni in eccesso (se ha posto) e quelle in difetto (se è carico).
+    I prelievi sono limitati al difetto ancora da coprire, quindi ogni
+    bicicletta caricata viene consegnata. Ogni passo è una riduzione
+    vettoriale su una riga della matrice delle distanze.
+
+    ``deposito`` è (lat, lon) da cui partono tutti i furgoni; senza, ogni
+    furgone parte da una stazione in eccesso diversa. Restituisce una lista
+    (per furgone) di (km, fermate), con fermate (indice, azione, biciclette).
+    """
+    # Solo le stazioni da visitare entrano nella matrice delle distanze
+    saldo = np.asarray(saldo, dtype=np.int64)
+    indici = np.flatnonzero(saldo != 0)
+    saldo = saldo[indici]
+    lat = np.asarray(lat, dtype=np.float64)[indici]
+    lon = np.asarray(lon, dtype=np.float64)[indici]
+    n = len(saldo)
+    dist = distance_matrix(lat, lon)
+
+    if deposito is not None:
+        partenza = haversine_np(deposito[0], deposito[1], lat, lon)
+        posizioni = [None] * furgoni
+    else:
+        posizioni = _semi(dist, saldo, furgoni)
+        furgoni = len(posizioni)
+
+    carichi = [0] * furgoni
+    km = [0.0] * furgoni
+    fermate = [[] for _ in range(furgoni)]
+    attivi = set(range(furgoni))
+    da_coprire = int(-saldo[saldo < 0].sum())
+
+    while attivi:
+        f = min(attivi, key=lambda i: (km[i], i))
+        distanze = partenza if posizioni[f] is None else dist[posizioni[f]]
+        carico = carichi[f]
+
+        # Quante biciclette si spostano fermandosi in ogni stazione
+        prelevabili = min(capacita - carico, da_coprire - sum(carichi))
+        quantita = np.zeros(n, dtype=np.int64)
+        if prelevabili > 0:
+            quantita = np.where(saldo > 0, np.minimum(saldo, prelevabili), 0)
+        if carico > 0:
+            quantita = np.where(saldo < 0, np.minimum(-saldo, carico), quantita)
+
+        if not quantita.any():
+            attivi.discard(f)
+            continue
+
+        punteggio = quantita / (distanze + _SMORZAMENTO_KM)
+        punteggio[quantita == 0] = -1.0
+        s = int(np.argmax(punteggio))
+        q = int(quantita[s])
+
+        if saldo[s] > 0:
+            saldo[s] -= q
+            carichi[f] += q
+            fermate[f].append((s, PRELIEVO, q))
+        else:
+            saldo[s] += q
+            carichi[f] -= q
+            da_coprire -= q
+            fermate[f].append((s, CONSEGNA, q))
+        km[f] += float(distanze[s])
+        posizioni[f] = s
+
+    return [
+        (distanza, [(int(indici[s]), azione, q) for s, azione, q in giro])
+        for distanza, giro in zip(km, fermate)
+    ]
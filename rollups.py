@@ -0,0 +1,148 @@
+from datetime import date
+
+import numpy as np
+import sqlalchemy as sa
+
+from archive import MICROSECONDI_ORA, TIPI, archivio
+from models import DomandaOraria, Operazione
+
+# Operazioni lette per volta durante la ricostruzione completa
+DEFAULT_CHUNK = 50000
+
+# Chiave di un bucket in un int64: stazione | ore dall'epoch | tipo
+_BIT_TIPO = 1
+_BIT_ORA = 22  # ~478 anni di ore
+_EPOCH = date(1970, 1, 1)
+
+
+def bucket_keys(stazione, giorno, ora, tipo):
+    """Codifica (stazione, giorno, ora, tipo) in chiavi int64 ordinabili.
+
+    ``giorno`` è un array datetime64[D], ``ora`` l'ora del giorno (0-23) e
+    ``tipo`` 0 per noleggio e 1 per riconsegna.
+    """
+    ore = giorno.astype("datetime64[D]").astype(np.int64) * 24 + ora.astype(np.int64)
+    return (
+        (stazione.astype(np.int64) << (_BIT_ORA + _BIT_TIPO))
+        | (ore << _BIT_TIPO)
+        | tipo.astype(np.int64)
+    )
+
+
+def decode_keys(keys):
+    """Inverso di bucket_keys: (stazione, giorno datetime64[D], ora, tipo)"""
+    tipo = keys & ((1 << _BIT_TIPO) - 1)
+    ore = (keys >> _BIT_TIPO) & ((1 << _BIT_ORA) - 1)
+    stazione = keys >> (_BIT_ORA + _BIT_TIPO)
+    giorno = (ore // 24).astype("datetime64[D]")
+    return stazione, giorno, ore % 24, tipo
+
+
+def aggregate(keys, counts=None):
+    """Somma i conteggi per chiave; senza ``counts`` ogni chiave vale 1"""
+    if counts is None:
+        return np.unique(keys, return_counts=True)
+    unique, inverse = np.unique(keys, return_inverse=True)
+    return unique, np.bincount(inverse, weights=counts, minlength=len(unique)).astype(np.int64)
+
+
+def _chunk_keys(rows):
+    n = len(rows)
+    return bucket_keys(
+        np.fromiter((r.idStazione for r in rows), dtype=np.int64, count=n),
+        np.array([r.data for r in rows], dtype="datetime64[D]"),
+        np.fromiter((r.ora.hour for r in rows), dtype=np.int64, count=n),
+        np.fromiter((TIPI.index(r.tipo) for r in rows), dtype=np.int64, count=n),
+    )
+
+
+def build_rollups(session, chunk=DEFAULT_CHUNK):
+    """Ricalcola da zero i contatori orari dall'intero log delle operazioni.
+
+    Le operazioni sono lette a blocchi di ``chunk`` righe, dalla tabella e
+    dai segmenti dell'archivio, e ogni blocco è ridotto subito a (chiave,
+    conteggio) con NumPy: la memoria dipende dal numero di bucket, non
+    dalla lunghezza del log. Non esegue il commit: è compito del chiamante.
+    """
+    chiavi = np.empty(0, dtype=np.int64)
+    conteggi = np.empty(0, dtype=np.int64)
+    operazioni = 0
+
+    def somma(blocco):
+        nonlocal chiavi, conteggi
+        parziali, n = aggregate(blocco)
+        chiavi, conteggi = aggregate(
+            np.concatenate([chiavi, parziali]), np.concatenate([conteggi, n])
+        )
+
+    segmenti = archivio.segments()
+    for segmento in segmenti:
+        for inizio in range(0, len(segmento), chunk):
+            fine = inizio + chunk
+            somma(bucket_keys(
+                segmento["idStazione"][inizio:fine],
+                segmento["giorno"][inizio:fine].astype("datetime64[D]"),
+                segmento["ora"][inizio:fine] // MICROSECONDI_ORA,
+                segmento["tipo"][inizio:fine],
+            ))
+        operazioni += len(segmento)
+
+    result = session.execute(
+        sa.select(Operazione.idStazione, Operazione.tipo, Operazione.data, Operazione.ora)
+        .where(Operazione.ID > (segmenti[-1].ultimo if segmenti else 0))
+        .execution_options(yield_per=chunk)
+    )
+    for rows in result.partitions():
+        operazioni += len(rows)
+        somma(_chunk_keys(rows))
+
+    stazione, giorno, ora, tipo = decode_keys(chiavi)
+    righe = [
+        {
+            "idStazione": s,
+            "giorno": g,
+            "ora": o,
+            "tipo": TIPI[t],
+            "conteggio": c,
+        }
+        for s, g, o, t, c in zip(
+            stazione.tolist(), giorno.tolist(), ora.tolist(), tipo.tolist(), conteggi.tolist()
+        )
+    ]
+
+    session.execute(sa.delete(DomandaOraria))
+    if righe:
+        session.connection().execute(sa.insert(DomandaOraria.__table__), righe)
+    return {"operazioni": operazioni, "bucket": len(righe)}
+
+
+def record_operation(session, operazione):
+    """Incrementa il bucket di un'operazione appena inserita.
+
+    Va chiamata nella transazione dell'operazione, dopo l'UPDATE della
+    stazione: il lock sulla riga della stazione serializza già gli
+    aggiornamenti dei suoi bucket, quindi UPDATE e poi INSERT non corrono
+    con altre transazioni.
+    """
+    chiave = (
+        DomandaOraria.idStazione == operazione.idStazione,
+        DomandaOraria.giorno == operazione.data,
+        DomandaOraria.ora == operazione.ora.hour,
+        DomandaOraria.tipo == operazione.tipo,
+    )
+    aggiornate = session.execute(
+        sa.update(DomandaOraria)
+        .where(*chiave)
+        .values(conteggio=DomandaOraria.conteggio + 1)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not aggiornate:
+        session.execute(
+            sa.insert(DomandaOraria).values(
+                idStazione=operazione.idStazione,
+                giorno=operazione.data,
+                ora=operazione.ora.hour,
+                tipo=operazione.tipo,
+                conteggio=1,
+            )
+        )
@@ -1,32 +1,439 @@
-from models import Session, Bicicletta, Operazione, Stazione, Utente
+from datetime import date
+
+import sqlalchemy as sa
+from sqlalchemy.exc import OperationalError
+
+import cache
+from archive import archive_operations, archivio
+from availability import AvailabilityFeed
+from leaderboard import LazyLeaderboard
+from models import Session, session_scope, OPERAZIONE_DETTAGLI, Admin, Bicicletta, DomandaOraria, Operazione, Stazione, Utente, Viaggio
+from passwords import dummy_hash, hash_password, needs_rehash, verify_password
+from pagination import decode_cursor, encode_cursor, parse_limit
+from projection import OPERAZIONE, VIAGGIO
+from rebalancing import CONSEGNA, imbalance, plan_routes
+from rollups import build_rollups, record_operation
+from spatial import LazyIndex
+from tags import TagAllocator
+from telemetry import apply_fixes, parse_fixes
+from trips import build_trips
+from writebuffer import write_buffer
+
+
+def _parse_data(value, nome):
+    """Legge una data ISO (YYYY-MM-DD) dai parametri di un filtro"""
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Parametro {nome} non valido")
+
+
+def _load_stazioni_coords():
+    """Coordinate di tutte le stazioni per costruire l'indice spaziale"""
+    with session_scope() as session:
+        return session.execute(
+            sa.select(Stazione.ID, Stazione.latitudine, Stazione.longitudine)
+        ).all()
+
+
+def _load_biciclette_disponibili():
+    """Coordinate delle biciclette localizzate e non noleggiate"""
+    with session_scope() as session:
+        return session.execute(
+            sa.select(Bicicletta.ID, Bicicletta.latitudine, Bicicletta.longitudine)
+            .where(Bicicletta.idUtenteNoleggio.is_(None))
+            .where(sa.not_(sa.and_(Bicicletta.latitudine == 0, Bicicletta.longitudine == 0)))
+        ).all()
+
+
+def _load_distanze():
+    """Distanza percorsa da ogni bicicletta, letta dall'indice su distanzaPercorsa"""
+    with session_scope() as session:
+        return session.execute(
+            sa.select(Bicicletta.ID, Bicicletta.distanzaPercorsa)
+            .order_by(Bicicletta.distanzaPercorsa, Bicicletta.ID)
+        ).all()
+
+
+def _load_disponibilita():
+    """Biciclette e slot di ogni stazione per il feed di disponibilità"""
+    # Sessione propria: il feed è aggiornato anche dentro gli stream SSE,
+    # che non devono tenere occupata la sessione della richiesta
+    with Session() as session:
+        return session.execute(
+            sa.select(Stazione.ID, Stazione.numBiciclette, Stazione.numSlot)
+        ).all()
+
+
+# Indice spaziale delle stazioni, tenuto allineato da create/delete_stazione
+stazioni_index = cache.register(LazyIndex(_load_stazioni_coords))
+
+# Indice spaziale delle biciclette disponibili (localizzate e non noleggiate)
+biciclette_index = cache.register(LazyIndex(_load_biciclette_disponibili, max_age=60))
+
+# Classifica della flotta per chilometri: la aggiornano la telemetria e le
+# riconsegne (UPDATE senza ORM) e _raccogli_distanze (oggetti Bicicletta)
+classifica_distanze = cache.register(LazyLeaderboard(_load_distanze))
+
+
+@sa.event.listens_for(sa.orm.Session, "after_flush")
+def _raccogli_distanze(session, flush_context):
+    """Annota le biciclette la cui distanza è cambiata tramite l'ORM.
+
+    Copre add_distance, update_position e le biciclette nuove in qualunque
+    sessione; la classifica è aggiornata solo dopo il COMMIT.
+    """
+    for obj in (*session.new, *session.dirty):
+        if isinstance(obj, Bicicletta) and sa.inspect(obj).attrs.distanzaPercorsa.history.has_changes():
+            session.info.setdefault("distanze", {})[obj.ID] = obj.distanzaPercorsa
+
+
+@sa.event.listens_for(sa.orm.Session, "after_commit")
+def _pubblica_distanze(session):
+    for bici_id, distanza in session.info.pop("distanze", {}).items():
+        classifica_distanze.set(bici_id, distanza)
+
+
+@sa.event.listens_for(sa.orm.Session, "after_rollback")
+def _scarta_distanze(session):
+    session.info.pop("distanze", None)
+
+# Lista stazioni già codificata per GET /api/stazioni; invalidata da ogni
+# modifica alle stazioni (anche numBiciclette per noleggi e riconsegne)
+stazioni_response = cache.register(cache.CachedResponse(max_age=30))
+
+# Disponibilità delle stazioni pubblicata su /api/stazioni/stream
+disponibilita = cache.register(AvailabilityFeed(_load_disponibilita))
+
+# Credenziali per email: tupla di (ruolo, id, hash), solo per le email
+# esistenti. Niente profilo (dati personali e carta di credito) e niente
+# esiti negativi: un'email registrata dopo un login fallito funziona
+# subito, anche negli altri processi. Invalidata da registrazione e
+# modifica delle credenziali.
+credenziali_cache = cache.register(cache.LRUCache(maxsize=10000, ttl=60))
+
+# Biciclette creabili con una singola richiesta di provisioning
+MAX_BULK_BICICLETTE = 10000
+
+# Errore di MySQL per la transazione annullata in un deadlock e tentativi
+# di noleggi e riconsegne prima di restituire l'errore
+_ER_LOCK_DEADLOCK = 1213
+_TENTATIVI_DEADLOCK = 3
+
+# Blocchi di ricerca dei codici già presenti (limite di parametri per query)
+_BLOCCO_IN = 1000
+
+
+def _tag_esistenti(codici):
+    """codiceTag già assegnati, tra quelli indicati"""
+    usati = set()
+    with session_scope() as session:
+        for i in range(0, len(codici), _BLOCCO_IN):
+            usati.update(session.scalars(
+                sa.select(Bicicletta.codiceTag)
+                .where(Bicicletta.codiceTag.in_(codici[i:i + _BLOCCO_IN]))
+            ))
+    return usati
+
+
+# Codici delle nuove biciclette; i codiceTag casuali assegnati prima del
+# contatore sono scartati
+tag_allocator = cache.register(
+    TagAllocator("codiceTag", 25214903917, 1013904223, esistenti=_tag_esistenti)
+)
+gps_allocator = cache.register(TagAllocator("gps", 48271144813, 2147483647))
+
+_CAMPI_PROFILO = (
+    "nome",
+    "cognome",
+    "numTelefono",
+    "cartaCredito",
+    "smartCard",
+    "via",
+    "città",
+    "provincia",
+    "regione",
+)
+
+
+def _credenziali_query(email):
+    """Admin e utenti con questa email in un'unica query indicizzata"""
+    admin = sa.select(
+        sa.literal("admin").label("ruolo"),
+        Admin.ID.label("id"),
+        Admin.password.label("password"),
+    ).where(Admin.email == email)
+    utente = sa.select(
+        sa.literal("user").label("ruolo"),
+        Utente.id.label("id"),
+        Utente.password.label("password"),
+    ).where(Utente.email == email)
+    return sa.union_all(admin, utente)
+
+
+def _load_credenziali(email):
+    """Candidati (ruolo, id, hash) per il login, admin prima degli utenti"""
+    with session_scope() as session:
+        candidati = [tuple(row) for row in session.execute(_credenziali_query(email))]
+    candidati.sort(key=lambda c: c[0] != "admin")
+    return tuple(candidati)
+
+
+def _load_profilo(ruolo, user_id):
+    """Dati restituiti dal login riuscito, None se l'account non esiste più"""
+    with session_scope() as session:
+        if ruolo == "admin":
+            row = session.execute(
+                sa.select(Admin.ID, Admin.email).where(Admin.ID == user_id)
+            ).mappings().first()
+            return dict(row) if row is not None else None
+        row = session.execute(
+            sa.select(Utente.id, Utente.email, *[getattr(Utente, campo) for campo in _CAMPI_PROFILO])
+            .where(Utente.id == user_id)
+        ).mappings().first()
+        return dict(row) if row is not None else None
+
+
+def _disponibilita_stazione(session, station_id):
+    """numBiciclette e numSlot dopo l'UPDATE condizionale (riga già bloccata)"""
+    return session.execute(
+        sa.select(Stazione.numBiciclette, Stazione.numSlot).where(Stazione.ID == station_id)
+    ).one()
+
+
+def _noleggio(session, tx, user_id, bike_id, station_id, tariffa):
+    """Lavoro di scrittura di un noleggio (vedi writebuffer).
+
+    Lo stato cambia solo tramite UPDATE condizionali: la bicicletta passa a
+    noleggiata solo se era libera e la stazione perde una bicicletta solo
+    se ne aveva almeno una. Le righe sono bloccate sempre nell'ordine
+    bicicletta -> stazione -> INSERT dell'operazione. La stazione va
+    aggiornata prima dell'INSERT: su InnoDB la chiave esterna
+    dell'operazione prende un lock condiviso sulla riga della stazione, e
+    due noleggi concorrenti che lo tengono entrambi prima dell'UPDATE
+    andrebbero in deadlock promuovendolo a esclusivo. Restituisce il
+    dizionario d'errore oppure (operazione, disponibilità della stazione).
+    """
+    if not session.get(Utente, user_id):
+        return {"status": "error", "message": "Utente non trovato", "code": 404}
+
+    presa = session.execute(
+        sa.update(Bicicletta)
+        .where(Bicicletta.ID == bike_id, Bicicletta.idUtenteNoleggio.is_(None))
+        .values(idUtenteNoleggio=user_id)
+        .execution_options(synchronize_session=False)
+    )
+    if presa.rowcount != 1:
+        tx.rollback()
+        if not session.get(Bicicletta, bike_id):
+            return {"status": "error", "message": "Bicicletta non trovata", "code": 404}
+        return {"status": "error", "message": "Bicicletta già noleggiata", "code": 409}
+
+    prelievo = session.execute(
+        sa.update(Stazione)
+        .where(Stazione.ID == station_id, Stazione.numBiciclette > 0)
+        .values(numBiciclette=Stazione.numBiciclette - 1)
+        .execution_options(synchronize_session=False)
+    )
+    if prelievo.rowcount != 1:
+        tx.rollback()
+        if not session.get(Stazione, station_id):
+            return {"status": "error", "message": "Stazione non trovata", "code": 404}
+        return {"status": "error", "message": "Nessuna bicicletta disponibile nella stazione", "code": 409}
+
+    operazione = Operazione(
+        tipo="noleggio",
+        idUtente=user_id,
+        idBicicletta=bike_id,
+        idStazione=station_id,
+        tariffa=tariffa,
+    )
+    session.add(operazione)
+    session.flush()
+
+    record_operation(session, operazione)
+    stazione = _disponibilita_stazione(session, station_id)
+    dati = operazione.to_dict()
+    tx.commit()
+    return dati, stazione
+
+
+def _riconsegna(session, tx, user_id, bike_id, station_id, distanzaPercorsa, tariffa):
+    """Lavoro di scrittura di una riconsegna, speculare a _noleggio.
+
+    La bicicletta torna libera solo se era a noleggio proprio a questo
+    utente e la stazione accetta la bicicletta solo se ha uno slot libero;
+    stesso ordine dei lock di _noleggio. La distanza del viaggio si somma a
+    quella della bicicletta. Restituisce il dizionario d'errore oppure
+    (operazione, disponibilità della stazione, posizione e distanza della
+    bicicletta).
+    """
+    rilascio = session.execute(
+        sa.update(Bicicletta)
+        .where(Bicicletta.ID == bike_id, Bicicletta.idUtenteNoleggio == user_id)
+        .values(
+            idUtenteNoleggio=None,
+            distanzaPercorsa=Bicicletta.distanzaPercorsa + distanzaPercorsa,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    if rilascio.rowcount != 1:
+        tx.rollback()
+        if not session.get(Bicicletta, bike_id):
+            return {"status": "error", "message": "Bicicletta non trovata", "code": 404}
+        return {"status": "error", "message": "Bicicletta non noleggiata da questo utente", "code": 409}
+
+    posizione = session.execute(
+        sa.select(Bicicletta.latitudine, Bicicletta.longitudine, Bicicletta.distanzaPercorsa)
+        .where(Bicicletta.ID == bike_id)
+    ).one()
+
+    deposito = session.execute(
+        sa.update(Stazione)
+        .where(Stazione.ID == station_id, Stazione.numBiciclette < Stazione.numSlot)
+        .values(numBiciclette=Stazione.numBiciclette + 1)
+        .execution_options(synchronize_session=False)
+    )
+    if deposito.rowcount != 1:
+        tx.rollback()
+        if not session.get(Stazione, station_id):
+            return {"status": "error", "message": "Stazione non trovata", "code": 404}
+        return {"status": "error", "message": "Nessuno slot libero nella stazione", "code": 409}
+
+    operazione = Operazione(
+        tipo="riconsegna",
+        idUtente=user_id,
+        idBicicletta=bike_id,
+        idStazione=station_id,
+        distanzaPercorsa=distanzaPercorsa,
+        tariffa=tariffa,
+    )
+    session.add(operazione)
+    session.flush()
+
+    record_operation(session, operazione)
+    stazione = _disponibilita_stazione(session, station_id)
+    dati = operazione.to_dict()
+    tx.commit()
+    return dati, stazione, posizione
+
+
+def _con_retry_deadlock(lavoro, *args):
+    """Esegue il lavoro con write_buffer.run, ripetendolo sui deadlock.
+
+    MySQL annulla per intero la transazione scelta come vittima (errore
+    1213), quindi il lavoro può essere rieseguito da capo.
+    """
+    for tentativo in range(_TENTATIVI_DEADLOCK):
+        try:
+            return write_buffer.run(lavoro, *args)
+        except OperationalError as e:
+            codice = e.orig.args[0] if e.orig is not None and e.orig.args else None
+            if codice != _ER_LOCK_DEADLOCK or tentativo == _TENTATIVI_DEADLOCK - 1:
+                raise
+
+
+def _telemetria(session, tx, bike, lat, lon, ts):
+    """Lavoro di scrittura di un batch di fix GPS (vedi apply_fixes)"""
+    riepilogo = apply_fixes(session, bike, lat, lon, ts)
+    tx.commit()
+    return riepilogo
+
+
+def _aggiungi_dettagli(session, operazioni):
+    """Bicicletta e stazione per operazioni archiviate, con una query ciascuna"""
+    biciclette = {
+        b.ID: b.to_dict()
+        for b in session.scalars(
+            sa.select(Bicicletta).where(Bicicletta.ID.in_({o["idBicicletta"] for o in operazioni}))
+        )
+    }
+    stazioni = {
+        s.ID: s.to_dict()
+        for s in session.scalars(
+            sa.select(Stazione).where(Stazione.ID.in_({o["idStazione"] for o in operazioni}))
+        )
+    }
+    for operazione in operazioni:
+        operazione["bicicletta"] = biciclette.get(operazione["idBicicletta"])
+        operazione["stazione"] = stazioni.get(operazione["idStazione"])
 
 
 class BikeRentalService:
     """Servizio per gestire le operazioni di noleggio e riconsegna"""
 
     @staticmethod
-    def get_user_operations(user_id):
-        """Ottieni tutte le operazioni di un utente"""
+    def get_user_operations(user_id, limit=None, cursor=None, dal=None, al=None, dettagli=False):
+        """Ottieni le operazioni di un utente, dalla più recente.
+
+        Senza ``limit`` né ``cursor`` restituisce l'intero storico. Con
+        ``limit`` restituisce una pagina keyset sull'indice (idUtente, ID)
+        e ``next_cursor`` per la successiva; ``dal`` e ``al`` (date ISO,
+        estremi inclusi) filtrano per data dell'operazione. Con
+        ``dettagli`` ogni operazione include bicicletta e stazione. Le
+        operazioni archiviate (archive.py) seguono quelle della tabella,
+        che hanno tutte ID maggiori: la tabella è letta solo oltre
+        l'ultimo ID archiviato e l'archivio solo se la pagina non è piena.
+        Un utente inesistente dà un errore con ``code`` 404; l'esistenza
+        è verificata solo quando la pagina è vuota.
+        """
         try:
-            with Session() as session:
-                operazioni = (
-                    session.query(Operazione)
-                    .filter_by(idUtente=user_id)
-                    .order_by(Operazione.ID.desc())
-                    .all()
-                )
-                return {
-                    "status": "success",
-                    "data": [op.to_dict() for op in operazioni],
-                }
+            query = OPERAZIONE.select() if not dettagli else sa.select(Operazione).options(*OPERAZIONE_DETTAGLI)
+            query = query.where(Operazione.idUtente == user_id).order_by(Operazione.ID.desc())
+            if dal is not None:
+                dal = _parse_data(dal, "dal")
+                query = query.where(Operazione.data >= dal)
+            if al is not None:
+                al = _parse_data(al, "al")
+                query = query.where(Operazione.data <= al)
+
+            archiviate = archivio.archived_until()
+            if archiviate:
+                query = query.where(Operazione.ID > archiviate)
+
+            paginata = limit is not None or cursor is not None
+            ultimo_id = None
+            if paginata:
+                limit = parse_limit(limit)
+                if cursor:
+                    (ultimo_id,) = decode_cursor(cursor, 1)
+                    query = query.where(Operazione.ID < ultimo_id)
+                query = query.limit(limit + 1)
+
+            with session_scope() as session:
+                if dettagli:
+                    operazioni = [o.to_dict(dettagli=True) for o in session.scalars(query)]
+                else:
+                    operazioni = OPERAZIONE.all(session, query)
+
+                mancanti = limit + 1 - len(operazioni) if paginata else None
+                if archiviate and (mancanti is None or mancanti > 0):
+                    vecchie = archivio.user_operations(
+                        user_id, before=ultimo_id, dal=dal, al=al, limit=mancanti
+                    )
+                    if dettagli and vecchie:
+                        _aggiungi_dettagli(session, vecchie)
+                    operazioni += vecchie
+
+                if not operazioni and not session.get(Utente, user_id):
+                    return {"status": "error", "message": "Utente non trovato", "code": 404}
+
+            result = {"status": "success", "data": operazioni}
+            if paginata:
+                next_cursor = None
+                if len(operazioni) > limit:
+                    result["data"] = operazioni[:limit]
+                    next_cursor = encode_cursor([operazioni[limit - 1]["ID"]])
+                result["next_cursor"] = next_cursor
+            return result
         except Exception as e:
-            return {"status": "error", "message": str(e)}
+            return {"status": "error", "message": str(e), "code": 400}
 
     @staticmethod
     def get_bike_status(bike_id):
         """Ottieni lo stato di una bicicletta"""
         try:
-            with Session() as session:
+            with session_scope() as session:
                 bicicletta = session.query(Bicicletta).filter_by(ID=bike_id).first()
                 if not bicicletta:
                     return {"status": "error", "message": "Bicicletta non trovata"}
@@ -36,6 +443,88 @@ class BikeRentalService:
             return {"status": "error", "message": str(e)}
 
 
+    @staticmethod
+    def rent_bike(user_id, bike_id, station_id, tariffa=None):
+        """Noleggia una bicicletta da una stazione (vedi _noleggio)"""
+        try:
+            esito = _con_retry_deadlock(_noleggio, user_id, bike_id, station_id, tariffa)
+        except Exception as e:
+            return {"status": "error", "message": str(e), "code": 500}
+        if isinstance(esito, dict):
+            return esito
+
+        operazione, stazione = esito
+        biciclette_index.remove(bike_id)
+        stazioni_response.invalidate()
+        disponibilita.update(
+            station_id, stazione.numBiciclette, stazione.numSlot, versione=operazione["ID"]
+        )
+
+        return {
+            "status": "success",
+            "message": "Noleggio avvenuto con successo",
+            "data": operazione,
+        }
+
+    @staticmethod
+    def return_bike(user_id, bike_id, station_id, distanzaPercorsa=0, tariffa=None):
+        """Riconsegna una bicicletta a una stazione (vedi _riconsegna)"""
+        try:
+            distanzaPercorsa = float(distanzaPercorsa or 0)
+        except (TypeError, ValueError):
+            distanzaPercorsa = -1.0
+        if not 0 <= distanzaPercorsa < float("inf"):
+            return {"status": "error", "message": "distanzaPercorsa non valida", "code": 400}
+
+        try:
+            esito = _con_retry_deadlock(
+                _riconsegna, user_id, bike_id, station_id, distanzaPercorsa, tariffa
+            )
+        except Exception as e:
+            return {"status": "error", "message": str(e), "code": 500}
+        if isinstance(esito, dict):
+            return esito
+
+        operazione, stazione, posizione = esito
+        classifica_distanze.set(bike_id, posizione.distanzaPercorsa)
+        stazioni_response.invalidate()
+        disponibilita.update(
+            station_id, stazione.numBiciclette, stazione.numSlot, versione=operazione["ID"]
+        )
+        if not (posizione.latitudine == 0 and posizione.longitudine == 0):
+            biciclette_index.insert(bike_id, posizione.latitudine, posizione.longitudine)
+
+        return {
+            "status": "success",
+            "message": "Riconsegna avvenuta con successo",
+            "data": operazione,
+        }
+
+    @staticmethod
+    def get_nearby_bikes(lat, lon, k=5, radius=None):
+        """Ottieni le k biciclette disponibili più vicine (solo dati in memoria)"""
+        try:
+            index = biciclette_index.get()
+            risultati = index.nearest(lat, lon, k=k, radius_km=radius)
+
+            data = []
+            for distanza, bici_id in risultati:
+                posizione = index.position(bici_id)
+                if posizione is None:
+                    continue
+                data.append(
+                    {
+                        "ID": bici_id,
+                        "latitudine": posizione[0],
+                        "longitudine": posizione[1],
+                        "distanza": round(distanza, 4),
+                    }
+                )
+            return {"status": "success", "data": data}
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+
 class UserService:
     """Servizio per gestire le operazioni degli utenti"""
 
@@ -43,7 +532,7 @@ class UserService:
     def get_user_profile(user_id):
         """Ottieni il profilo di un utente"""
         try:
-            with Session() as session:
+            with session_scope() as session:
                 utente = session.query(Utente).filter_by(id=user_id).first()
                 if not utente:
                     return {"status": "error", "message": "Utente non trovato"}
@@ -56,7 +545,7 @@ class UserService:
     def update_user_profile(user_id, data):
         """Aggiorna il profilo di un utente"""
         try:
-            with Session() as session:
+            with session_scope() as session:
                 utente = session.query(Utente).filter_by(id=user_id).first()
                 if not utente:
                     return {"status": "error", "message": "Utente non trovato"}
@@ -78,6 +567,7 @@ class UserService:
                         setattr(utente, field, data[field])
 
                 session.commit()
+                AuthService.invalidate(utente.email)
 
                 return {
                     "status": "success",
@@ -86,3 +576,396 @@ class UserService:
                 }
         except Exception as e:
             return {"status": "error", "message": str(e)}
+
+
+class AuthService:
+    """Servizio per l'autenticazione di admin e utenti"""
+
+    @staticmethod
+    def credentials(email):
+        """Candidati (ruolo, id, hash) per un'email: una query o la cache"""
+        candidati = credenziali_cache.get(email)
+        if candidati is None:
+            candidati = _load_credenziali(email)
+            if candidati:
+                credenziali_cache.set(email, candidati)
+        return candidati
+
+    @staticmethod
+    def profile(ruolo, user_id, email):
+        """Profilo per la risposta del login; None (e cache invalidata) se l'account non c'è più"""
+        profilo = _load_profilo(ruolo, user_id)
+        if profilo is None:
+            credenziali_cache.invalidate(email)
+        return profilo
+
+    @staticmethod
+    def authenticate(email, password):
+        """Verifica le credenziali: una query (nessuna se in cache) più il profilo.
+
+        La verifica gira nel pool di passwords. Per un'email sconosciuta si
+        verifica comunque un hash fittizio, così la durata della risposta
+        non rivela quali email sono registrate. Un hash MD5 o con un costo
+        inferiore a quello corrente viene ricalcolato e salvato al login
+        riuscito.
+        """
+        try:
+            candidati = AuthService.credentials(email)
+            if not candidati:
+                verify_password(dummy_hash(), password)
+            for ruolo, user_id, password_hash in candidati:
+                if verify_password(password_hash, password):
+                    profilo = AuthService.profile(ruolo, user_id, email)
+                    if profilo is None:
+                        break
+                    if needs_rehash(password_hash):
+                        AuthService.store_hash(
+                            ruolo, user_id, email, password_hash, hash_password(password)
+                        )
+                    return {"status": "success", "tipoUtente": ruolo, "data": profilo}
+
+            return {"status": "error", "message": "Credenziali non valide. Riprova."}
+        except Exception as e:
+            return {"status": "error", "message": str(e), "code": 500}
+
+    @staticmethod
+    def store_hash(ruolo, user_id, email, old_hash, new_hash):
+        """Sostituisce l'hash di una password, se nel frattempo non è cambiato"""
+        modello, chiave = (Admin, Admin.ID) if ruolo == "admin" else (Utente, Utente.id)
+        with session_scope() as session:
+            session.execute(
+                sa.update(modello)
+                .where(chiave == user_id, modello.password == old_hash)
+                .values(password=new_hash)
+                .execution_options(synchronize_session=False)
+            )
+            session.commit()
+        credenziali_cache.invalidate(email)
+
+    @staticmethod
+    def invalidate(email):
+        """Da chiamare quando cambiano le credenziali o il profilo di un'email"""
+        credenziali_cache.invalidate(email)
+
+
+class FleetService:
+    """Servizio per la gestione della flotta"""
+
+    @staticmethod
+    def provision_bikes(quantita):
+        """Crea ``quantita`` biciclette in una transazione con un INSERT multi-riga"""
+        if not isinstance(quantita, int) or isinstance(quantita, bool) or not (
+            1 <= quantita <= MAX_BULK_BICICLETTE
+        ):
+            return {
+                "status": "error",
+                "message": f"quantita deve essere tra 1 e {MAX_BULK_BICICLETTE}",
+                "code": 400,
+            }
+
+        try:
+            codici = tag_allocator.allocate(quantita)
+            gps = gps_allocator.allocate(quantita)
+
+            with session_scope() as session:
+                session.connection().execute(
+                    sa.insert(Bicicletta.__table__),
+                    [
+                        {
+                            "codiceTag": tag,
+                            "gps": gps_tag,
+                            "latitudine": 0.0,
+                            "longitudine": 0.0,
+                            "distanzaPercorsa": 0.0,
+                        }
+                        for tag, gps_tag in zip(codici, gps)
+                    ],
+                )
+                session.commit()
+
+                righe = []
+                for i in range(0, quantita, _BLOCCO_IN):
+                    righe.extend(session.execute(
+                        sa.select(Bicicletta.ID, Bicicletta.codiceTag, Bicicletta.gps)
+                        .where(Bicicletta.codiceTag.in_(codici[i:i + _BLOCCO_IN]))
+                    ))
+        except Exception as e:
+            return {"status": "error", "message": str(e), "code": 500}
+
+        righe.sort()
+        for row in righe:
+            classifica_distanze.set(row.ID, 0.0)
+
+        return {
+            "status": "ok",
+            "message": f"{quantita} biciclette aggiunte con successo",
+            "data": [
+                {"ID": row.ID, "codiceTag": row.codiceTag, "gps": row.gps}
+                for row in righe
+            ],
+        }
+
+
+class LeaderboardService:
+    """Servizio per la classifica della flotta per distanza percorsa"""
+
+    @staticmethod
+    def get_classifica(n=10, ordine="top"):
+        """Le n biciclette con più (``top``) o meno (``bottom``) chilometri"""
+        try:
+            board = classifica_distanze.get()
+            righe = board.top(n) if ordine == "top" else board.bottom(n)
+            return {
+                "status": "success",
+                "data": [
+                    {"posizione": i, "ID": bici_id, "distanzaPercorsa": distanza}
+                    for i, (distanza, bici_id) in enumerate(righe, start=1)
+                ],
+            }
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+
+class TelemetryService:
+    """Servizio per l'acquisizione della telemetria GPS delle biciclette"""
+
+    @staticmethod
+    def ingest_fixes(items, bike_id=None):
+        """Applica un batch di fix GPS (lista di dizionari) in una transazione"""
+        bike, lat, lon, ts = parse_fixes(items, bike_id=bike_id)
+
+        try:
+            riepilogo = write_buffer.run(_telemetria, bike, lat, lon, ts)
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+        for bici_id, distanza in riepilogo.pop("distanze"):
+            classifica_distanze.set(bici_id, distanza)
+
+        # Le biciclette disponibili già indicizzate seguono la nuova posizione
+        posizioni = riepilogo.pop("posizioni")
+        index = biciclette_index.current()
+        if index is not None:
+            for bici_id, bici_lat, bici_lon in posizioni:
+                if bici_id in index:
+                    index.insert(bici_id, bici_lat, bici_lon)
+
+        return {"status": "success", "data": riepilogo}
+
+
+class TripService:
+    """Servizio per i viaggi ricostruiti dal log delle operazioni"""
+
+    STATI = ("completo", "in_corso", "noleggio_orfano", "riconsegna_orfana")
+
+    @staticmethod
+    def rebuild(completo=False):
+        """Elabora le nuove operazioni (o tutte, con ``completo``) in una transazione"""
+        try:
+            with session_scope() as session:
+                riepilogo = build_trips(session, completo=completo)
+                session.commit()
+            return {"status": "success", "data": riepilogo}
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+    @staticmethod
+    def get_trips(limit=None, cursor=None, stato=None, bike_id=None, user_id=None):
+        """Viaggi dal più recente, a pagine keyset su ID, con filtri opzionali"""
+        try:
+            if stato is not None and stato not in TripService.STATI:
+                raise ValueError("Parametro stato non valido")
+
+            limit = parse_limit(limit)
+            query = VIAGGIO.select().order_by(Viaggio.ID.desc())
+            if stato is not None:
+                query = query.where(Viaggio.stato == stato)
+            if bike_id is not None:
+                query = query.where(Viaggio.idBicicletta == bike_id)
+            if user_id is not None:
+                query = query.where(Viaggio.idUtente == user_id)
+            if cursor:
+                (ultimo_id,) = decode_cursor(cursor, 1)
+                query = query.where(Viaggio.ID < ultimo_id)
+
+            with session_scope() as session:
+                viaggi = VIAGGIO.all(session, query.limit(limit + 1))
+
+            next_cursor = None
+            if len(viaggi) > limit:
+                viaggi = viaggi[:limit]
+                next_cursor = encode_cursor([viaggi[-1]["ID"]])
+            return {"status": "success", "data": viaggi, "next_cursor": next_cursor}
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+
+class ArchiveService:
+    """Servizio per l'archiviazione su disco delle operazioni vecchie"""
+
+    @staticmethod
+    def archive(eta_giorni=None):
+        """Archivia le operazioni più vecchie di ``eta_giorni`` in una transazione"""
+        if eta_giorni is None:
+            eta_giorni = archivio.eta_giorni
+        if not isinstance(eta_giorni, int) or isinstance(eta_giorni, bool) or eta_giorni < 0:
+            return {"status": "error", "message": "eta_giorni non valido", "code": 400}
+        if archivio.directory is None:
+            return {"status": "error", "message": "ARCHIVE_DIR non impostato", "code": 400}
+
+        try:
+            with session_scope() as session:
+                riepilogo = archive_operations(session, archivio, eta_giorni)
+                session.commit()
+            return {"status": "success", "data": riepilogo}
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+
+class DemandService:
+    """Servizio per i contatori orari di noleggi e riconsegne per stazione"""
+
+    @staticmethod
+    def rebuild():
+        """Ricalcola tutti i contatori dal log delle operazioni in una transazione"""
+        try:
+            with session_scope() as session:
+                riepilogo = build_rollups(session)
+                session.commit()
+            return {"status": "success", "data": riepilogo}
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+    @staticmethod
+    def get_demand(dal=None, al=None, station_id=None):
+        """Noleggi e riconsegne per stazione e ora, in ordine cronologico.
+
+        ``dal`` e ``al`` (date ISO, estremi inclusi) limitano i giorni; le
+        ore senza operazioni non compaiono.
+        """
+        try:
+            query = sa.select(
+                DomandaOraria.idStazione,
+                DomandaOraria.giorno,
+                DomandaOraria.ora,
+                DomandaOraria.tipo,
+                DomandaOraria.conteggio,
+            ).order_by(DomandaOraria.giorno, DomandaOraria.ora, DomandaOraria.idStazione)
+            if dal is not None:
+                query = query.where(DomandaOraria.giorno >= _parse_data(dal, "dal"))
+            if al is not None:
+                query = query.where(DomandaOraria.giorno <= _parse_data(al, "al"))
+            if station_id is not None:
+                query = query.where(DomandaOraria.idStazione == station_id)
+
+            bucket = {}
+            with session_scope() as session:
+                for row in session.execute(query):
+                    chiave = (row.idStazione, row.giorno, row.ora)
+                    if chiave not in bucket:
+                        bucket[chiave] = {
+                            "idStazione": row.idStazione,
+                            "giorno": row.giorno.isoformat(),
+                            "ora": row.ora,
+                            "noleggi": 0,
+                            "riconsegne": 0,
+                        }
+                    campo = "noleggi" if row.tipo == "noleggio" else "riconsegne"
+                    bucket[chiave][campo] = row.conteggio
+
+            return {"status": "success", "data": list(bucket.values())}
+        except ValueError as e:
+            return {"status": "error", "message": str(e), "code": 400}
+        except Exception as e:
+            return {"status": "error", "message": str(e), "code": 500}
+
+
+class RebalancingService:
+    """Servizio per la pianificazione dei giri di ribilanciamento"""
+
+    @staticmethod
+    def plan(furgoni=3, capacita=20, target=0.5, deposito=None):
+        """Giri dei furgoni per riportare ogni stazione a numSlot * target biciclette"""
+        try:
+            with session_scope() as session:
+                stazioni = session.execute(
+                    sa.select(
+                        Stazione.ID,
+                        Stazione.latitudine,
+                        Stazione.longitudine,
+                        Stazione.numBiciclette,
+                        Stazione.numSlot,
+                    ).order_by(Stazione.ID)
+                ).all()
+
+            ids = [row.ID for row in stazioni]
+            saldo = imbalance(
+                [row.numBiciclette for row in stazioni], [row.numSlot for row in stazioni], target
+            )
+            giri = plan_routes(
+                [row.latitudine for row in stazioni],
+                [row.longitudine for row in stazioni],
+                saldo,
+                furgoni,
+                capacita,
+                deposito=deposito,
+            )
+
+            spostate = sum(q for _, fermate in giri for _, azione, q in fermate if azione == CONSEGNA)
+            return {
+                "status": "success",
+                "data": {
+                    "stazioniInEccesso": int((saldo > 0).sum()),
+                    "stazioniInDifetto": int((saldo < 0).sum()),
+                    "biciclette": spostate,
+                    "difettoResiduo": int(-saldo[saldo < 0].sum()) - spostate,
+                    "distanzaTotale": round(sum(km for km, _ in giri), 3),
+                    "furgoni": [
+                        {
+                            "furgone": i,
+                            "distanza": round(km, 3),
+                            "fermate": [
+                                {"idStazione": ids[s], "azione": azione, "biciclette": q}
+                                for s, azione, q in fermate
+                            ],
+                        }
+                        for i, (km, fermate) in enumerate(giri, start=1)
+                    ],
+                },
+            }
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+
+class StationService:
+    """Servizio per le ricerche sulle stazioni"""
+
+    @staticmethod
+    def get_nearby_stations(lat, lon, k=5, radius=None):
+        """Ottieni le k stazioni più vicine, opzionalmente entro radius km"""
+        try:
+            risultati = stazioni_index.get().nearest(lat, lon, k=k, radius_km=radius)
+            if not risultati:
+                return {"status": "success", "data": []}
+
+            ids = [stazione_id for _, stazione_id in risultati]
+            with session_scope() as session:
+                stazioni = {
+                    stazione.ID: stazione
+                    for stazione in session.scalars(
+                        sa.select(Stazione).where(Stazione.ID.in_(ids))
+                    )
+                }
+
+            data = []
+            for distanza, stazione_id in risultati:
+                stazione = stazioni.get(stazione_id)
+                if stazione is None:
+                    continue
+                item = stazione.to_dict()
+                item["distanza"] = round(distanza, 4)
+                data.append(item)
+
+            return {"status": "success", "data": data}
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
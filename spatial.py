@@ -0,0 +1,268 @@
+import heapq
+import math
+import threading
+import time
+
+from geo import KM_PER_DEG, haversine
+
+# Lato della cella della griglia in gradi (~1.1 km in latitudine)
+DEFAULT_CELL_DEG = 0.01
+
+
+class GridIndex:
+    """Indice spaziale a griglia regolare su latitudine/longitudine.
+
+    I punti sono raggruppati in celle quadrate di ``cell_deg`` gradi.
+    Le ricerche visitano solo le celle vicine al punto richiesto,
+    allargandosi ad anelli finché il risultato non può più migliorare.
+    """
+
+    def __init__(self, cell_deg=DEFAULT_CELL_DEG):
+        self.cell_deg = cell_deg
+        self._cells = {}
+        self._points = {}
+        self._bounds = None  # (min_i, max_i, min_j, max_j) delle celle usate
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._points)
+
+    def __contains__(self, item_id):
+        return item_id in self._points
+
+    def _cell(self, lat, lon):
+        return (math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg))
+
+    def insert(self, item_id, lat, lon):
+        """Inserisce o sposta un punto"""
+        with self._lock:
+            self.remove(item_id)
+            cell = self._cell(lat, lon)
+            self._cells.setdefault(cell, {})[item_id] = (lat, lon)
+            self._points[item_id] = cell
+
+            i, j = cell
+            if self._bounds is None:
+                self._bounds = (i, i, j, j)
+            else:
+                min_i, max_i, min_j, max_j = self._bounds
+                self._bounds = (min(min_i, i), max(max_i, i), min(min_j, j), max(max_j, j))
+
+    def remove(self, item_id):
+        """Rimuove un punto, se presente"""
+        with self._lock:
+            cell = self._points.pop(item_id, None)
+            if cell is None:
+                return False
+            bucket = self._cells[cell]
+            del bucket[item_id]
+            if not bucket:
+                del self._cells[cell]
+            return True
+
+    def position(self, item_id):
+        """Coordinate (lat, lon) di un punto indicizzato, None se assente"""
+        with self._lock:
+            cell = self._points.get(item_id)
+            if cell is None:
+                return None
+            return self._cells[cell][item_id]
+
+    def clear(self):
+        with self._lock:
+            self._cells.clear()
+            self._points.clear()
+            self._bounds = None
+
+    def _ring(self, ci, cj, r):
+        """Celle a distanza di Chebyshev esattamente r dalla cella (ci, cj)"""
+        if r == 0:
+            yield (ci, cj)
+            return
+        for dj in range(-r, r + 1):
+            yield (ci - r, cj + dj)
+            yield (ci + r, cj + dj)
+        for di in range(-r + 1, r):
+            yield (ci + di, cj - r)
+            yield (ci + di, cj + r)
+
+    def _ring_min_km(self, lat, r):
+        """Limite inferiore della distanza dei punti nell'anello r"""
+        if r <= 1:
+            return 0.0
+        side_km = (r - 1) * self.cell_deg * KM_PER_DEG
+        max_lat = min(90.0, abs(lat) + (r + 1) * self.cell_deg)
+        return side_km * math.cos(math.radians(max_lat))
+
+    def _max_ring(self, ci, cj):
+        """Anello oltre il quale non ci sono più celle occupate"""
+        if self._bounds is None:
+            return -1
+        min_i, max_i, min_j, max_j = self._bounds
+        return max(abs(min_i - ci), abs(max_i - ci), abs(min_j - cj), abs(max_j - cj))
+
+    @staticmethod
+    def _score(bucket, lat, lon, k, radius_km, best):
+        """Aggiunge i punti di una cella al max-heap dei k migliori"""
+        for item_id, (plat, plon) in bucket.items():
+            d = haversine(lat, lon, plat, plon)
+            if radius_km is not None and d > radius_km:
+                continue
+            if len(best) < k:
+                heapq.heappush(best, (-d, item_id))
+            elif d < -best[0][0]:
+                heapq.heapreplace(best, (-d, item_id))
+
+    def _complete(self, lat, r, k, radius_km, best):
+        """True se nessun punto dall'anello r in poi può entrare nel risultato"""
+        lower = self._ring_min_km(lat, r)
+        if radius_km is not None and lower > radius_km:
+            return True
+        return len(best) == k and -best[0][0] <= lower
+
+    def nearest(self, lat, lon, k=1, radius_km=None):
+        """I k punti più vicini, come lista di (distanza_km, id).
+
+        Gli anelli vuoti costano quanto quelli pieni: con pochi punti
+        lontani (o k maggiore dei punti) la scansione ad anelli arriverebbe
+        fino al bordo dell'area occupata. Quando le celle già visitate
+        superano quelle occupate, le celle occupate rimaste sono ordinate
+        per anello e visitate con lo stesso criterio di arresto, così il
+        costo resta limitato dal numero di celle occupate.
+        """
+        with self._lock:
+            if k < 1 or not self._cells:
+                return []
+
+            ci, cj = self._cell(lat, lon)
+            max_ring = self._max_ring(ci, cj)
+            best = []  # max-heap su distanza: (-distanza, id)
+
+            r = 0
+            visited = 0
+            while r <= max_ring and visited < len(self._cells):
+                if self._complete(lat, r, k, radius_km, best):
+                    return sorted((-d, item_id) for d, item_id in best)
+                for cell in self._ring(ci, cj, r):
+                    bucket = self._cells.get(cell)
+                    if bucket:
+                        self._score(bucket, lat, lon, k, radius_km, best)
+                visited += max(1, 8 * r)
+                r += 1
+
+            if r <= max_ring:
+                remaining = sorted(
+                    (max(abs(i - ci), abs(j - cj)), (i, j))
+                    for i, j in self._cells
+                    if max(abs(i - ci), abs(j - cj)) >= r
+                )
+                for ring, cell in remaining:
+                    if self._complete(lat, ring, k, radius_km, best):
+                        break
+                    self._score(self._cells[cell], lat, lon, k, radius_km, best)
+
+            return sorted((-d, item_id) for d, item_id in best)
+
+    def within(self, lat, lon, radius_km):
+        """Tutti i punti entro radius_km, ordinati per distanza"""
+        with self._lock:
+            if not self._cells:
+                return []
+
+            dlat = radius_km / KM_PER_DEG
+            cos_lat = math.cos(math.radians(min(89.9, abs(lat) + dlat)))
+            dlon = min(180.0, radius_km / (KM_PER_DEG * max(cos_lat, 1e-6)))
+
+            i0, j0 = self._cell(lat - dlat, lon - dlon)
+            i1, j1 = self._cell(lat + dlat, lon + dlon)
+
+            if (i1 - i0 + 1) * (j1 - j0 + 1) > len(self._cells):
+                # Raggio grande: meno celle occupate che celle nel riquadro
+                cells = [c for c in self._cells if i0 <= c[0] <= i1 and j0 <= c[1] <= j1]
+            else:
+                cells = [(i, j) for i in range(i0, i1 + 1) for j in range(j0, j1 + 1)]
+
+            found = []
+            for cell in cells:
+                bucket = self._cells.get(cell)
+                if not bucket:
+                    continue
+                for item_id, (plat, plon) in bucket.items():
+                    d = haversine(lat, lon, plat, plon)
+                    if d <= radius_km:
+                        found.append((d, item_id))
+            found.sort()
+            return found
+
+
+class LazyIndex:
+    """GridIndex costruito al primo utilizzo a partire dal database.
+
+    ``loader`` restituisce un iterabile di tuple (id, lat, lon). L'indice
+    viene ricostruito dopo ``max_age`` secondi, così i processi che non
+    hanno ricevuto le modifiche le recuperano comunque. Il caricamento
+    avviene fuori dal lock: in modalità asincrona il loader cede il loop
+    mentre attende il database, e le altre richieste non devono bloccarsi
+    su un lock che il loop stesso dovrebbe rilasciare. Durante una
+    ricostruzione le altre richieste usano l'indice precedente.
+    """
+
+    def __init__(self, loader, cell_deg=DEFAULT_CELL_DEG, max_age=300):
+        self._loader = loader
+        self._cell_deg = cell_deg
+        self._max_age = max_age
+        self._index = None
+        self._built_at = 0.0
+        self._version = 0
+        self._building = False
+        self._lock = threading.Lock()
+
+    def get(self):
+        index = self._index
+        if index is not None and time.monotonic() - self._built_at < self._max_age:
+            return index
+
+        with self._lock:
+            if self._building and self._index is not None:
+                return self._index
+            self._building = True
+            version = self._version
+
+        try:
+            index = self._build(self._loader())
+        finally:
+            with self._lock:
+                self._building = False
+
+        with self._lock:
+            if version == self._version:
+                self._index = index
+                self._built_at = time.monotonic()
+        return index
+
+    def _build(self, rows):
+        index = GridIndex(self._cell_deg)
+        for item_id, lat, lon in rows:
+            index.insert(item_id, lat, lon)
+        return index
+
+    def current(self):
+        """L'indice attuale senza costruirlo, None se non ancora caricato"""
+        return self._index
+
+    def insert(self, item_id, lat, lon):
+        """Aggiorna l'indice se già costruito (altrimenti lo farà il loader)"""
+        index = self._index
+        if index is not None:
+            index.insert(item_id, lat, lon)
+
+    def remove(self, item_id):
+        index = self._index
+        if index is not None:
+            index.remove(item_id)
+
+    def reset(self):
+        with self._lock:
+            self._version += 1
+            self._index = None
+            self._built_at = 0.0
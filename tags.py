@@ -0,0 +1,113 @@
+import threading
+
+import sqlalchemy as sa
+from sqlalchemy.exc import IntegrityError
+
+from models import Session, Sequenza
+
+ALFABETO = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+LUNGHEZZA_TAG = 6
+
+# Codici distinti di LUNGHEZZA_TAG caratteri
+SPAZIO_TAG = len(ALFABETO) ** LUNGHEZZA_TAG
+
+# Valori riservati per ogni accesso al contatore nel database
+DEFAULT_BLOCK_SIZE = 1000
+
+
+class TagExhaustedError(RuntimeError):
+    """Tutti i codici disponibili sono stati assegnati"""
+
+
+def encode_tag(valore, moltiplicatore, scostamento):
+    """Codice di LUNGHEZZA_TAG caratteri per il valore di un contatore.
+
+    ``valore -> (moltiplicatore * valore + scostamento) mod SPAZIO_TAG`` è
+    una permutazione dello spazio dei codici (il moltiplicatore è primo con
+    SPAZIO_TAG): valori distinti danno codici distinti, ma consecutivi non
+    sembrano tali.
+    """
+    x = (moltiplicatore * valore + scostamento) % SPAZIO_TAG
+    cifre = []
+    for _ in range(LUNGHEZZA_TAG):
+        x, resto = divmod(x, len(ALFABETO))
+        cifre.append(ALFABETO[resto])
+    return "".join(reversed(cifre))
+
+
+class TagAllocator:
+    """Assegna codici univoci a partire da un contatore nella tabella sequenze.
+
+    Ogni processo riserva un blocco di valori con un UPDATE sulla riga del
+    contatore e lo consuma in memoria, quindi due processi non ricevono mai
+    lo stesso valore. ``esistenti`` (opzionale) riceve una lista di codici e
+    restituisce quelli già in uso, per scartare i codici casuali assegnati
+    prima dell'introduzione del contatore.
+    """
+
+    def __init__(self, nome, moltiplicatore, scostamento, block_size=DEFAULT_BLOCK_SIZE, esistenti=None):
+        self.nome = nome
+        self._moltiplicatore = moltiplicatore
+        self._scostamento = scostamento
+        self._block_size = block_size
+        self._esistenti = esistenti
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+
+    def _reserve(self, n):
+        """Riserva n valori nel database, restituisce il primo"""
+        # Sessione propria: la riserva è confermata subito e non tiene il
+        # lock sul contatore per tutta la transazione del chiamante
+        with Session() as session:
+            for _ in range(2):
+                aggiornate = session.execute(
+                    sa.update(Sequenza)
+                    .where(Sequenza.nome == self.nome)
+                    .values(valore=Sequenza.valore + n)
+                ).rowcount
+                if aggiornate:
+                    valore = session.scalar(
+                        sa.select(Sequenza.valore).where(Sequenza.nome == self.nome)
+                    )
+                    session.commit()
+                    return valore - n
+
+                session.add(Sequenza(nome=self.nome, valore=n))
+                try:
+                    session.commit()
+                    return 0
+                except IntegrityError:
+                    # Riga creata nel frattempo da un altro processo
+                    session.rollback()
+        raise RuntimeError(f"Impossibile riservare valori per {self.nome}")
+
+    def allocate(self, n):
+        """Restituisce n codici mai assegnati prima"""
+        codici = []
+        with self._lock:
+            while len(codici) < n:
+                if self._next >= self._end:
+                    dimensione = max(self._block_size, n - len(codici))
+                    self._next = self._reserve(dimensione)
+                    self._end = self._next + dimensione
+                    if self._end > SPAZIO_TAG:
+                        raise TagExhaustedError(f"Codici {self.nome} esauriti")
+
+                fine = min(self._end, self._next + n - len(codici))
+                candidati = [
+                    encode_tag(v, self._moltiplicatore, self._scostamento)
+                    for v in range(self._next, fine)
+                ]
+                self._next = fine
+
+                if self._esistenti is not None:
+                    usati = self._esistenti(candidati)
+                    candidati = [c for c in candidati if c not in usati]
+                codici.extend(candidati)
+        return codici
+
+    def reset(self):
+        """Abbandona il blocco riservato (i valori rimasti non saranno usati)"""
+        with self._lock:
+            self._next = self._end = 0
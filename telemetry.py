@@ -0,0 +1,235 @@
+import json
+from datetime import datetime
+
+import numpy as np
+import sqlalchemy as sa
+
+from geo import MIN_SEGMENT_KM, haversine_np
+from models import Bicicletta
+
+# Fix massimi accettati in una singola richiesta
+MAX_BATCH_SIZE = 50000
+
+# Segmenti più veloci di così sono salti del GPS e non vengono contati
+MAX_SPEED_KMH = 60.0
+
+
+class TelemetryError(ValueError):
+    """Batch di telemetria non valido"""
+
+
+def _parse_timestamp(value):
+    """Timestamp in secondi: accetta epoch numerico o stringa ISO 8601"""
+    if value is None:
+        return np.nan
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+
+
+def decode_fixes_body(text, mimetype):
+    """Fix GPS dal corpo di una richiesta: JSON {"fixes": [...]}, lista JSON o NDJSON"""
+    if mimetype == "application/x-ndjson":
+        try:
+            return [json.loads(riga) for riga in text.splitlines() if riga.strip()]
+        except ValueError:
+            raise TelemetryError("NDJSON non valido")
+
+    data = None
+    if mimetype == "application/json" or (
+        mimetype.startswith("application/") and mimetype.endswith("+json")
+    ):
+        try:
+            data = json.loads(text)
+        except ValueError:
+            pass
+    if isinstance(data, dict):
+        return data["fixes"] if "fixes" in data else [data]
+    if isinstance(data, list):
+        return data
+    raise TelemetryError("Dati richiesti")
+
+
+def parse_fixes(items, bike_id=None):
+    """Converte una lista di fix in array NumPy (bike, lat, lon, ts).
+
+    Ogni fix è un dizionario con ``idBicicletta`` (implicito se ``bike_id``
+    è indicato), ``latitudine``, ``longitudine`` e ``timestamp`` opzionale.
+    """
+    if not isinstance(items, list):
+        raise TelemetryError("Il batch deve essere una lista di fix")
+    if len(items) > MAX_BATCH_SIZE:
+        raise TelemetryError(f"Massimo {MAX_BATCH_SIZE} fix per richiesta")
+
+    n = len(items)
+    bike = np.empty(n, dtype=np.int64)
+    lat = np.empty(n, dtype=np.float64)
+    lon = np.empty(n, dtype=np.float64)
+    ts = np.empty(n, dtype=np.float64)
+
+    for i, fix in enumerate(items):
+        try:
+            bike[i] = bike_id if bike_id is not None else int(fix["idBicicletta"])
+            lat[i] = float(fix["latitudine"])
+            lon[i] = float(fix["longitudine"])
+            ts[i] = _parse_timestamp(fix.get("timestamp"))
+        except (AttributeError, KeyError, TypeError, ValueError):
+            raise TelemetryError(f"Fix non valido in posizione {i}")
+
+    return bike, lat, lon, ts
+
+
+def compute_increments(bike, lat, lon, ts, previous):
+    """Calcola per ogni bicicletta l'ultima posizione e la distanza percorsa.
+
+    ``previous`` associa l'ID di ogni bicicletta nota alla posizione
+    memorizzata (lat, lon). I fix sono ordinati per (bicicletta, timestamp,
+    ordine di arrivo) e le distanze tra fix consecutivi della stessa
+    bicicletta sono calcolate in un'unica passata vettoriale.
+
+    Restituisce (ids, last_lat, last_lon, delta_km, fix_applicati).
+    """
+    valid = (
+        (lat >= -90) & (lat <= 90) & (lon >= -180) & (lon <= 180)
+        & ~((lat == 0) & (lon == 0))
+        & np.isin(bike, np.fromiter(previous, dtype=np.int64, count=len(previous)))
+    )
+    bike, lat, lon, ts = bike[valid], lat[valid], lon[valid], ts[valid]
+    n = len(bike)
+    if n == 0:
+        empty = np.empty(0)
+        return np.empty(0, dtype=np.int64), empty, empty, empty, 0
+
+    seq = np.arange(n)
+    order = np.lexsort((seq, ts, bike))
+    bike, lat, lon, ts = bike[order], lat[order], lon[order], ts[order]
+
+    ids, starts = np.unique(bike, return_index=True)
+    ends = np.append(starts[1:], n) - 1
+
+    # Punto di partenza di ogni segmento: il fix precedente della stessa
+    # bicicletta, oppure la posizione memorizzata per il primo fix
+    prev_lat = np.empty(n)
+    prev_lon = np.empty(n)
+    prev_lat[1:] = lat[:-1]
+    prev_lon[1:] = lon[:-1]
+    stored = np.array([previous[int(i)] for i in ids], dtype=np.float64).reshape(-1, 2)
+    prev_lat[starts] = stored[:, 0]
+    prev_lon[starts] = stored[:, 1]
+
+    seg = haversine_np(prev_lat, prev_lon, lat, lon)
+
+    # La posizione memorizzata a (0, 0) significa "mai localizzata"
+    first_unknown = (stored[:, 0] == 0) & (stored[:, 1] == 0)
+    seg[starts[first_unknown]] = 0.0
+
+    seg[seg < MIN_SEGMENT_KM] = 0.0
+
+    # Filtro velocità sui segmenti interni con timestamp validi
+    dt = np.full(n, np.nan)
+    dt[1:] = ts[1:] - ts[:-1]
+    dt[starts] = np.nan
+    with np.errstate(invalid="ignore", divide="ignore"):
+        speed = seg / (dt / 3600.0)
+    seg[(dt > 0) & (speed > MAX_SPEED_KMH)] = 0.0
+
+    delta = np.add.reduceat(seg, starts)
+    return ids, lat[ends], lon[ends], delta, n
+
+
+_UPDATE_POSIZIONE = (
+    sa.update(Bicicletta.__table__)
+    .where(Bicicletta.__table__.c.ID == sa.bindparam("b_id"))
+    .values(
+        latitudine=sa.bindparam("b_lat"),
+        longitudine=sa.bindparam("b_lon"),
+        distanzaPercorsa=Bicicletta.__table__.c.distanzaPercorsa + sa.bindparam("b_delta"),
+    )
+)
+
+# Dialetti in cui un executemany non costa un round trip per riga (il
+# database è nel processo); negli altri si usa _update_posizioni
+_EXECUTEMANY_LOCALE = {"sqlite"}
+
+# Biciclette aggiornate da un singolo UPDATE (7 parametri ciascuna; il CASE
+# è valutato riga per riga, quindi il costo cresce col quadrato del blocco)
+_BLOCCO_UPDATE = 1000
+
+
+def _update_posizioni(ids, lat, lon, delta):
+    """UPDATE delle biciclette indicate, con un CASE ID per colonna.
+
+    Su MySQL un executemany costerebbe un round trip per bicicletta:
+    PyMySQL raggruppa in una sola istruzione solo gli INSERT. Il CASE
+    funziona anche su MariaDB, che non ha VALUES ROW().
+    """
+    tabella = Bicicletta.__table__
+    return (
+        sa.update(tabella)
+        .where(tabella.c.ID.in_(ids))
+        .values(
+            latitudine=sa.case(dict(zip(ids, lat)), value=tabella.c.ID),
+            longitudine=sa.case(dict(zip(ids, lon)), value=tabella.c.ID),
+            distanzaPercorsa=tabella.c.distanzaPercorsa
+            + sa.case(dict(zip(ids, delta)), value=tabella.c.ID),
+        )
+    )
+
+
+def apply_fixes(session, bike, lat, lon, ts):
+    """Applica un batch di fix con una SELECT e un UPDATE ogni 1000 biciclette.
+
+    Su SQLite gli UPDATE sono un executemany, più veloce del CASE quando
+    non ci sono round trip da risparmiare.
+
+    Le righe delle biciclette coinvolte sono bloccate (in ordine di ID, per
+    evitare deadlock) fino al commit, così due batch concorrenti sulla
+    stessa bicicletta non contano due volte lo stesso tratto. Non esegue il
+    commit: è compito del chiamante.
+    """
+    richieste = np.unique(bike)
+    righe = session.execute(
+        sa.select(
+            Bicicletta.ID,
+            Bicicletta.latitudine,
+            Bicicletta.longitudine,
+            Bicicletta.distanzaPercorsa,
+        )
+        .where(Bicicletta.ID.in_(richieste.tolist()))
+        .order_by(Bicicletta.ID)
+        .with_for_update()
+    ).all()
+    previous = {row.ID: (row.latitudine, row.longitudine) for row in righe}
+    distanze = {row.ID: row.distanzaPercorsa for row in righe}
+
+    ids, last_lat, last_lon, delta, applicati = compute_increments(
+        bike, lat, lon, ts, previous
+    )
+
+    colonne = (ids.tolist(), last_lat.tolist(), last_lon.tolist(), delta.tolist())
+    connection = session.connection()
+    if connection.dialect.name in _EXECUTEMANY_LOCALE:
+        if len(ids):
+            connection.execute(
+                _UPDATE_POSIZIONE,
+                [
+                    {"b_id": i, "b_lat": la, "b_lon": lo, "b_delta": d}
+                    for i, la, lo, d in zip(*colonne)
+                ],
+            )
+    else:
+        for i in range(0, len(ids), _BLOCCO_UPDATE):
+            connection.execute(_update_posizioni(*(c[i:i + _BLOCCO_UPDATE] for c in colonne)))
+
+    return {
+        "ricevuti": int(len(bike)),
+        "applicati": int(applicati),
+        "scartati": int(len(bike) - applicati),
+        "biciclette": int(len(ids)),
+        "distanzaTotale": round(float(delta.sum()), 4),
+        "posizioni": list(zip(ids.tolist(), last_lat.tolist(), last_lon.tolist())),
+        # Righe bloccate fino al commit: i totali sono esatti
+        "distanze": [
+            (i, distanze[i] + d) for i, d in zip(ids.tolist(), delta.tolist())
+        ],
+    }
@@ -1,7 +1,6 @@
 # conftest.py - Configurazione fixture per test pytest
 import pytest
-import sqlalchemy as sa
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 
 @pytest.fixture(scope="function")
 def test_app():
@@ -9,30 +8,28 @@ def test_app():
     Restituisce l'istanza di Flask configurata per i test
     e con un database SQLite in-memory isolato.
     """
-    # Importiamo qui dentro per non inizializzare subito il DB MySQL
-    import app as app_module
-    from models import Base
-
-    # Motore di test in-memory
-    engine = sa.create_engine("sqlite:///:memory:", future=True)
-    TestingSession = sessionmaker(bind=engine)
-
-    # Colleghiamo i metadati alla nuova engine
-    Base.metadata.create_all(engine)
-
-    # Monkey-patch: usiamo la nuova Session invece di quella MySQL
-    app_module.Session = TestingSession
-    
-    # Monkey-patch anche nel modulo models e services
-    import models
-    import services
-    models.Session = TestingSession
-    services.Session = TestingSession
-
-    # Attiviamo la modalità di test di Flask
-    app_module.app.config.update(TESTING=True)
-
-    yield app_module.app     # forniamo l'oggetto Flask ai test
+    from app import create_app
+    from models import init_db
+
+    # Motore di test in-memory, una sola connessione condivisa
+    app = create_app({
+        "TESTING": True,
+        # Più query in una richiesta fanno fallire il test (N+1)
+        "QUERY_BUDGET": 20,
+        # Hash veloci e calcolati nel processo del test
+        "PASSWORD_COST": 1000,
+        "PASSWORD_WORKERS": 0,
+        "DATABASE_URL": "sqlite://",
+        "DATABASE_OPTIONS": {
+            "poolclass": StaticPool,
+            "connect_args": {"check_same_thread": False},
+        },
+    })
+
+    # Bootstrap esplicito dello schema
+    init_db()
+
+    yield app     # forniamo l'oggetto Flask ai test
 
 
 @pytest.fixture()
@@ -49,6 +46,22 @@ def session(test_app):
         yield session
 
 
+@pytest.fixture()
+def file_db(tmp_path, test_app):
+    """Database SQLite su file condiviso tra thread, al posto di quello in-memory"""
+    import cache
+    import models
+
+    models.configure_engine(
+        f"sqlite:///{tmp_path / 'contesa.db'}",
+        connect_args={"timeout": 30, "check_same_thread": False},
+    )
+    models.init_db()
+    cache.reset_all()
+    yield models.Session
+    models.configure_engine()
+
+
 @pytest.fixture()
 def sample_admin(session):
     """Crea un admin di test nel database."""
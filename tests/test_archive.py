@@ -0,0 +1,176 @@
+# test_archive.py - Test per l'archivio a colonne delle operazioni vecchie
+import json
+import os
+from datetime import date, time, timedelta
+
+import numpy as np
+import pytest
+import sqlalchemy as sa
+
+import archive
+from archive import archivio
+from models import DomandaOraria, Operazione, Viaggio
+
+
+@pytest.fixture()
+def archivio_tmp(tmp_path, test_app, monkeypatch):
+    """Archivio in una directory temporanea; finestra dei viaggi azzerata"""
+    monkeypatch.setattr(archive, "FINESTRA_RITARDO", 1)
+    archivio.configure(str(tmp_path / "archivio"), eta_giorni=365, segment_rows=10)
+    yield archivio
+    archivio.configure(None, eta_giorni=archive.DEFAULT_ETA_GIORNI, segment_rows=archive.DEFAULT_SEGMENT_ROWS)
+
+
+@pytest.fixture()
+def storico(session, sample_user, sample_bike, sample_station):
+    """25 viaggi di due anni fa e 3 operazioni recenti, viaggi già ricostruiti"""
+    from services import TripService
+
+    u, b, s = sample_user.id, sample_bike.ID, sample_station.ID
+    inizio = date.today() - timedelta(days=730)
+    righe = []
+    for i in range(25):
+        giorno = inizio + timedelta(days=i)
+        righe.append({"tipo": "noleggio", "data": giorno, "ora": time(8, i, 0, 1000 * i),
+                      "idUtente": u, "idBicicletta": b, "idStazione": s,
+                      "distanzaPercorsa": 0, "tariffa": None})
+        righe.append({"tipo": "riconsegna", "data": giorno, "ora": time(9, i, 30),
+                      "idUtente": u, "idBicicletta": b, "idStazione": s,
+                      "distanzaPercorsa": i, "tariffa": 2 * i})
+    for i in range(3):
+        righe.append({"tipo": "noleggio" if i % 2 == 0 else "riconsegna", "data": date.today(),
+                      "ora": time(10, i), "idUtente": u, "idBicicletta": b, "idStazione": s,
+                      "distanzaPercorsa": 0, "tariffa": 1})
+    session.execute(sa.insert(Operazione), righe)
+    session.commit()
+    assert TripService.rebuild()["status"] == "success"
+    return u
+
+
+def _storia(user_id, **kwargs):
+    from services import BikeRentalService
+
+    result = BikeRentalService.get_user_operations(user_id, **kwargs)
+    assert result["status"] == "success", result
+    return result
+
+
+def _tutte_le_pagine(user_id, limit, **kwargs):
+    pagine, cursor = [], None
+    while True:
+        result = _storia(user_id, limit=limit, cursor=cursor, **kwargs)
+        pagine += result["data"]
+        cursor = result["next_cursor"]
+        if cursor is None:
+            return pagine
+
+
+class TestArchiviazione:
+    """Test per lo spostamento delle operazioni nei segmenti"""
+
+    def test_sposta_le_operazioni_vecchie(self, client, session, archivio_tmp, storico):
+        prima = _storia(storico)["data"]
+
+        response = client.post("/api/admin/archivio")
+        assert response.status_code == 200
+        data = json.loads(response.data)["data"]
+
+        # 50 operazioni vecchie in segmenti da 10; l'ultimo noleggio aperto resta
+        assert data["operazioni"] == 50
+        assert len(data["segmenti"]) == 5
+        assert session.scalar(sa.select(sa.func.count()).select_from(Operazione)) == 3
+        assert archivio_tmp.archived_until() == data["archiviateFinoA"]
+
+        segmento = archivio_tmp.segments()[0]
+        assert isinstance(segmento["ID"], np.memmap)
+        assert segmento["tipo"].dtype == np.int8
+
+        # Lo storico unisce tabella e archivio senza differenze
+        assert _storia(storico)["data"] == prima
+        assert _tutte_le_pagine(storico, 7) == prima
+        dal = (date.today() - timedelta(days=720)).isoformat()
+        al = (date.today() - timedelta(days=715)).isoformat()
+        filtrate = [op for op in prima if dal <= op["data"] <= al]
+        assert len(filtrate) == 12
+        assert _tutte_le_pagine(storico, 5, dal=dal, al=al) == filtrate
+
+    def test_dettagli_dall_archivio(self, client, archivio_tmp, storico):
+        prima = _storia(storico, dettagli=True)["data"]
+        client.post("/api/admin/archivio")
+        assert _tutte_le_pagine(storico, 9, dettagli=True) == prima
+
+    def test_contatori_e_viaggi_ricostruiti(self, client, session, archivio_tmp, storico):
+        """Le ricostruzioni complete contano anche le operazioni archiviate"""
+        from services import DemandService, TripService
+
+        def contatori():
+            return sorted(tuple(r) for r in session.execute(sa.select(DomandaOraria.__table__)))
+
+        def viaggi():
+            return sorted(
+                (v.stato, v.idNoleggio, v.idRiconsegna, v.durata)
+                for v in session.scalars(sa.select(Viaggio))
+            )
+
+        DemandService.rebuild()
+        contatori_prima, viaggi_prima = contatori(), viaggi()
+
+        client.post("/api/admin/archivio")
+        assert DemandService.rebuild()["data"]["operazioni"] == 53
+        assert TripService.rebuild(completo=True)["status"] == "success"
+        session.expire_all()
+        assert contatori() == contatori_prima
+        assert viaggi() == viaggi_prima
+
+    def test_viaggio_in_corso_ferma_l_archiviazione(self, session, archivio_tmp, storico):
+        """Le operazioni dal primo noleggio ancora aperto restano nella tabella"""
+        from services import ArchiveService, TripService
+
+        from models import Bicicletta
+
+        altra = Bicicletta()
+        session.add(altra)
+        session.commit()
+        ids = session.scalars(sa.select(Operazione.ID).order_by(Operazione.ID)).all()
+        aperto = ids[20]  # un noleggio di due anni fa, unico evento di altra
+        session.execute(
+            sa.update(Operazione).where(Operazione.ID == aperto).values(idBicicletta=altra.ID)
+        )
+        session.commit()
+        TripService.rebuild(completo=True)
+        assert session.scalar(
+            sa.select(Viaggio.stato).where(Viaggio.idNoleggio == aperto)
+        ) == "in_corso"
+
+        data = ArchiveService.archive()["data"]
+        assert data["archiviateFinoA"] == ids[19]
+        assert session.get(Operazione, aperto) is not None
+
+    def test_archiviazione_interrotta(self, session, archivio_tmp, storico):
+        """Un segmento scritto senza cancellare le righe non le duplica"""
+        from services import ArchiveService
+
+        prima = _storia(storico)["data"]
+        righe = session.execute(
+            sa.select(Operazione).order_by(Operazione.ID).limit(4)
+        ).scalars().all()
+        archivio_tmp.write_segment(righe)
+        session.rollback()
+
+        assert _storia(storico)["data"] == prima
+        data = ArchiveService.archive()["data"]
+        assert data["cancellate"] == 50
+        assert _storia(storico)["data"] == prima
+
+    def test_solo_file_completi_visibili(self, archivio_tmp, storico):
+        """Una directory provvisoria (nome con il punto) non è un segmento"""
+        os.makedirs(os.path.join(archivio_tmp.directory, ".tmp123"))
+        assert archivio_tmp.segments() == []
+
+    def test_senza_directory(self, client, storico):
+        response = client.post("/api/admin/archivio")
+        assert response.status_code == 400
+
+    def test_eta_non_valida(self, client, archivio_tmp):
+        response = client.post("/api/admin/archivio", json={"eta_giorni": -1})
+        assert response.status_code == 400
@@ -0,0 +1,224 @@
+# test_asgi.py - Test per la modalità di servizio asincrona (ASGI)
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip("starlette")
+pytest.importorskip("a2wsgi")
+pytest.importorskip("aiosqlite")
+pytest.importorskip("greenlet")
+pytest.importorskip("httpx")
+
+import httpx  # noqa: E402
+from starlette.testclient import TestClient  # noqa: E402
+
+
+@pytest.fixture()
+def asgi_app(tmp_path):
+    """Applicazione ASGI su un database SQLite su file, condiviso dai due engine"""
+    import models
+    from asgi import create_asgi_app
+
+    app = create_asgi_app({
+        "TESTING": True,
+        "DATABASE_URL": f"sqlite:///{tmp_path / 'asgi.db'}",
+        "DATABASE_OPTIONS": {"connect_args": {"timeout": 30}},
+        "PASSWORD_COST": 1000,
+        "PASSWORD_WORKERS": 0,
+    })
+    models.init_db()
+    yield app
+    models.configure_engine()
+
+
+@pytest.fixture()
+def dati(asgi_app):
+    """Un utente, una bicicletta localizzata e una stazione"""
+    from models import Bicicletta, Session, Stazione, Utente
+
+    with Session() as session:
+        utente = Utente(
+            nome="Mario", cognome="Rossi", email="mario@test.com",
+            numTelefono="1234567890", cartaCredito="1234567890123456",
+            password="password123", via="Via Roma 1", città="Milano",
+            provincia="MI", regione="Lombardia",
+        )
+        bici = Bicicletta()
+        bici.update_position(45.4642, 9.19)
+        stazione = Stazione(
+            numSlot=10, numBiciclette=5, via="Via Dante", città="Milano",
+            provincia="MI", regione="Lombardia", latitudine=45.4642, longitudine=9.19,
+        )
+        session.add_all([utente, bici, stazione])
+        session.commit()
+        return {"utente": utente.id, "bici": bici.ID, "stazione": stazione.ID}
+
+
+class TestASGI:
+    """Test per le route asincrone e il passaggio a Flask"""
+
+    def test_login_asincrono(self, asgi_app, dati):
+        with TestClient(asgi_app) as client:
+            response = client.post(
+                "/api/auth/login", json={"email": "mario@test.com", "password": "password123"}
+            )
+            assert response.status_code == 200
+            assert response.json()["tipoUtente"] == "user"
+
+            response = client.post(
+                "/api/auth/login", json={"email": "mario@test.com", "password": "sbagliata"}
+            )
+            assert response.status_code == 401
+
+    def test_login_asincrono_aggiorna_md5(self, asgi_app, dati):
+        """Il login asincrono sostituisce un hash MD5 della versione precedente"""
+        import hashlib
+
+        import sqlalchemy as sa
+        from models import Session, Utente
+
+        with Session() as session:
+            session.execute(
+                sa.update(Utente)
+                .where(Utente.id == dati["utente"])
+                .values(password=hashlib.md5(b"password123").hexdigest())
+            )
+            session.commit()
+
+        with TestClient(asgi_app) as client:
+            credenziali = {"email": "mario@test.com", "password": "password123"}
+            assert client.post("/api/auth/login", json=credenziali).status_code == 200
+            assert client.post("/api/auth/login", json=credenziali).status_code == 200
+
+        with Session() as session:
+            assert session.get(Utente, dati["utente"]).password.startswith("pbkdf2_sha256$")
+
+    def test_noleggio_visibile_da_flask(self, asgi_app, dati):
+        """Una modifica fatta dalla route asincrona è letta dalla route Flask"""
+        with TestClient(asgi_app) as client:
+            response = client.post("/api/operazioni", json={
+                "tipo": "noleggio",
+                "idUtente": dati["utente"],
+                "idBicicletta": dati["bici"],
+                "idStazione": dati["stazione"],
+            })
+            assert response.status_code == 201
+
+            # GET /api/stazioni non ha una route asincrona: la serve Flask
+            stazioni = client.get("/api/stazioni").json()
+            assert stazioni[0]["numBiciclette"] == 4
+
+            storico = client.get(f"/api/operazioni/utente/{dati['utente']}?limit=10").json()
+            assert len(storico["data"]) == 1
+            assert storico["next_cursor"] is None
+
+            response = client.get("/api/operazioni/utente/999999")
+            assert response.status_code == 404
+            assert response.json()["status"] == "error"
+
+    def test_telemetria_e_stato(self, asgi_app, dati):
+        with TestClient(asgi_app) as client:
+            righe = "\n".join(
+                json.dumps({"idBicicletta": dati["bici"], "latitudine": 45.4642 + i * 0.001, "longitudine": 9.19})
+                for i in range(1, 4)
+            )
+            response = client.post(
+                "/api/simulazione", content=righe, headers={"Content-Type": "application/x-ndjson"}
+            )
+            assert response.status_code == 200
+            assert response.json()["data"]["applicati"] == 3
+
+            stato = client.get(f"/api/biciclette/{dati['bici']}/status").json()["data"]
+            assert stato["latitudine"] == pytest.approx(45.4672)
+            assert stato["distanzaPercorsa"] > 0.3
+
+            assert client.post("/api/simulazione", json=[{"latitudine": 1}]).status_code == 400
+            assert client.get("/api/biciclette/nearby?lat=999&lon=9").status_code == 400
+
+    def test_richieste_concorrenti(self, asgi_app, dati):
+        """Molte richieste contemporanee servite da un solo loop"""
+
+        async def scenario():
+            transport = httpx.ASGITransport(app=asgi_app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                risposte = await asyncio.gather(*[
+                    client.get(f"/api/biciclette/{dati['bici']}/status") for _ in range(200)
+                ])
+            return [r.status_code for r in risposte]
+
+        assert asyncio.run(scenario()) == [200] * 200
+
+    def test_stream_sse_nel_loop(self, asgi_app, dati):
+        """Gli stream SSE attendono sul loop: più client del pool di a2wsgi non bloccano Flask"""
+        from services import disponibilita
+
+        async def scenario():
+            chiusura = asyncio.Event()
+
+            async def receive():
+                await chiusura.wait()
+                return {"type": "http.disconnect"}
+
+            scope = {
+                "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+                "method": "GET", "scheme": "http", "path": "/api/stazioni/stream",
+                "raw_path": b"/api/stazioni/stream", "root_path": "", "query_string": b"",
+                "headers": [], "client": ("test", 1), "server": ("test", 80),
+            }
+            streams = []
+            for _ in range(20):
+                chunks = asyncio.Queue()
+
+                async def send(message, chunks=chunks):
+                    if message["type"] == "http.response.start":
+                        await chunks.put(message["status"])
+                    elif message.get("body"):
+                        await chunks.put(message["body"].decode())
+
+                streams.append((asyncio.create_task(asgi_app(scope, receive, send)), chunks))
+
+            for _, chunks in streams:
+                assert await asyncio.wait_for(chunks.get(), 5) == 200
+                assert (await chunks.get()).startswith("retry:")
+                assert "event: snapshot" in await chunks.get()
+
+            # GET /api/stazioni è servita da Flask nel pool di a2wsgi (10 thread)
+            transport = httpx.ASGITransport(app=asgi_app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                response = await asyncio.wait_for(client.get("/api/stazioni"), 5)
+            assert response.status_code == 200
+
+            await asyncio.to_thread(disponibilita.update, dati["stazione"], 4, 10)
+            for _, chunks in streams:
+                delta = await asyncio.wait_for(chunks.get(), 5)
+                assert "event: delta" in delta
+                assert '"numBiciclette": 4' in delta
+
+            chiusura.set()
+            await asyncio.wait_for(asyncio.gather(*(task for task, _ in streams)), 5)
+
+        asyncio.run(scenario())
+
+    def test_metriche_route_native(self, asgi_app, dati):
+        """Le route asincrone compaiono in /metrics come quelle servite da Flask"""
+        import metrics
+
+        route = "/api/biciclette/{bike_id:int}/status"
+        prima = metrics.REQUESTS.value("GET", route, "200")
+        sql_prima = metrics.SQL_STATEMENTS.count(route)
+        flask_prima = metrics.REQUESTS.value("GET", "/api/stazioni", "200")
+
+        with TestClient(asgi_app) as client:
+            assert client.get(f"/api/biciclette/{dati['bici']}/status").status_code == 200
+            assert client.get("/api/biciclette/999999/status").status_code == 400
+            assert client.get("/api/stazioni").status_code == 200
+            testo = client.get("/metrics").text
+
+        assert metrics.REQUESTS.value("GET", route, "200") == prima + 1
+        assert metrics.REQUESTS.value("GET", route, "400") >= 1
+        assert metrics.SQL_STATEMENTS.count(route) == sql_prima + 2
+        assert metrics.SQL_STATEMENTS.sum(route) > 0
+        # Le route montate restano contate una volta sola, dagli hook di Flask
+        assert metrics.REQUESTS.value("GET", "/api/stazioni", "200") == flask_prima + 1
+        assert 'route="/api/biciclette/{bike_id:int}/status"' in testo
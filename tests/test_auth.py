@@ -140,4 +140,75 @@ class TestAuth:
         assert response.status_code == 401
         data = json.loads(response.data)
         assert data["status"] == "error"
-        assert data["message"] == "Credenziali non valide. Riprova." 
\ No newline at end of file
+        assert data["message"] == "Credenziali non valide. Riprova."
+
+    def test_login_admin_e_utente_stessa_email(self, client, session):
+        """Test la query unificata distingue admin e utente con la stessa email"""
+        from models import Admin, Utente
+
+        session.add(Admin(email="doppio@test.com", password="adminpass"))
+        session.add(Utente(
+            nome="Doppio", cognome="Ruolo", email="doppio@test.com",
+            numTelefono="1", cartaCredito="1", password="userpass",
+            via="Via", città="Milano", provincia="MI", regione="Lombardia",
+        ))
+        session.commit()
+
+        response = client.post("/api/auth/login", json={"email": "doppio@test.com", "password": "adminpass"})
+        assert json.loads(response.data)["tipoUtente"] == "admin"
+
+        response = client.post("/api/auth/login", json={"email": "doppio@test.com", "password": "userpass"})
+        data = json.loads(response.data)
+        assert data["tipoUtente"] == "user"
+        assert data["data"]["nome"] == "Doppio"
+        assert "password" not in data["data"]
+
+    def test_login_usa_la_cache(self, client, session, sample_user):
+        """Test il secondo login legge l'hash dalla cache e interroga solo il profilo"""
+        from metrics import query_budget
+        from services import credenziali_cache
+
+        credenziali = {"email": "mario@test.com", "password": "password123"}
+        assert client.post("/api/auth/login", json=credenziali).status_code == 200
+        assert credenziali_cache.get("mario@test.com") == (
+            ("user", sample_user.id, sample_user.password),
+        )
+
+        with query_budget(1):
+            assert client.post("/api/auth/login", json=credenziali).status_code == 200
+
+        # Account eliminato: il profilo non c'è più e la cache è invalidata
+        session.delete(sample_user)
+        session.commit()
+        assert client.post("/api/auth/login", json=credenziali).status_code == 401
+        assert credenziali_cache.get("mario@test.com") is None
+
+    def test_login_email_sconosciuta(self, client):
+        """Test email sconosciuta: 401 e nessun esito negativo in cache"""
+        from services import credenziali_cache
+
+        credenziali = {"email": "ignoto@test.com", "password": "qualsiasi"}
+        assert client.post("/api/auth/login", json=credenziali).status_code == 401
+        assert credenziali_cache.get("ignoto@test.com") is None
+
+    def test_login_cache_invalidata_da_registrazione(self, client):
+        """Test un login fallito non impedisce quello dopo la registrazione"""
+        credenziali = {"email": "nuovo@test.com", "password": "nuovapass"}
+        assert client.post("/api/auth/login", json=credenziali).status_code == 401
+
+        client.post("/api/auth/register", json={
+            "nome": "Nuovo", "cognome": "Utente", "email": "nuovo@test.com",
+            "numTelefono": "1", "cartaCredito": "1", "password": "nuovapass",
+            "via": "Via", "città": "Milano", "provincia": "MI", "regione": "Lombardia",
+        })
+        assert client.post("/api/auth/login", json=credenziali).status_code == 200
+
+    def test_login_cache_invalidata_da_profilo(self, client, sample_user):
+        """Test il profilo restituito dal login segue le modifiche"""
+        credenziali = {"email": "mario@test.com", "password": "password123"}
+        client.post("/api/auth/login", json=credenziali)
+
+        client.put(f"/api/utenti/{sample_user.id}/profilo", json={"nome": "Luigi"})
+
+        data = json.loads(client.post("/api/auth/login", json=credenziali).data)
+        assert data["data"]["nome"] == "Luigi"
@@ -0,0 +1,217 @@
+# test_availability.py - Test per il feed di disponibilità delle stazioni (SSE)
+import json
+import threading
+
+from availability import AvailabilityFeed, stream_events
+
+
+def _parse(chunk):
+    """Campi di un evento SSE"""
+    if isinstance(chunk, bytes):
+        chunk = chunk.decode()
+    campi = {}
+    for riga in chunk.strip().splitlines():
+        nome, _, valore = riga.partition(": ")
+        campi[nome] = valore
+    return campi
+
+
+class TestAvailabilityFeed:
+    """Test per AvailabilityFeed"""
+
+    def test_solo_delta_effettivi(self):
+        feed = AvailabilityFeed(lambda: [(1, 5, 10), (2, 0, 4)])
+        version, righe = feed.snapshot()
+        assert righe == [
+            {"ID": 1, "numBiciclette": 5, "postiLiberi": 5},
+            {"ID": 2, "numBiciclette": 0, "postiLiberi": 4},
+        ]
+
+        feed.update(1, 5, 10)  # nessun cambiamento
+        assert feed.events_since(version) == []
+
+        feed.update(1, 4, 10)
+        feed.remove(2)
+        eventi = feed.events_since(version)
+        assert [json.loads(p) for _, p in eventi] == [
+            [{"ID": 1, "numBiciclette": 4, "postiLiberi": 6}],
+            [{"ID": 2, "rimossa": True}],
+        ]
+
+    def test_log_troppo_vecchio(self):
+        feed = AvailabilityFeed(lambda: [(1, 0, 10)], history=2)
+        feed.snapshot()
+        for n in range(1, 5):
+            feed.update(1, n, 10)
+        assert feed.events_since(0) is None
+        assert len(feed.events_since(2)) == 2
+
+    def test_refresh_dal_database(self):
+        righe = [(1, 5, 10), (2, 3, 4)]
+        feed = AvailabilityFeed(lambda: list(righe), max_age=0)
+        version, _ = feed.snapshot()
+
+        righe[:] = [(1, 6, 10)]  # modifiche fatte da un altro processo
+        feed.refresh_if_stale()
+        (evento,) = feed.events_since(version)
+        assert json.loads(evento[1]) == [
+            {"ID": 1, "numBiciclette": 6, "postiLiberi": 4},
+            {"ID": 2, "rimossa": True},
+        ]
+
+    def test_caricamento_senza_lock(self):
+        """Test il loader gira senza il lock: gli aggiornamenti non attendono la query"""
+        in_query = threading.Event()
+        rilascia = threading.Event()
+
+        def loader():
+            in_query.set()
+            rilascia.wait(5)
+            return [(1, 5, 10), (2, 3, 4)]
+
+        feed = AvailabilityFeed(loader)
+        risultato = []
+        lettore = threading.Thread(target=lambda: risultato.append(feed.snapshot()))
+        lettore.start()
+        assert in_query.wait(5)
+
+        # Durante la query: non si blocca e vince sulla riga letta
+        feed.update(1, 2, 10)
+        feed.remove(2)
+        rilascia.set()
+        lettore.join(5)
+
+        (_, righe), = risultato
+        assert righe == [{"ID": 1, "numBiciclette": 2, "postiLiberi": 8}]
+
+    def test_aggiornamenti_fuori_ordine(self):
+        """Test un conteggio con versione più vecchia, pubblicato in ritardo, è ignorato"""
+        feed = AvailabilityFeed(lambda: [(1, 5, 10)])
+        version, _ = feed.snapshot()
+
+        feed.update(1, 3, 10, versione=8)
+        feed.update(1, 4, 10, versione=7)
+        feed.update(1, 3, 10, versione=8)
+        assert feed.snapshot()[1] == [{"ID": 1, "numBiciclette": 3, "postiLiberi": 7}]
+        assert len(feed.events_since(version)) == 1
+
+        feed.update(1, 2, 10, versione=9)
+        assert feed.snapshot()[1] == [{"ID": 1, "numBiciclette": 2, "postiLiberi": 8}]
+
+    def test_riallineamento_periodico(self):
+        """Test con uno stream aperto la tabella si riallinea senza attendere il heartbeat"""
+        righe = [(1, 5, 10)]
+        feed = AvailabilityFeed(lambda: list(righe), max_age=0.05)
+        assert feed.subscribe()
+        try:
+            version, _ = feed.snapshot()
+            feed.update(1, 4, 10, versione=2)  # conteggio sbagliato
+            version = feed.version
+
+            assert feed.wait(version, 5)
+            (evento,) = feed.events_since(version)
+            assert json.loads(evento[1]) == [{"ID": 1, "numBiciclette": 5, "postiLiberi": 5}]
+        finally:
+            feed.unsubscribe()
+
+    def test_aggiornamento_durante_il_riallineamento(self):
+        """Test un noleggio pubblicato mentre il riallineamento legge il database non va perso"""
+        letture = iter([[(1, 5, 10)], [(1, 6, 10)]])
+
+        def loader():
+            righe = next(letture)
+            if righe == [(1, 6, 10)]:
+                feed.update(1, 4, 10, versione=3)  # commit successivo alla lettura
+            return righe
+
+        feed = AvailabilityFeed(loader, max_age=3600)
+        feed.snapshot()
+        feed.refresh()
+        assert feed.snapshot()[1] == [{"ID": 1, "numBiciclette": 4, "postiLiberi": 6}]
+
+    def test_limite_abbonati(self):
+        feed = AvailabilityFeed(lambda: [], max_subscribers=2)
+        assert feed.subscribe() and feed.subscribe()
+        assert not feed.subscribe()
+        feed.unsubscribe()
+        assert feed.subscribe()
+        assert feed.subscribers == 2
+
+    def test_stream_snapshot_delta_e_riconnessione(self):
+        feed = AvailabilityFeed(lambda: [(1, 5, 10)], max_age=3600)
+        stream = stream_events(feed, heartbeat=0.01)
+
+        assert next(stream).startswith("retry:")
+        snapshot = _parse(next(stream))
+        assert snapshot["event"] == "snapshot"
+        assert next(stream) == ": ping\n\n"
+
+        feed.update(1, 4, 10)
+        delta = _parse(next(stream))
+        assert delta["event"] == "delta"
+        assert int(delta["id"]) == int(snapshot["id"]) + 1
+
+        # Riconnessione: arrivano solo gli eventi persi
+        feed.update(1, 3, 10)
+        ripresa = stream_events(feed, last_event_id=int(delta["id"]), heartbeat=0.01)
+        next(ripresa)
+        assert json.loads(_parse(next(ripresa))["data"])[0]["numBiciclette"] == 3
+
+
+class TestStreamAPI:
+    """Test per GET /api/stazioni/stream"""
+
+    def test_stream_segue_i_noleggi(self, client, sample_user, sample_bike, sample_station):
+        response = client.get("/api/stazioni/stream", buffered=False)
+        assert response.status_code == 200
+        assert response.mimetype == "text/event-stream"
+
+        stream = iter(response.response)
+        next(stream)
+        snapshot = _parse(next(stream))
+        assert json.loads(snapshot["data"]) == [
+            {"ID": sample_station.ID, "numBiciclette": 5, "postiLiberi": 5}
+        ]
+
+        client.post("/api/operazioni", json={
+            "tipo": "noleggio",
+            "idUtente": sample_user.id,
+            "idBicicletta": sample_bike.ID,
+            "idStazione": sample_station.ID,
+        })
+        delta = _parse(next(stream))
+        assert json.loads(delta["data"]) == [
+            {"ID": sample_station.ID, "numBiciclette": 4, "postiLiberi": 6}
+        ]
+
+        nuova = json.loads(client.post("/api/stazioni", json={
+            "numSlot": 8, "numBiciclette": 2, "via": "Via Nuova",
+            "città": "Milano", "provincia": "MI", "regione": "Lombardia",
+        }).data)["data"]
+        assert json.loads(_parse(next(stream))["data"]) == [
+            {"ID": nuova["ID"], "numBiciclette": 2, "postiLiberi": 6}
+        ]
+
+        client.delete(f"/api/stazioni/{nuova['ID']}")
+        assert json.loads(_parse(next(stream))["data"]) == [
+            {"ID": nuova["ID"], "rimossa": True}
+        ]
+        response.close()
+
+    def test_troppi_stream(self, client, monkeypatch):
+        """Test oltre SSE_MAX_SUBSCRIBERS stream: 503, e il posto torna libero alla chiusura"""
+        from services import disponibilita
+
+        monkeypatch.setattr(disponibilita, "max_subscribers", 1)
+        aperto = client.get("/api/stazioni/stream", buffered=False)
+        assert aperto.status_code == 200
+
+        rifiutato = client.get("/api/stazioni/stream", buffered=False)
+        assert rifiutato.status_code == 503
+        assert rifiutato.headers["Retry-After"] == "30"
+
+        aperto.close()
+        assert disponibilita.subscribers == 0
+        riaperto = client.get("/api/stazioni/stream", buffered=False)
+        assert riaperto.status_code == 200
+        riaperto.close()
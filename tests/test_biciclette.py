@@ -125,4 +125,172 @@ class TestBicicletteAPI:
         
         # Verifica che abbiano codiciTag diversi
         codici_tag = [bici["codiceTag"] for bici in list_data["data"]]
-        assert len(set(codici_tag)) == 3  # tutti diversi 
\ No newline at end of file
+        assert len(set(codici_tag)) == 3  # tutti diversi
+
+    def test_biciclette_paginazione_keyset(self, client, session):
+        """Test paginazione con cursore su (distanzaPercorsa, ID)"""
+        from models import Bicicletta
+
+        # Distanze ripetute per verificare lo spareggio sull'ID
+        for distanza in [5.0, 10.0, 10.0, 10.0, 25.0, 0.0, 2.5]:
+            bici = Bicicletta()
+            bici.distanzaPercorsa = distanza
+            session.add(bici)
+        session.commit()
+
+        visti = []
+        cursor = None
+        pagine = 0
+        while True:
+            url = "/api/biciclette?limit=3"
+            if cursor:
+                url += f"&cursor={cursor}"
+            response = client.get(url)
+            assert response.status_code == 200
+            data = json.loads(response.data)
+            assert len(data["data"]) <= 3
+            visti.extend(data["data"])
+            pagine += 1
+            cursor = data["next_cursor"]
+            if cursor is None:
+                break
+
+        assert pagine == 3
+        assert len(visti) == 7
+        assert len({bici["ID"] for bici in visti}) == 7
+
+        # Stesso ordinamento della lista completa
+        completa = json.loads(client.get("/api/biciclette").data)["data"]
+        assert [b["ID"] for b in visti] == [b["ID"] for b in completa]
+
+    def test_biciclette_cursore_non_valido(self, client):
+        """Test cursore o limit non validi"""
+        response = client.get("/api/biciclette?limit=2&cursor=non-valido")
+        assert response.status_code == 400
+        assert json.loads(response.data)["status"] == "error"
+
+        response = client.get("/api/biciclette?limit=0")
+        assert response.status_code == 400
+
+    def test_biciclette_stream_json(self, client, session):
+        """Test lista biciclette in streaming come array JSON"""
+        from models import Bicicletta
+
+        session.add_all([Bicicletta() for _ in range(4)])
+        session.commit()
+
+        response = client.get("/api/biciclette?stream=json")
+
+        assert response.status_code == 200
+        assert response.is_streamed
+        data = json.loads(response.data)
+        assert data["status"] == "success"
+        assert len(data["data"]) == 4
+
+    def test_biciclette_stream_ndjson(self, client, sample_bike):
+        """Test lista biciclette in streaming NDJSON"""
+        response = client.get("/api/biciclette?stream=ndjson")
+
+        assert response.status_code == 200
+        assert response.mimetype == "application/x-ndjson"
+        righe = [json.loads(r) for r in response.data.decode().splitlines()]
+        assert len(righe) == 1
+        assert righe[0]["ID"] == sample_bike.ID
+
+        response = client.get("/api/biciclette?stream=xml")
+        assert response.status_code == 400
+
+    def test_biciclette_nearby(self, client, session, sample_user):
+        """Test ricerca biciclette disponibili: esclude (0,0) e quelle noleggiate"""
+        from models import Bicicletta
+
+        vicina = Bicicletta()
+        vicina.update_position(45.4642, 9.1900)
+        lontana = Bicicletta()
+        lontana.update_position(45.4800, 9.2100)
+        noleggiata = Bicicletta()
+        noleggiata.update_position(45.4643, 9.1901)
+        noleggiata.idUtenteNoleggio = sample_user.id
+        mai_localizzata = Bicicletta()
+        session.add_all([vicina, lontana, noleggiata, mai_localizzata])
+        session.commit()
+
+        response = client.get("/api/biciclette/nearby?lat=45.4642&lon=9.19&k=10")
+
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert [b["ID"] for b in data["data"]] == [vicina.ID, lontana.ID]
+        assert data["data"][0]["distanza"] == 0.0
+        assert data["data"][0]["latitudine"] == 45.4642
+
+        response = client.get("/api/biciclette/nearby?lat=45.4642&lon=9.19&radius=0.5")
+        data = json.loads(response.data)
+        assert [b["ID"] for b in data["data"]] == [vicina.ID]
+
+    def test_biciclette_nearby_k_oltre_le_disponibili(self, client, session):
+        """Test k maggiore delle biciclette disponibili, una delle quali lontanissima"""
+        import time
+        from models import Bicicletta
+
+        vicine = [Bicicletta() for _ in range(3)]
+        for i, bici in enumerate(vicine):
+            bici.update_position(45.4642 + i * 0.001, 9.1900)
+        lontana = Bicicletta()
+        lontana.update_position(-33.8688, 151.2093)
+        session.add_all(vicine + [lontana])
+        session.commit()
+
+        inizio = time.perf_counter()
+        response = client.get("/api/biciclette/nearby?lat=45.4642&lon=9.19&k=100")
+        durata = time.perf_counter() - inizio
+
+        assert response.status_code == 200
+        data = json.loads(response.data)["data"]
+        assert [b["ID"] for b in data] == [b.ID for b in vicine] + [lontana.ID]
+        # Senza limite la scansione ad anelli arriverebbe fino a Sydney
+        assert durata < 1.0
+
+    def test_biciclette_nearby_dopo_delete(self, client, session):
+        """Test bicicletta eliminata rimossa dall'indice"""
+        from models import Bicicletta
+
+        bici = Bicicletta()
+        bici.update_position(45.4642, 9.1900)
+        session.add(bici)
+        session.commit()
+        bici_id = bici.ID
+
+        url = "/api/biciclette/nearby?lat=45.4642&lon=9.19"
+        assert len(json.loads(client.get(url).data)["data"]) == 1
+
+        client.delete(f"/api/biciclette/{bici_id}")
+        assert json.loads(client.get(url).data)["data"] == []
+
+    def test_create_biciclette_bulk(self, client, session):
+        """Test provisioning di molte biciclette in una richiesta"""
+        from models import Bicicletta
+
+        esistente = Bicicletta()
+        session.add(esistente)
+        session.commit()
+
+        response = client.post("/api/biciclette/bulk", json={"quantita": 2500})
+        assert response.status_code == 201
+        data = json.loads(response.data)["data"]
+        assert len(data) == 2500
+        assert len({b["codiceTag"] for b in data}) == 2500
+        assert esistente.codiceTag not in {b["codiceTag"] for b in data}
+
+        response = client.post("/api/biciclette/bulk", json={"quantita": 10})
+        assert response.status_code == 201
+        assert session.query(Bicicletta).count() == 2511
+
+        # Le nuove biciclette entrano in classifica
+        classifica = json.loads(client.get("/api/biciclette/classifica?n=1000").data)["data"]
+        assert len(classifica) == 1000
+
+    def test_create_biciclette_bulk_non_valido(self, client):
+        assert client.post("/api/biciclette/bulk", json={}).status_code == 400
+        for quantita in (0, -1, "10", 1.5, True, 10001):
+            response = client.post("/api/biciclette/bulk", json={"quantita": quantita})
+            assert response.status_code == 400, quantita
@@ -0,0 +1,177 @@
+# test_database.py - Test per pool di connessioni e sessione per richiesta
+import pytest
+import json
+
+import sqlalchemy as sa
+
+from models import (
+    TimedQueuePool,
+    async_database_url,
+    bind_session,
+    engine_options_from_env,
+    pool_stats,
+    session_scope,
+)
+
+
+class TestSessionePerRichiesta:
+    """Test per session_scope"""
+
+    def test_stessa_sessione_nella_richiesta(self, test_app):
+        """Test una sola sessione per tutta la richiesta, chiusa alla fine"""
+        from flask import g
+
+        with test_app.app_context():
+            with session_scope() as prima:
+                pass
+            with session_scope() as seconda:
+                pass
+            assert prima is seconda
+            assert g._db_session is prima
+
+    def test_sessioni_diverse_fuori_richiesta(self, test_app):
+        """Test fuori da una richiesta ogni blocco ha la sua sessione"""
+        with session_scope() as prima:
+            pass
+        with session_scope() as seconda:
+            pass
+        assert prima is not seconda
+
+    def test_sessione_legata(self, test_app):
+        """Test dentro bind_session i servizi usano la sessione legata (modalità ASGI)"""
+        from models import Session
+
+        legata = Session()
+        try:
+            with bind_session(legata):
+                with test_app.test_request_context():
+                    with session_scope() as session:
+                        assert session is legata
+            with session_scope() as session:
+                assert session is not legata
+        finally:
+            legata.close()
+
+    def test_rollback_su_errore(self, test_app, session, sample_user):
+        """Test un errore nel blocco non lascia la sessione inutilizzabile"""
+        from models import Utente
+
+        with test_app.app_context():
+            with pytest.raises(Exception):
+                with session_scope() as s:
+                    s.add(Utente(
+                        nome="X", cognome="Y", email="mario@test.com", numTelefono="1",
+                        cartaCredito="1", password="x", via="Via", città="C",
+                        provincia="P", regione="R",
+                    ))
+                    s.flush()  # email duplicata
+
+            with session_scope() as s:
+                assert s.get(Utente, sample_user.id) is not None
+
+
+class TestPool:
+    """Test per la configurazione e le statistiche del pool"""
+
+    def test_opzioni_da_ambiente(self):
+        """Test lettura delle variabili d'ambiente del pool"""
+        options = engine_options_from_env({
+            "DB_POOL_SIZE": "4",
+            "DB_MAX_OVERFLOW": "2",
+            "DB_POOL_TIMEOUT": "1.5",
+            "DB_POOL_RECYCLE": "60",
+            "DB_POOL_PRE_PING": "false",
+        })
+        assert options == {
+            "pool_size": 4,
+            "max_overflow": 2,
+            "pool_timeout": 1.5,
+            "pool_recycle": 60,
+            "pool_pre_ping": False,
+        }
+        assert engine_options_from_env({})["pool_pre_ping"] is True
+
+    def test_statistiche_pool(self, tmp_path):
+        """Test connessioni in uso, overflow e tempo di attesa"""
+        engine = sa.create_engine(
+            f"sqlite:///{tmp_path / 'pool.db'}",
+            poolclass=TimedQueuePool,
+            pool_size=1,
+            max_overflow=1,
+        )
+        prima = engine.connect()
+        seconda = engine.connect()
+
+        stats = pool_stats(engine)
+        assert stats["inUso"] == 2
+        assert stats["overflow"] == 1
+        assert stats["attesa"]["richieste"] == 2
+
+        prima.close()
+        seconda.close()
+        assert pool_stats(engine)["inUso"] == 0
+        engine.dispose()
+
+    def test_endpoint_pool(self, client):
+        """Test endpoint delle statistiche"""
+        response = client.get("/api/sistema/pool")
+
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert data["status"] == "success"
+        assert "tipo" in data["data"]
+
+
+class TestAsync:
+    """Test per la configurazione dell'engine asincrono"""
+
+    def test_url_driver_asincrono(self):
+        assert async_database_url("mysql+pymysql://u:p@db/bici") == "mysql+aiomysql://u:p@db/bici"
+        assert async_database_url("sqlite:///bici.db") == "sqlite+aiosqlite:///bici.db"
+        assert async_database_url("mysql+asyncmy://u:p@db/bici") == "mysql+asyncmy://u:p@db/bici"
+
+
+class TestAvvio:
+    """Test per l'app factory e l'inizializzazione pigra dell'engine"""
+
+    def test_import_senza_connessioni(self):
+        """Test importare i moduli non crea l'engine né apre connessioni"""
+        import subprocess
+        import sys
+
+        codice = (
+            "import app, models, services; "
+            "assert models._engine is None; "
+            "app.create_app(); "
+            "assert models._engine is None"
+        )
+        risultato = subprocess.run([sys.executable, "-c", codice], capture_output=True, text=True)
+        assert risultato.returncode == 0, risultato.stderr
+
+    def test_engine_creato_al_primo_uso(self, test_app):
+        """Test models.db è l'engine configurato dall'app factory"""
+        import models
+
+        assert models.db is models.get_engine()
+        assert str(models.db.url) == "sqlite://"
+
+    def test_comando_init_db(self, tmp_path):
+        """Test il comando CLI crea lo schema"""
+        from app import create_app
+        import models
+
+        url = f"sqlite:///{tmp_path / 'init.db'}"
+        app = create_app({"DATABASE_URL": url})
+        result = app.test_cli_runner().invoke(args=["init-db"])
+
+        assert result.exit_code == 0
+        assert "biciclette" in sa.inspect(models.get_engine()).get_table_names()
+        models.configure_engine()
+
+    def test_dopo_fork(self, test_app):
+        """Test dopo un fork il pool del figlio riparte vuoto"""
+        import models
+
+        vecchio_pool = models.get_engine().pool
+        models._dispose_after_fork()
+        assert models.get_engine().pool is not vecchio_pool
@@ -0,0 +1,145 @@
+# test_leaderboard.py - Test per la classifica della flotta per distanza
+import json
+import random
+
+from leaderboard import Leaderboard
+
+
+class TestLeaderboard:
+    """Test per Leaderboard"""
+
+    def test_top_e_bottom_come_ordinamento(self):
+        """Test top/bottom coincidono con l'ordinamento completo dopo molti aggiornamenti"""
+        rng = random.Random(3)
+        board = Leaderboard()
+        distanze = {}
+        for _ in range(2000):
+            bici_id = rng.randrange(200)
+            if rng.random() < 0.1:
+                board.remove(bici_id)
+                distanze.pop(bici_id, None)
+            else:
+                distanze[bici_id] = round(rng.random() * 500, 1)
+                board.set(bici_id, distanze[bici_id])
+
+        attesi = sorted((d, i) for i, d in distanze.items())
+        assert len(board) == len(distanze)
+        assert board.top(10) == attesi[::-1][:10]
+        assert board.bottom(10) == attesi[:10]
+        assert board.top(10000) == attesi[::-1]
+
+    def test_molti_blocchi(self):
+        """Test l'ordine resta corretto quando i blocchi si dividono e si svuotano"""
+        rng = random.Random(11)
+        board = Leaderboard()
+        distanze = {}
+        for bici_id in range(5000):
+            distanze[bici_id] = rng.random() * 1000
+            board.set(bici_id, distanze[bici_id])
+        for bici_id in rng.sample(range(5000), 4000):
+            if rng.random() < 0.5:
+                board.remove(bici_id)
+                del distanze[bici_id]
+            else:
+                distanze[bici_id] = rng.random() * 1000
+                board.set(bici_id, distanze[bici_id])
+
+        attesi = sorted((d, i) for i, d in distanze.items())
+        assert len(board) == len(distanze)
+        assert board.top(len(attesi)) == attesi[::-1]
+        assert board.bottom(len(attesi)) == attesi
+        assert board.top(700) == attesi[::-1][:700]
+        assert board.bottom(1500) == attesi[:1500]
+
+    def test_casi_limite(self):
+        board = Leaderboard()
+        assert board.top(5) == []
+        board.set(1, 3)
+        assert board.top(0) == []
+        assert board.bottom(0) == []
+        assert board.distance(1) == 3.0
+        assert board.remove(2) is False
+
+
+class TestClassificaAPI:
+    """Test per GET /api/biciclette/classifica"""
+
+    def test_classifica(self, client, session):
+        from models import Bicicletta
+
+        biciclette = []
+        for distanza in (5.0, 12.5, 0.0, 7.25):
+            bici = Bicicletta()
+            bici.add_distance(distanza)
+            biciclette.append(bici)
+        session.add_all(biciclette)
+        session.commit()
+
+        data = json.loads(client.get("/api/biciclette/classifica?n=2").data)["data"]
+        assert [b["distanzaPercorsa"] for b in data] == [12.5, 7.25]
+        assert data[0] == {"posizione": 1, "ID": biciclette[1].ID, "distanzaPercorsa": 12.5}
+
+        data = json.loads(client.get("/api/biciclette/classifica?n=2&ordine=bottom").data)["data"]
+        assert [b["distanzaPercorsa"] for b in data] == [0.0, 5.0]
+
+    def test_classifica_segue_telemetria_e_modifiche(self, client, session):
+        """La classifica già caricata è aggiornata da telemetria, create e delete"""
+        from models import Bicicletta
+
+        bici = Bicicletta()
+        bici.update_position(45.46, 9.19)
+        bici.add_distance(1.0)
+        session.add(bici)
+        session.commit()
+        bici_id = bici.ID
+
+        assert len(json.loads(client.get("/api/biciclette/classifica").data)["data"]) == 1
+
+        nuova_id = json.loads(client.post("/api/biciclette").data)["data"]["ID"]
+        client.post(f"/api/simulazione/{bici_id}", json={"latitudine": 45.47, "longitudine": 9.19})
+
+        data = json.loads(client.get("/api/biciclette/classifica").data)["data"]
+        assert [b["ID"] for b in data] == [bici_id, nuova_id]
+        assert data[0]["distanzaPercorsa"] > 2.0
+
+        client.delete(f"/api/biciclette/{bici_id}")
+        data = json.loads(client.get("/api/biciclette/classifica").data)["data"]
+        assert [b["ID"] for b in data] == [nuova_id]
+
+    def test_classifica_segue_orm_e_riconsegne(self, client, session, sample_user, sample_station):
+        """La classifica segue add_distance fuori dai servizi e la distanza delle riconsegne"""
+        from models import Bicicletta
+
+        bici = Bicicletta()
+        session.add(bici)
+        session.commit()
+        assert json.loads(client.get("/api/biciclette/classifica").data)["data"][0]["distanzaPercorsa"] == 0.0
+
+        bici.add_distance(2.5)
+        session.flush()
+        session.rollback()  # annullata: la classifica non cambia
+        assert json.loads(client.get("/api/biciclette/classifica").data)["data"][0]["distanzaPercorsa"] == 0.0
+
+        bici.add_distance(4.0)
+        session.commit()
+        assert json.loads(client.get("/api/biciclette/classifica").data)["data"][0]["distanzaPercorsa"] == 4.0
+
+        for tipo, extra in (
+            ("noleggio", {}),
+            ("riconsegna", {"distanzaPercorsa": -1}),
+            ("riconsegna", {"distanzaPercorsa": 3.5}),
+        ):
+            response = client.post("/api/operazioni", json={
+                "tipo": tipo, "idUtente": sample_user.id, "idBicicletta": bici.ID,
+                "idStazione": sample_station.ID, **extra,
+            })
+            assert response.status_code == (400 if extra.get("distanzaPercorsa") == -1 else 201)
+
+        data = json.loads(client.get("/api/biciclette/classifica").data)["data"]
+        assert data == [{"posizione": 1, "ID": bici.ID, "distanzaPercorsa": 7.5}]
+        session.refresh(bici)
+        assert bici.distanzaPercorsa == 7.5
+
+    def test_parametri_non_validi(self, client):
+        assert client.get("/api/biciclette/classifica?ordine=medio").status_code == 400
+        assert client.get("/api/biciclette/classifica?n=0").status_code == 400
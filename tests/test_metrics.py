@@ -0,0 +1,144 @@
+# test_metrics.py - Test per le metriche Prometheus
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.pool import StaticPool
+
+import metrics
+
+
+class TestFormato:
+    """Test per contatori e istogrammi nel formato testuale"""
+
+    def test_istogramma_cumulativo(self):
+        h = metrics.Histogram("prova_seconds", "Prova", ("route",), buckets=(0.1, 1.0))
+        for valore in (0.05, 0.5, 0.5, 3.0):
+            h.observe(valore, '/a"b')
+
+        assert h.render() == [
+            "# HELP prova_seconds Prova",
+            "# TYPE prova_seconds histogram",
+            'prova_seconds_bucket{route="/a\\"b",le="0.1"} 1',
+            'prova_seconds_bucket{route="/a\\"b",le="1.0"} 3',
+            'prova_seconds_bucket{route="/a\\"b",le="+Inf"} 4',
+            'prova_seconds_sum{route="/a\\"b"} 4.05',
+            'prova_seconds_count{route="/a\\"b"} 4',
+        ]
+
+    def test_contatore(self):
+        c = metrics.Counter("prova_total", "Prova", ("tipo",))
+        c.inc("x")
+        c.inc("x", amount=2)
+        assert c.value("x") == 3
+        assert 'prova_total{tipo="x"} 3' in c.render()
+
+
+class TestRichieste:
+    """Test per il middleware e GET /metrics"""
+
+    def test_richiesta_misurata(self, client, sample_bike):
+        route = "/api/biciclette/<int:bike_id>/status"
+        labels = ("GET", route, "200")
+        richieste = metrics.REQUESTS.value(*labels)
+        campionate = metrics.REQUEST_SECONDS.count(*labels)
+        query = metrics.SQL_STATEMENTS.sum(route)
+
+        assert client.get(f"/api/biciclette/{sample_bike.ID}/status").status_code == 200
+
+        assert metrics.REQUESTS.value(*labels) == richieste + 1
+        assert metrics.REQUEST_SECONDS.count(*labels) == campionate + 1
+        assert metrics.SQL_STATEMENTS.sum(route) >= query + 1
+
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.content_type == metrics.CONTENT_TYPE
+        testo = response.get_data(as_text=True)
+        assert f'http_requests_total{{method="GET",route="{route}",status="200"}}' in testo
+        assert "# TYPE http_request_sql_seconds histogram" in testo
+
+    def test_stato_e_route_non_trovata(self, client):
+        richieste = metrics.REQUESTS.value("GET", "<non trovata>", "404")
+        client.get("/non/esiste")
+        assert metrics.REQUESTS.value("GET", "<non trovata>", "404") == richieste + 1
+
+    def test_campionamento_disattivato(self):
+        from app import create_app
+
+        app = create_app({
+            "TESTING": True,
+            "DATABASE_URL": "sqlite://",
+            "DATABASE_OPTIONS": {"poolclass": StaticPool, "connect_args": {"check_same_thread": False}},
+            "METRICS_SAMPLE_RATE": 0,
+        })
+        labels = ("GET", "/api/info", "200")
+        richieste = metrics.REQUESTS.value(*labels)
+        campionate = metrics.REQUEST_SECONDS.count(*labels)
+
+        app.test_client().get("/api/info")
+
+        assert metrics.REQUESTS.value(*labels) == richieste + 1
+        assert metrics.REQUEST_SECONDS.count(*labels) == campionate
+
+    def test_errori_database(self, test_app):
+        from models import get_engine
+
+        errori = metrics.SQL_ERRORS.value("", "OperationalError")
+        with pytest.raises(sa.exc.OperationalError):
+            with get_engine().connect() as conn:
+                conn.execute(sa.text("SELECT * FROM tabella_inesistente"))
+        assert metrics.SQL_ERRORS.value("", "OperationalError") == errori + 1
+
+    def test_attesa_pool(self):
+        from models import TimedQueuePool
+
+        engine = sa.create_engine("sqlite://", poolclass=TimedQueuePool, pool_size=1)
+        stats = metrics._RequestStats("/prova", 0.0)
+        token = metrics._current.set(stats)
+        try:
+            with engine.connect() as conn:
+                conn.execute(sa.text("SELECT 1"))
+        finally:
+            metrics._current.reset(token)
+        assert stats.statements == 1
+        assert stats.pool_wait > 0
+
+
+class TestBudgetQuery:
+    """Test per il limite di query SQL per richiesta"""
+
+    def test_richiesta_oltre_il_budget(self):
+        from app import create_app
+        from models import init_db
+
+        def app_con_budget(**config):
+            app = create_app({
+                "DATABASE_URL": "sqlite://",
+                "DATABASE_OPTIONS": {"poolclass": StaticPool, "connect_args": {"check_same_thread": False}},
+                "QUERY_BUDGET": 0,
+                **config,
+            })
+            init_db()
+            return app.test_client()
+
+        route = "/api/utenti/<int:user_id>/profilo"
+        superate = metrics.QUERY_BUDGET_EXCEEDED.value("GET", route)
+
+        with pytest.raises(metrics.QueryBudgetExceeded):
+            app_con_budget(TESTING=True).get("/api/utenti/1/profilo")
+        assert metrics.QUERY_BUDGET_EXCEEDED.value("GET", route) == superate + 1
+
+        # Fuori dai test il superamento è solo registrato e segnalato nel log
+        assert app_con_budget().get("/api/utenti/1/profilo").status_code == 404
+        assert metrics.QUERY_BUDGET_EXCEEDED.value("GET", route) == superate + 2
+
+    def test_query_budget(self, session, sample_bike):
+        from models import Bicicletta
+
+        with metrics.query_budget(1) as conteggio:
+            session.execute(sa.select(Bicicletta)).all()
+        assert conteggio == [1]
+
+        # Relazione lazy letta riga per riga: una query in più per bicicletta
+        with pytest.raises(metrics.QueryBudgetExceeded):
+            with metrics.query_budget(1):
+                for bici in session.scalars(sa.select(Bicicletta)).all():
+                    bici.operazioni
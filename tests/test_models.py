@@ -118,8 +118,37 @@ class TestBicicletta:
         """Test aggiornamento posizione bicicletta"""
         sample_bike.update_position(45.4642, 9.1900)
         
-        assert sample_bike.latitudine == "45.4642"
-        assert sample_bike.longitudine == "9.1900"
+        assert sample_bike.latitudine == 45.4642
+        assert sample_bike.longitudine == 9.19
+        assert sample_bike.has_position() is True
+
+    def test_bicicletta_update_position_somma_distanza(self, sample_bike):
+        """Test distanza accumulata dagli spostamenti (non dal primo fix)"""
+        from geo import haversine
+
+        assert sample_bike.update_position(45.46, 9.19) == 0.0
+        delta = sample_bike.update_position(45.47, 9.19)
+
+        assert delta == pytest.approx(haversine(45.46, 9.19, 45.47, 9.19))
+        assert sample_bike.distanzaPercorsa == pytest.approx(delta)
+        # Rumore del GPS sotto la soglia
+        assert sample_bike.update_position(45.47001, 9.19) == 0.0
+        assert sample_bike.distanzaPercorsa == pytest.approx(delta)
+
+    def test_bicicletta_update_position_fix_non_validi(self, sample_bike):
+        """Test un fix a (0, 0) o fuori dai limiti non sposta la bici né somma distanza"""
+        sample_bike.update_position(45.46, 9.19)
+
+        assert sample_bike.update_position(0, 0) == 0.0
+        assert (sample_bike.latitudine, sample_bike.longitudine) == (45.46, 9.19)
+        for lat, lon in ((91.0, 9.19), (45.46, -181.0), (float("nan"), 9.19)):
+            with pytest.raises(ValueError):
+                sample_bike.update_position(lat, lon)
+
+        # Il fix successivo conta solo il tratto reale
+        delta = sample_bike.update_position(45.47, 9.19)
+        assert delta < 2
+        assert sample_bike.distanzaPercorsa == pytest.approx(delta)
 
     def test_bicicletta_add_distance(self, sample_bike):
         """Test aggiunta distanza percorsa"""
@@ -0,0 +1,361 @@
+# test_operazioni.py - Test per il motore di noleggio e riconsegna
+import pytest
+import json
+import os
+import threading
+
+import sqlalchemy as sa
+
+
+def _noleggio(client, utente, bici, stazione, tipo="noleggio"):
+    return client.post("/api/operazioni", json={
+        "tipo": tipo,
+        "idUtente": utente,
+        "idBicicletta": bici,
+        "idStazione": stazione,
+    })
+
+
+class TestOperazioniAPI:
+    """Test per POST /api/operazioni"""
+
+    def test_noleggio_e_riconsegna(self, client, session, sample_user, sample_bike, sample_station):
+        """Test ciclo completo noleggio -> riconsegna"""
+        from models import Stazione
+
+        response = _noleggio(client, sample_user.id, sample_bike.ID, sample_station.ID)
+
+        assert response.status_code == 201
+        data = json.loads(response.data)
+        assert data["status"] == "success"
+        assert data["data"]["tipo"] == "noleggio"
+
+        status = json.loads(client.get(f"/api/biciclette/{sample_bike.ID}/status").data)
+        assert status["data"]["noleggiata"] is True
+        session.expire_all()
+        assert session.get(Stazione, sample_station.ID).numBiciclette == 4
+
+        response = _noleggio(client, sample_user.id, sample_bike.ID, sample_station.ID, "riconsegna")
+
+        assert response.status_code == 201
+        assert json.loads(response.data)["data"]["tipo"] == "riconsegna"
+        status = json.loads(client.get(f"/api/biciclette/{sample_bike.ID}/status").data)
+        assert status["data"]["noleggiata"] is False
+        session.expire_all()
+        assert session.get(Stazione, sample_station.ID).numBiciclette == 5
+
+    def test_doppio_noleggio_rifiutato(self, client, sample_user, sample_bike, sample_station):
+        """Test la stessa bicicletta non può essere noleggiata due volte"""
+        assert _noleggio(client, sample_user.id, sample_bike.ID, sample_station.ID).status_code == 201
+
+        response = _noleggio(client, sample_user.id, sample_bike.ID, sample_station.ID)
+
+        assert response.status_code == 409
+        assert json.loads(response.data)["message"] == "Bicicletta già noleggiata"
+
+    def test_riconsegna_senza_noleggio(self, client, sample_user, sample_bike, sample_station):
+        """Test riconsegna di una bicicletta non noleggiata"""
+        response = _noleggio(client, sample_user.id, sample_bike.ID, sample_station.ID, "riconsegna")
+        assert response.status_code == 409
+
+    def test_stazione_vuota_o_piena(self, client, session, sample_user, sample_bike, sample_station):
+        """Test stazione senza biciclette o senza slot liberi"""
+        from models import Stazione
+
+        vuota = Stazione(numSlot=5, numBiciclette=0, via="Via A", città="Milano", provincia="MI", regione="Lombardia")
+        piena = Stazione(numSlot=5, numBiciclette=5, via="Via B", città="Milano", provincia="MI", regione="Lombardia")
+        session.add_all([vuota, piena])
+        session.commit()
+
+        response = _noleggio(client, sample_user.id, sample_bike.ID, vuota.ID)
+        assert response.status_code == 409
+        # Il noleggio fallito non deve lasciare la bicicletta bloccata
+        status = json.loads(client.get(f"/api/biciclette/{sample_bike.ID}/status").data)
+        assert status["data"]["noleggiata"] is False
+
+        assert _noleggio(client, sample_user.id, sample_bike.ID, sample_station.ID).status_code == 201
+        response = _noleggio(client, sample_user.id, sample_bike.ID, piena.ID, "riconsegna")
+        assert response.status_code == 409
+        status = json.loads(client.get(f"/api/biciclette/{sample_bike.ID}/status").data)
+        assert status["data"]["noleggiata"] is True
+
+    def test_operazione_non_valida(self, client, sample_user, sample_bike, sample_station):
+        """Test richieste malformate o riferimenti inesistenti"""
+        assert client.post("/api/operazioni", json={"tipo": "noleggio"}).status_code == 400
+        assert _noleggio(client, sample_user.id, sample_bike.ID, sample_station.ID, "furto").status_code == 400
+        assert _noleggio(client, 999, sample_bike.ID, sample_station.ID).status_code == 404
+        assert _noleggio(client, sample_user.id, 999, sample_station.ID).status_code == 404
+        assert _noleggio(client, sample_user.id, sample_bike.ID, 999).status_code == 404
+
+
+
+class TestStoricoUtente:
+    """Test per GET /api/operazioni/utente/<id> paginato"""
+
+    @pytest.fixture()
+    def storico(self, session, sample_user, sample_bike, sample_station):
+        """25 operazioni, una al giorno dal 1 al 25 gennaio 2024"""
+        from datetime import date
+        from models import Operazione
+
+        operazioni = []
+        for giorno in range(1, 26):
+            op = Operazione("noleggio", sample_user.id, sample_bike.ID, sample_station.ID)
+            op.data = date(2024, 1, giorno)
+            operazioni.append(op)
+        session.add_all(operazioni)
+        session.commit()
+        return [op.ID for op in operazioni]
+
+    def test_senza_parametri_restituisce_tutto(self, client, sample_user, storico):
+        response = client.get(f"/api/operazioni/utente/{sample_user.id}")
+        data = json.loads(response.data)
+
+        assert response.status_code == 200
+        assert [op["ID"] for op in data["data"]] == storico[::-1]
+        assert "next_cursor" not in data
+
+    def test_paginazione_keyset(self, client, sample_user, storico):
+        """Le pagine seguono il cursore fino alla fine, senza duplicati"""
+        visti = []
+        url = f"/api/operazioni/utente/{sample_user.id}?limit=10"
+        while url:
+            data = json.loads(client.get(url).data)
+            assert len(data["data"]) <= 10
+            visti.extend(op["ID"] for op in data["data"])
+            cursor = data["next_cursor"]
+            url = cursor and f"/api/operazioni/utente/{sample_user.id}?limit=10&cursor={cursor}"
+
+        assert visti == storico[::-1]
+
+    def test_filtro_date(self, client, sample_user, storico):
+        response = client.get(
+            f"/api/operazioni/utente/{sample_user.id}?dal=2024-01-10&al=2024-01-14&limit=3"
+        )
+        data = json.loads(response.data)
+        assert [op["data"] for op in data["data"]] == ["2024-01-14", "2024-01-13", "2024-01-12"]
+
+        data = json.loads(client.get(
+            f"/api/operazioni/utente/{sample_user.id}"
+            f"?dal=2024-01-10&al=2024-01-14&limit=3&cursor={data['next_cursor']}"
+        ).data)
+        assert [op["data"] for op in data["data"]] == ["2024-01-11", "2024-01-10"]
+        assert data["next_cursor"] is None
+
+    def test_dettagli_senza_n_piu_1(self, client, session, sample_user, sample_station):
+        """Bicicletta e stazione di ogni operazione caricate nella stessa query"""
+        from metrics import query_budget
+        from models import Bicicletta, Operazione
+
+        biciclette = [Bicicletta() for _ in range(10)]
+        session.add_all(biciclette)
+        session.flush()
+        session.add_all(
+            Operazione("noleggio", sample_user.id, bici.ID, sample_station.ID) for bici in biciclette
+        )
+        session.commit()
+        url = f"/api/operazioni/utente/{sample_user.id}?dettagli=1&limit=5"
+        attese = [b.ID for b in biciclette[::-1][:5]]
+
+        with query_budget(1):
+            response = client.get(url)
+
+        data = json.loads(response.data)["data"]
+        assert [op["bicicletta"]["ID"] for op in data] == attese
+        assert all(op["stazione"]["città"] == "Milano" for op in data)
+        assert all(op["bicicletta"]["ID"] == op["idBicicletta"] for op in data)
+
+    def test_parametri_non_validi(self, client, sample_user):
+        for query in ("limit=0", "limit=abc", "cursor=%%%", "dal=ieri", "al=2024-13-01"):
+            response = client.get(f"/api/operazioni/utente/{sample_user.id}?{query}")
+            assert response.status_code == 400, query
+
+
+@pytest.fixture(params=["sincrono", "gruppo"])
+def modalita_scrittura(request):
+    """Scritture con un COMMIT ciascuna oppure con il commit di gruppo"""
+    from writebuffer import write_buffer
+
+    write_buffer.configure(enabled=request.param == "gruppo")
+    yield request.param
+    write_buffer.configure(enabled=False)
+
+
+def _in_parallelo(n_thread, funzione):
+    """Esegue funzione(i) su n_thread thread partiti insieme.
+
+    Un'eccezione in un thread è rilanciata nel thread del test, che
+    altrimenti non la vedrebbe.
+    """
+    barriera = threading.Barrier(n_thread)
+    risultati = [None] * n_thread
+    eccezioni = []
+
+    def lavoro(i):
+        barriera.wait()
+        try:
+            risultati[i] = funzione(i)
+        except BaseException as e:
+            eccezioni.append(e)
+
+    threads = [threading.Thread(target=lavoro, args=(i,)) for i in range(n_thread)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if eccezioni:
+        raise eccezioni[0]
+    return risultati
+
+
+def _popola(Session, n_utenti, n_bici, bici_in_stazione, slot):
+    """Utenti, biciclette e una stazione condivisa per i test di contesa"""
+    from models import Bicicletta, Stazione, Utente
+
+    with Session() as session:
+        utenti = [
+            Utente(
+                nome="U", cognome=str(i), email=f"u{i}@test.com", numTelefono="1",
+                cartaCredito="1", password="x", via="Via", città="Milano",
+                provincia="MI", regione="Lombardia",
+            )
+            for i in range(n_utenti)
+        ]
+        bici = [Bicicletta(codiceTag=f"t{i:05d}", gps=f"g{i:05d}") for i in range(n_bici)]
+        stazione = Stazione(
+            numSlot=slot, numBiciclette=bici_in_stazione, via="Via Hub",
+            città="Milano", provincia="MI", regione="Lombardia",
+        )
+        session.add_all(utenti + bici + [stazione])
+        session.commit()
+        return [u.id for u in utenti], [b.ID for b in bici], stazione.ID
+
+
+def _cicli_concorrenti(utenti, bici, stazione, cicli):
+    """Ogni utente noleggia e riconsegna la sua bicicletta, tutti in parallelo.
+
+    Restituisce le risposte non riuscite.
+    """
+    from services import BikeRentalService
+
+    def lavoro(i):
+        falliti = []
+        for _ in range(cicli):
+            for operazione in (BikeRentalService.rent_bike, BikeRentalService.return_bike):
+                r = operazione(utenti[i], bici[i], stazione)
+                if r["status"] != "success":
+                    falliti.append(r)
+        return falliti
+
+    return [r for falliti in _in_parallelo(len(utenti), lavoro) for r in falliti]
+
+
+@pytest.mark.usefixtures("modalita_scrittura")
+class TestContesa:
+    """Test multithread: correttezza sotto contesa"""
+
+    def test_stessa_bici_un_solo_vincitore(self, file_db):
+        """Test molti utenti sulla stessa bicicletta: un solo noleggio riesce"""
+        from services import BikeRentalService
+        from models import Operazione, Stazione
+
+        utenti, bici, stazione = _popola(file_db, 32, 1, 10, 20)
+
+        risultati = _in_parallelo(
+            32, lambda i: BikeRentalService.rent_bike(utenti[i], bici[0], stazione)
+        )
+
+        assert sum(r["status"] == "success" for r in risultati) == 1
+        assert all(r.get("code") == 409 for r in risultati if r["status"] != "success")
+        with file_db() as session:
+            assert session.scalar(sa.select(sa.func.count()).select_from(Operazione)) == 1
+            assert session.get(Stazione, stazione).numBiciclette == 9
+
+    def test_stazione_non_va_sotto_zero(self, file_db):
+        """Test più noleggi concorrenti delle biciclette presenti in stazione"""
+        from services import BikeRentalService
+        from models import Stazione
+
+        utenti, bici, stazione = _popola(file_db, 40, 40, 15, 40)
+
+        risultati = _in_parallelo(
+            40, lambda i: BikeRentalService.rent_bike(utenti[i], bici[i], stazione)
+        )
+
+        assert sum(r["status"] == "success" for r in risultati) == 15
+        with file_db() as session:
+            assert session.get(Stazione, stazione).numBiciclette == 0
+
+    def test_noleggi_riconsegne_concorrenti(self, file_db):
+        """Test cicli noleggio/riconsegna concorrenti: nessun errore e invarianti"""
+        from models import Bicicletta, Operazione, Stazione
+
+        n_thread, cicli = 16, 10
+        utenti, bici, stazione = _popola(file_db, n_thread, n_thread, n_thread, n_thread)
+
+        assert _cicli_concorrenti(utenti, bici, stazione, cicli) == []
+        with file_db() as session:
+            assert session.get(Stazione, stazione).numBiciclette == n_thread
+            assert session.scalar(
+                sa.select(sa.func.count()).where(Bicicletta.idUtenteNoleggio.is_not(None))
+            ) == 0
+            assert session.scalar(
+                sa.select(sa.func.count()).select_from(Operazione)
+            ) == n_thread * cicli * 2
+
+    def test_deadlock_ripetuto(self, file_db, monkeypatch):
+        """Test un noleggio scelto come vittima di un deadlock viene ripetuto"""
+        import services
+        from sqlalchemy.exc import OperationalError
+        from services import BikeRentalService
+
+        utenti, bici, stazione = _popola(file_db, 1, 1, 1, 1)
+        run = services.write_buffer.run
+        chiamate = []
+
+        def run_con_deadlock(lavoro, *args):
+            chiamate.append(lavoro)
+            if len(chiamate) == 1:
+                raise OperationalError("UPDATE stazioni", {}, Exception(1213, "Deadlock found"))
+            return run(lavoro, *args)
+
+        monkeypatch.setattr(services.write_buffer, "run", run_con_deadlock)
+        r = BikeRentalService.rent_bike(utenti[0], bici[0], stazione)
+
+        assert r["status"] == "success"
+        assert len(chiamate) == 2
+
+
+@pytest.mark.skipif(
+    not os.environ.get("MYSQL_TEST_URL"),
+    reason="richiede MYSQL_TEST_URL, un database MySQL usa e getta",
+)
+class TestContesaMySQL:
+    """Deadlock di InnoDB, che SQLite (un lock su tutto il database) non riproduce"""
+
+    @pytest.fixture()
+    def mysql_db(self, test_app):
+        import cache
+        import models
+
+        models.configure_engine(os.environ["MYSQL_TEST_URL"])
+        models.Base.metadata.drop_all(models.get_engine())
+        models.init_db()
+        cache.reset_all()
+        yield models.Session
+        models.Base.metadata.drop_all(models.get_engine())
+        models.configure_engine()
+
+    def test_stessa_stazione_senza_deadlock(self, mysql_db, monkeypatch):
+        """Test noleggi e riconsegne concorrenti sulla stessa stazione senza 1213"""
+        import services
+        from models import Stazione
+
+        n_thread, cicli = 32, 20
+        utenti, bici, stazione = _popola(mysql_db, n_thread, n_thread, n_thread, n_thread)
+        # Senza ripetizioni: un deadlock arriva al test come errore 500
+        monkeypatch.setattr(services, "_TENTATIVI_DEADLOCK", 1)
+
+        assert _cicli_concorrenti(utenti, bici, stazione, cicli) == []
+        with mysql_db() as session:
+            assert session.get(Stazione, stazione).numBiciclette == n_thread
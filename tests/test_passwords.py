@@ -0,0 +1,139 @@
+# test_passwords.py - Test per gli hash delle password e l'aggiornamento dei vecchi MD5
+import hashlib
+import time
+
+import pytest
+import sqlalchemy as sa
+
+import passwords
+from models import Admin, Utente
+
+
+@pytest.fixture()
+def md5_user(session, sample_user):
+    """sample_user con l'hash MD5 senza sale della versione precedente"""
+    session.execute(
+        sa.update(Utente)
+        .where(Utente.id == sample_user.id)
+        .values(password=hashlib.md5(b"password123").hexdigest())
+    )
+    session.commit()
+    return sample_user
+
+
+class TestHasher:
+    """Test per il formato e la verifica degli hash"""
+
+    def test_hash_con_sale(self, test_app):
+        """Due hash della stessa password sono diversi e verificabili"""
+        primo = passwords.hash_password("segreta")
+        secondo = passwords.hash_password("segreta")
+
+        assert primo != secondo
+        assert primo.startswith("pbkdf2_sha256$1000$")
+        assert len(primo) <= 128
+        assert passwords.verify_password(primo, "segreta") is True
+        assert passwords.verify_password(primo, "sbagliata") is False
+        assert passwords.needs_rehash(primo) is False
+
+    def test_md5_verificato_e_da_aggiornare(self, test_app):
+        """Un vecchio hash MD5 è ancora valido ma va ricalcolato"""
+        vecchio = hashlib.md5(b"segreta").hexdigest()
+
+        assert passwords.identify(vecchio) == "md5"
+        assert passwords.verify_password(vecchio, "segreta") is True
+        assert passwords.verify_password(vecchio, "sbagliata") is False
+        assert passwords.needs_rehash(vecchio) is True
+
+    def test_costo_aumentato(self, test_app):
+        """Gli hash con meno iterazioni del costo corrente vanno ricalcolati"""
+        from app import create_app
+
+        economico = passwords.hash_password("segreta")
+        create_app({"PASSWORD_COST": 2000})
+
+        assert passwords.needs_rehash(economico) is True
+        assert passwords.verify_password(economico, "segreta") is True
+        assert passwords.hash_password("segreta").startswith("pbkdf2_sha256$2000$")
+        assert passwords.dummy_hash().startswith("pbkdf2_sha256$2000$")
+
+    def test_costo_minimo(self):
+        """Un costo troppo basso è rifiutato"""
+        with pytest.raises(ValueError):
+            passwords.Pbkdf2Hasher(cost=10)
+
+    def test_pool_di_processi(self, test_app):
+        """Hash e verifica nel pool danno lo stesso risultato"""
+        from app import create_app
+
+        create_app({"PASSWORD_WORKERS": 1})
+
+        stored = passwords.hash_password("segreta")
+        assert passwords.verify_password(stored, "segreta") is True
+        assert passwords.verify_password(stored, "sbagliata") is False
+
+
+class TestEmailSconosciuta:
+    """Test per i tempi di login con email non registrate"""
+
+    def test_stesso_costo_di_una_password_sbagliata(self, test_app):
+        """Un'email sconosciuta verifica un hash con il PASSWORD_COST configurato"""
+        from app import create_app
+
+        client = create_app({"TESTING": True, "PASSWORD_COST": 200000}).test_client()
+
+        def durata(email):
+            credenziali = {"email": email, "password": "sbagliata"}
+            inizio = time.perf_counter()
+            assert client.post("/api/auth/login", json=credenziali).status_code == 401
+            return time.perf_counter() - inizio
+
+        durata("ignoto@test.com")  # calcola l'hash fittizio
+        assert passwords.dummy_hash().startswith("pbkdf2_sha256$200000$")
+
+        riferimento = min(durata("ignoto@test.com") for _ in range(3))
+        inizio = time.perf_counter()
+        passwords.get_hasher().verify(passwords.dummy_hash(), "sbagliata")
+        verifica = time.perf_counter() - inizio
+        assert riferimento >= 0.5 * verifica
+
+
+class TestAggiornamentoAlLogin:
+    """Test per la sostituzione degli hash superati al login"""
+
+    def test_login_aggiorna_md5(self, client, session, md5_user):
+        """Il primo login riuscito sostituisce l'hash MD5"""
+        credenziali = {"email": "mario@test.com", "password": "password123"}
+        assert client.post("/api/auth/login", json=credenziali).status_code == 200
+
+        session.expire_all()
+        nuovo = session.get(Utente, md5_user.id).password
+        assert nuovo.startswith("pbkdf2_sha256$")
+
+        # Il login successivo usa il nuovo hash (la cache è stata invalidata)
+        assert client.post("/api/auth/login", json=credenziali).status_code == 200
+        session.expire_all()
+        assert session.get(Utente, md5_user.id).password == nuovo
+
+    def test_login_sbagliato_non_aggiorna(self, client, session, md5_user):
+        """Una password errata lascia l'hash MD5 com'è"""
+        credenziali = {"email": "mario@test.com", "password": "sbagliata"}
+        assert client.post("/api/auth/login", json=credenziali).status_code == 401
+
+        session.expire_all()
+        assert session.get(Utente, md5_user.id).password == hashlib.md5(b"password123").hexdigest()
+
+    def test_login_admin_aggiorna_md5(self, client, session):
+        """Anche gli admin passano al nuovo hash"""
+        admin = Admin(email="admin@test.com", password="admin123")
+        admin.password = hashlib.md5(b"admin123").hexdigest()
+        session.add(admin)
+        session.commit()
+
+        credenziali = {"email": "admin@test.com", "password": "admin123"}
+        response = client.post("/api/auth/login", json=credenziali)
+        assert response.status_code == 200
+        assert response.get_json()["tipoUtente"] == "admin"
+
+        session.expire_all()
+        assert session.get(Admin, admin.ID).password.startswith("pbkdf2_sha256$")
@@ -0,0 +1,30 @@
+# test_projection.py - Test per il percorso di lettura a colonne
+import sqlalchemy as sa
+
+from models import Bicicletta, Operazione, Stazione, Utente
+from projection import BICICLETTA, OPERAZIONE, STAZIONE, UTENTE
+
+
+class TestProjection:
+    """Le proiezioni producono gli stessi dizionari di to_dict()"""
+
+    def test_come_to_dict(self, session, sample_operation):
+        noleggiata = session.get(Bicicletta, sample_operation.idBicicletta)
+        noleggiata.idUtenteNoleggio = sample_operation.idUtente
+        libera = Bicicletta()
+        libera.update_position(45.1, 9.2)
+        session.add(libera)
+        session.commit()
+
+        for projection, model in (
+            (BICICLETTA, Bicicletta),
+            (STAZIONE, Stazione),
+            (UTENTE, Utente),
+            (OPERAZIONE, Operazione),
+        ):
+            attesi = [obj.to_dict() for obj in session.scalars(sa.select(model))]
+            assert projection.all(session, projection.select()) == attesi
+            assert list(projection.keys) == list(attesi[0].keys())
+
+    def test_utente_senza_password(self):
+        assert "password" not in UTENTE.keys
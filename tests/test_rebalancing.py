@@ -0,0 +1,135 @@
+# test_rebalancing.py - Test per il pianificatore di ribilanciamento
+import json
+import time
+
+import numpy as np
+import pytest
+
+from rebalancing import CONSEGNA, PRELIEVO, distance_matrix, imbalance, parse_plan_args, plan_routes
+
+
+def _bilancio(saldo, giri):
+    """Saldo dopo aver eseguito i giri, verificando i carichi dei furgoni"""
+    saldo = np.array(saldo)
+    for _, fermate in giri:
+        carico = 0
+        for s, azione, q in fermate:
+            if azione == PRELIEVO:
+                carico += q
+                saldo[s] -= q
+            else:
+                carico -= q
+                saldo[s] += q
+            assert 0 <= carico <= 20
+        assert carico == 0
+    return saldo
+
+
+class TestPlanner:
+    """Test per il calcolo dei saldi e dei giri"""
+
+    def test_imbalance(self):
+        assert imbalance([9, 0, 5], [10, 10, 11]).tolist() == [4, -5, -1]
+        assert imbalance([9], [10], target=1.0).tolist() == [-1]
+
+    def test_distance_matrix(self):
+        from geo import haversine
+
+        d = distance_matrix([45.46, 45.47, 45.50], [9.19, 9.20, 9.10])
+        assert d.shape == (3, 3)
+        assert np.allclose(np.diag(d), 0)
+        assert d[0, 2] == pytest.approx(haversine(45.46, 9.19, 45.50, 9.10))
+        assert np.allclose(d, d.T)
+
+    def test_giro_semplice(self):
+        # Due stazioni in eccesso e una in difetto, un furgone
+        lat = [45.46, 45.47, 45.48, 45.60]
+        lon = [9.19, 9.19, 9.19, 9.19]
+        saldo = [3, 0, -5, 2]
+
+        giri = plan_routes(lat, lon, saldo, furgoni=1, capacita=20)
+
+        assert len(giri) == 1
+        _, fermate = giri[0]
+        # Parte dalla stazione più in eccesso, poi consegna
+        assert fermate[0] == (0, PRELIEVO, 3)
+        assert _bilancio(saldo, giri).tolist() == [0, 0, 0, 0]
+
+    def test_prelievi_limitati_al_difetto(self):
+        giri = plan_routes([45.46, 45.47], [9.19, 9.19], [10, -4], furgoni=2, capacita=20)
+        assert _bilancio([10, -4], giri).tolist() == [6, 0]
+
+    def test_capacita_e_deposito(self):
+        rng = np.random.default_rng(3)
+        n = 200
+        lat = 45.40 + rng.uniform(0, 0.1, n)
+        lon = 9.10 + rng.uniform(0, 0.1, n)
+        saldo = rng.integers(-15, 16, n)
+
+        giri = plan_routes(lat, lon, saldo, furgoni=4, capacita=20, deposito=(45.45, 9.15))
+
+        assert len(giri) == 4
+        residuo = _bilancio(saldo, giri)
+        # Finisce l'eccesso o il difetto: nessuna stazione peggiora
+        assert (residuo <= 0).all() or (residuo >= 0).all()
+        assert (np.abs(residuo) <= np.abs(saldo)).all()
+
+    def test_mille_stazioni_sotto_il_secondo(self):
+        rng = np.random.default_rng(1)
+        n = 1000
+        slot = rng.integers(10, 40, n)
+        saldo = imbalance(rng.integers(0, slot + 1), slot)
+        lat = 45.40 + rng.uniform(0, 0.15, n)
+        lon = 9.10 + rng.uniform(0, 0.2, n)
+
+        start = time.perf_counter()
+        giri = plan_routes(lat, lon, saldo, furgoni=5, capacita=20)
+        assert time.perf_counter() - start < 1.0
+        _bilancio(saldo, giri)
+
+    def test_parse_plan_args(self):
+        assert parse_plan_args({}) == (3, 20, 0.5, None)
+        assert parse_plan_args({"furgoni": "2", "lat": "45.4", "lon": "9.1"}) == (2, 20, 0.5, (45.4, 9.1))
+        for args in ({"furgoni": "0"}, {"capacita": "x"}, {"target": "2"}, {"lat": "45"}):
+            with pytest.raises(ValueError):
+                parse_plan_args(args)
+
+
+class TestRibilanciamentoAPI:
+    """Test per GET /api/admin/ribilanciamento"""
+
+    def test_piano(self, client, session):
+        from models import Stazione
+
+        piena = Stazione(numSlot=10, numBiciclette=9, via="A", città="Milano", provincia="MI",
+                         regione="Lombardia", latitudine=45.46, longitudine=9.19)
+        vuota = Stazione(numSlot=10, numBiciclette=1, via="B", città="Milano", provincia="MI",
+                         regione="Lombardia", latitudine=45.47, longitudine=9.19)
+        pari = Stazione(numSlot=10, numBiciclette=5, via="C", città="Milano", provincia="MI",
+                        regione="Lombardia", latitudine=45.48, longitudine=9.19)
+        session.add_all([piena, vuota, pari])
+        session.commit()
+
+        response = client.get("/api/admin/ribilanciamento?furgoni=2&capacita=10")
+
+        assert response.status_code == 200
+        data = json.loads(response.data)["data"]
+        assert data["stazioniInEccesso"] == 1
+        assert data["stazioniInDifetto"] == 1
+        assert data["biciclette"] == 4
+        assert data["difettoResiduo"] == 0
+        assert data["furgoni"] == [
+            {
+                "furgone": 1,
+                "distanza": pytest.approx(data["distanzaTotale"]),
+                "fermate": [
+                    {"idStazione": piena.ID, "azione": PRELIEVO, "biciclette": 4},
+                    {"idStazione": vuota.ID, "azione": CONSEGNA, "biciclette": 4},
+                ],
+            }
+        ]
+
+    def test_parametri_non_validi(self, client):
+        response = client.get("/api/admin/ribilanciamento?furgoni=0")
+        assert response.status_code == 400
+        assert json.loads(response.data)["status"] == "error"
@@ -0,0 +1,120 @@
+# test_rollups.py - Test per i contatori orari della domanda
+import json
+from datetime import date, time
+
+import numpy as np
+
+from rollups import aggregate, bucket_keys, decode_keys
+
+
+def _op(session, tipo, utente, bici, stazione, giorno, ora):
+    from models import Operazione
+
+    op = Operazione(tipo, utente, bici, stazione)
+    op.data = giorno
+    op.ora = time(*ora)
+    session.add(op)
+    session.commit()
+    return op.ID
+
+
+class TestBucketKeys:
+    """Test per la codifica e l'aggregazione vettoriale dei bucket"""
+
+    def test_codifica_reversibile(self):
+        stazione = np.array([1, 7, 123456])
+        giorno = np.array(["2024-03-01", "1999-12-31", "2031-07-15"], dtype="datetime64[D]")
+        ora = np.array([0, 23, 12])
+        tipo = np.array([1, 0, 1])
+
+        s, g, o, t = decode_keys(bucket_keys(stazione, giorno, ora, tipo))
+        assert s.tolist() == stazione.tolist()
+        assert g.tolist() == giorno.tolist()
+        assert o.tolist() == ora.tolist()
+        assert t.tolist() == tipo.tolist()
+
+    def test_aggregazione(self):
+        chiavi, conteggi = aggregate(np.array([5, 3, 5, 5]))
+        assert chiavi.tolist() == [3, 5] and conteggi.tolist() == [1, 3]
+
+        chiavi, conteggi = aggregate(np.array([5, 3, 5]), np.array([2, 4, 1]))
+        assert chiavi.tolist() == [3, 5] and conteggi.tolist() == [4, 3]
+
+
+class TestDomanda:
+    """Test per GET /api/stazioni/domanda e la ricostruzione"""
+
+    def test_noleggio_e_riconsegna_incrementano(self, client, sample_user, sample_bike, sample_station):
+        for tipo in ("noleggio", "riconsegna"):
+            response = client.post(
+                "/api/operazioni",
+                json={
+                    "tipo": tipo,
+                    "idUtente": sample_user.id,
+                    "idBicicletta": sample_bike.ID,
+                    "idStazione": sample_station.ID,
+                },
+            )
+            assert response.status_code == 201
+
+        data = json.loads(client.get("/api/stazioni/domanda").data)["data"]
+        assert len(data) >= 1
+        assert sum(b["noleggi"] for b in data) == 1
+        assert sum(b["riconsegne"] for b in data) == 1
+        assert {b["idStazione"] for b in data} == {sample_station.ID}
+
+    def test_noleggio_fallito_non_conta(self, client, session, sample_user, sample_bike, sample_station):
+        sample_station.numBiciclette = 0
+        session.commit()
+
+        response = client.post(
+            "/api/operazioni",
+            json={
+                "tipo": "noleggio",
+                "idUtente": sample_user.id,
+                "idBicicletta": sample_bike.ID,
+                "idStazione": sample_station.ID,
+            },
+        )
+        assert response.status_code == 409
+        assert json.loads(client.get("/api/stazioni/domanda").data)["data"] == []
+
+    def test_ricostruzione_e_filtri(self, client, session, sample_user, sample_bike, sample_station):
+        u, b, s = sample_user.id, sample_bike.ID, sample_station.ID
+        _op(session, "noleggio", u, b, s, date(2024, 3, 1), (8, 5))
+        _op(session, "riconsegna", u, b, s, date(2024, 3, 1), (8, 40))
+        _op(session, "noleggio", u, b, s, date(2024, 3, 1), (8, 50))
+        _op(session, "noleggio", u, b, s, date(2024, 3, 2), (17, 0))
+
+        response = client.post("/api/stazioni/domanda/ricostruisci")
+        assert response.status_code == 200
+        assert json.loads(response.data)["data"] == {"operazioni": 4, "bucket": 3}
+
+        data = json.loads(client.get("/api/stazioni/domanda").data)["data"]
+        assert data == [
+            {"idStazione": s, "giorno": "2024-03-01", "ora": 8, "noleggi": 2, "riconsegne": 1},
+            {"idStazione": s, "giorno": "2024-03-02", "ora": 17, "noleggi": 1, "riconsegne": 0},
+        ]
+
+        data = json.loads(client.get("/api/stazioni/domanda?dal=2024-03-02&al=2024-03-02").data)["data"]
+        assert [b["giorno"] for b in data] == ["2024-03-02"]
+
+        data = json.loads(client.get(f"/api/stazioni/domanda?idStazione={s + 1}").data)["data"]
+        assert data == []
+
+    def test_ricostruzione_a_blocchi(self, session, sample_user, sample_bike, sample_station):
+        from models import DomandaOraria
+        from rollups import build_rollups
+
+        u, b, s = sample_user.id, sample_bike.ID, sample_station.ID
+        for minuto in range(5):
+            _op(session, "noleggio", u, b, s, date(2024, 3, 1), (9, minuto))
+
+        assert build_rollups(session, chunk=2) == {"operazioni": 5, "bucket": 1}
+        session.commit()
+        assert session.query(DomandaOraria).one().conteggio == 5
+
+    def test_data_non_valida(self, client):
+        response = client.get("/api/stazioni/domanda?dal=ieri")
+        assert response.status_code == 400
+        assert json.loads(response.data)["status"] == "error"
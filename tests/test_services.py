@@ -28,8 +28,8 @@ class TestBikeRentalService:
         """Test get operazioni utente inesistente"""
         result = BikeRentalService.get_user_operations(999)
         
-        assert result["status"] == "success"
-        assert result["data"] == []  # Nessuna operazione trovata
+        assert result["status"] == "error"
+        assert result["code"] == 404
 
     def test_get_user_operations_multiple(self, session, sample_user, sample_bike, sample_station):
         """Test get operazioni multiple per stesso utente"""
@@ -87,8 +87,8 @@ class TestBikeRentalService:
         result = BikeRentalService.get_bike_status(sample_bike.ID)
         
         assert result["status"] == "success"
-        assert result["data"]["latitudine"] == "45.4642"
-        assert result["data"]["longitudine"] == "9.1900"
+        assert result["data"]["latitudine"] == 45.4642
+        assert result["data"]["longitudine"] == 9.19
         assert result["data"]["distanzaPercorsa"] == 15.5
 
 
@@ -0,0 +1,118 @@
+# test_spatial.py - Test per l'indice spaziale a griglia
+import random
+import time
+
+import pytest
+
+from geo import haversine
+from spatial import GridIndex, LazyIndex
+
+
+@pytest.fixture()
+def punti():
+    """Punti casuali attorno a Milano"""
+    rng = random.Random(42)
+    return {
+        i: (45.40 + rng.random() * 0.15, 9.10 + rng.random() * 0.20)
+        for i in range(1, 501)
+    }
+
+
+@pytest.fixture()
+def indice(punti):
+    index = GridIndex()
+    for item_id, (lat, lon) in punti.items():
+        index.insert(item_id, lat, lon)
+    return index
+
+
+class TestGridIndex:
+    """Test per GridIndex"""
+
+    def test_haversine(self):
+        """Test distanza nota Milano Duomo - Stazione Centrale (~2.3 km)"""
+        d = haversine(45.4642, 9.1900, 45.4862, 9.2045)
+        assert 2.5 < d < 2.8
+        assert haversine(45.0, 9.0, 45.0, 9.0) == 0.0
+
+    def test_nearest_come_forza_bruta(self, indice, punti):
+        """Test k-nearest coincide con la ricerca esaustiva"""
+        rng = random.Random(7)
+        for _ in range(50):
+            lat = 45.35 + rng.random() * 0.25
+            lon = 9.05 + rng.random() * 0.30
+            attesi = sorted(
+                (haversine(lat, lon, plat, plon), item_id)
+                for item_id, (plat, plon) in punti.items()
+            )[:5]
+            trovati = indice.nearest(lat, lon, k=5)
+            assert [item_id for _, item_id in trovati] == [item_id for _, item_id in attesi]
+
+    def test_within_come_forza_bruta(self, indice, punti):
+        """Test ricerca per raggio coincide con la ricerca esaustiva"""
+        lat, lon = 45.46, 9.19
+        attesi = {
+            item_id
+            for item_id, (plat, plon) in punti.items()
+            if haversine(lat, lon, plat, plon) <= 1.5
+        }
+        trovati = indice.within(lat, lon, 1.5)
+        assert {item_id for _, item_id in trovati} == attesi
+        assert [d for d, _ in trovati] == sorted(d for d, _ in trovati)
+
+    def test_nearest_con_raggio(self, indice):
+        """Test k-nearest limitato da un raggio"""
+        trovati = indice.nearest(45.46, 9.19, k=100, radius_km=0.5)
+        assert all(d <= 0.5 for d, _ in trovati)
+
+        lontano = indice.nearest(41.9, 12.5, k=3, radius_km=5)
+        assert lontano == []
+
+    def test_nearest_con_punto_isolato(self, indice, punti):
+        """Test k maggiore dei punti e un punto a (0, 0): nessuna scansione fino al bordo"""
+        indice.insert(0, 0.0, 0.0)
+        inizio = time.perf_counter()
+        trovati = indice.nearest(45.46, 9.19, k=len(punti) + 10)
+        durata = time.perf_counter() - inizio
+
+        assert len(trovati) == len(punti) + 1
+        assert trovati[-1][1] == 0
+        assert [d for d, _ in trovati] == sorted(d for d, _ in trovati)
+        # La scansione ad anelli fino a (0, 0) visiterebbe milioni di celle
+        assert durata < 1.0
+
+    def test_within_raggio_enorme(self, indice, punti):
+        """Test raggio più grande dell'area occupata: visita solo le celle occupate"""
+        indice.insert(0, 0.0, 0.0)
+        trovati = indice.within(45.46, 9.19, 6000)
+        assert {item_id for _, item_id in trovati} == set(punti) | {0}
+
+    def test_insert_remove(self):
+        """Test inserimento, spostamento e rimozione di un punto"""
+        index = GridIndex()
+        index.insert(1, 45.46, 9.19)
+        index.insert(1, 45.50, 9.25)
+        assert len(index) == 1
+        assert index.nearest(45.50, 9.25, k=1)[0][1] == 1
+
+        assert index.remove(1) is True
+        assert index.remove(1) is False
+        assert index.nearest(45.50, 9.25) == []
+
+    def test_lazy_index(self):
+        """Test costruzione pigra e reset"""
+        chiamate = []
+
+        def loader():
+            chiamate.append(1)
+            return [(1, 45.46, 9.19)]
+
+        lazy = LazyIndex(loader)
+        lazy.insert(2, 45.0, 9.0)  # ignorato: indice non ancora costruito
+        assert len(lazy.get()) == 1
+        lazy.get()
+        assert len(chiamate) == 1
+
+        lazy.reset()
+        lazy.get()
+        assert len(chiamate) == 2
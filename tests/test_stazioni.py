@@ -205,4 +205,114 @@ class TestStazioniAPI:
         assert isinstance(stazione['numSlot'], int)
         assert isinstance(stazione['numBiciclette'], int)
         assert isinstance(stazione['latitudine'], float)
-        assert isinstance(stazione['longitudine'], float) 
\ No newline at end of file
+        assert isinstance(stazione['longitudine'], float)
+
+    def test_stazioni_nearby(self, client):
+        """Test ricerca delle stazioni più vicine"""
+        coordinate = [
+            (45.4711419, 9.1992624),
+            (45.4634515, 9.1700282),
+            (45.481317, 9.1729375),
+            (45.4481546, 9.1958296),
+        ]
+        for i, (lat, lon) in enumerate(coordinate):
+            client.post("/api/stazioni", json={
+                "numSlot": 10,
+                "numBiciclette": 5,
+                "via": f"Via {i}",
+                "città": "Milano",
+                "provincia": "MI",
+                "regione": "Lombardia",
+                "latitudine": lat,
+                "longitudine": lon,
+            })
+
+        response = client.get("/api/stazioni/nearby?lat=45.4635&lon=9.1701&k=2")
+
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert data["status"] == "success"
+        assert len(data["data"]) == 2
+        assert data["data"][0]["via"] == "Via 1"
+        assert data["data"][0]["distanza"] < data["data"][1]["distanza"]
+
+        response = client.get("/api/stazioni/nearby?lat=45.4635&lon=9.1701&k=10&radius=0.5")
+        data = json.loads(response.data)
+        assert [s["via"] for s in data["data"]] == ["Via 1"]
+
+    def test_stazioni_nearby_sincronizzato(self, client, sample_station):
+        """Test indice aggiornato da create e delete"""
+        response = client.get("/api/stazioni/nearby?lat=45.4642&lon=9.19&k=5")
+        assert len(json.loads(response.data)["data"]) == 1
+
+        client.delete(f"/api/stazioni/{sample_station.ID}")
+        response = client.get("/api/stazioni/nearby?lat=45.4642&lon=9.19&k=5")
+        assert json.loads(response.data)["data"] == []
+
+    def test_stazioni_nearby_parametri_non_validi(self, client):
+        """Test parametri mancanti o fuori range"""
+        assert client.get("/api/stazioni/nearby?lat=45.4").status_code == 400
+        assert client.get("/api/stazioni/nearby?lat=95&lon=9").status_code == 400
+        assert client.get("/api/stazioni/nearby?lat=45&lon=9&k=0").status_code == 400
+        assert client.get("/api/stazioni/nearby?lat=abc&lon=9").status_code == 400
+        assert client.get("/api/stazioni/nearby?lat=45&lon=9&radius=20000").status_code == 400
+
+    def test_get_stazioni_etag_304_senza_query(self, client, sample_station):
+        """Test richiesta condizionale con ETag: 304 senza toccare il database"""
+        import sqlalchemy as sa
+        import models
+
+        response = client.get("/api/stazioni")
+        assert response.status_code == 200
+        etag = response.headers["ETag"]
+        assert response.headers["Last-Modified"]
+
+        query = []
+        engine = models.get_engine()
+        listener = lambda *args: query.append(args[2])
+        sa.event.listen(engine, "before_cursor_execute", listener)
+        try:
+            response = client.get("/api/stazioni", headers={"If-None-Match": etag})
+        finally:
+            sa.event.remove(engine, "before_cursor_execute", listener)
+
+        assert response.status_code == 304
+        assert response.data == b""
+        assert query == []
+
+    def test_get_stazioni_etag_cambia_con_le_modifiche(self, client, sample_station):
+        """Test create e delete invalidano la lista in cache"""
+        etag = client.get("/api/stazioni").headers["ETag"]
+
+        response = client.post("/api/stazioni", json={
+            "numSlot": 5, "numBiciclette": 1, "via": "Via Nuova",
+            "città": "Milano", "provincia": "MI", "regione": "Lombardia",
+        })
+        nuova_id = json.loads(response.data)["data"]["ID"]
+
+        response = client.get("/api/stazioni", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert len(json.loads(response.data)) == 2
+        etag_dopo_create = response.headers["ETag"]
+        assert etag_dopo_create != etag
+
+        client.delete(f"/api/stazioni/{nuova_id}")
+        response = client.get("/api/stazioni", headers={"If-None-Match": etag_dopo_create})
+        assert response.status_code == 200
+        # Stesso contenuto di prima della create: stesso ETag
+        assert response.headers["ETag"] == etag
+
+    def test_get_stazioni_invalidata_dai_noleggi(self, client, sample_station, sample_user, sample_bike):
+        """Test un noleggio cambia numBiciclette e quindi la lista"""
+        etag = client.get("/api/stazioni").headers["ETag"]
+
+        client.post("/api/operazioni", json={
+            "tipo": "noleggio",
+            "idUtente": sample_user.id,
+            "idBicicletta": sample_bike.ID,
+            "idStazione": sample_station.ID,
+        })
+
+        response = client.get("/api/stazioni", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert json.loads(response.data)[0]["numBiciclette"] == 4
@@ -0,0 +1,39 @@
+# test_tags.py - Test per l'allocazione dei codici delle biciclette
+from tags import LUNGHEZZA_TAG, TagAllocator, encode_tag
+
+
+class TestTagAllocator:
+    """Test per TagAllocator"""
+
+    def test_encode_tag_iniettivo(self):
+        codici = {encode_tag(v, 25214903917, 1013904223) for v in range(50000)}
+        assert len(codici) == 50000
+        assert all(len(c) == LUNGHEZZA_TAG for c in codici)
+
+    def test_processi_diversi_blocchi_diversi(self, session):
+        """Due allocatori sullo stesso contatore non restituiscono mai lo stesso codice"""
+        a = TagAllocator("test", 25214903917, 7, block_size=10)
+        b = TagAllocator("test", 25214903917, 7, block_size=10)
+
+        codici = []
+        for _ in range(5):
+            codici += a.allocate(7) + b.allocate(3)
+        codici += a.allocate(25)
+
+        assert len(codici) == len(set(codici)) == 75
+
+    def test_scarta_codici_esistenti(self, session):
+        primo = encode_tag(0, 25214903917, 7)
+        allocator = TagAllocator(
+            "test_esistenti", 25214903917, 7, esistenti=lambda codici: {primo}
+        )
+
+        codici = allocator.allocate(5)
+        assert len(codici) == 5
+        assert primo not in codici
+
+    def test_reset_non_riusa_i_valori(self, session):
+        allocator = TagAllocator("test_reset", 25214903917, 7, block_size=10)
+        primi = allocator.allocate(2)
+        allocator.reset()
+        assert not set(primi) & set(allocator.allocate(20))
@@ -0,0 +1,193 @@
+# test_telemetria.py - Test per l'acquisizione della telemetria GPS
+import pytest
+import json
+import numpy as np
+
+from geo import haversine, haversine_np
+from telemetry import compute_increments
+
+
+class TestComputeIncrements:
+    """Test per il calcolo vettoriale delle distanze"""
+
+    def test_haversine_np_come_scalare(self):
+        """Test versione vettoriale coincide con quella scalare"""
+        lat1 = np.array([45.46, 45.47, 41.90])
+        lon1 = np.array([9.19, 9.20, 12.49])
+        lat2 = np.array([45.48, 45.47, 45.46])
+        lon2 = np.array([9.21, 9.20, 9.19])
+
+        attese = [haversine(*p) for p in zip(lat1, lon1, lat2, lon2)]
+        assert np.allclose(haversine_np(lat1, lon1, lat2, lon2), attese)
+
+    def test_fix_ordinati_per_timestamp(self):
+        """Test fix fuori ordine riordinati per bicicletta e timestamp"""
+        bike = np.array([1, 2, 1, 1])
+        lat = np.array([45.4700, 45.5000, 45.4600, 45.4650])
+        lon = np.array([9.19, 9.20, 9.19, 9.19])
+        ts = np.array([300.0, 100.0, 100.0, 200.0])
+        previous = {1: (45.4600, 9.19), 2: (0.0, 0.0)}
+
+        ids, last_lat, last_lon, delta, applicati = compute_increments(
+            bike, lat, lon, ts, previous
+        )
+
+        assert ids.tolist() == [1, 2]
+        assert last_lat.tolist() == [45.4700, 45.5000]
+        assert applicati == 4
+        # Bici 1: 45.46 -> 45.46 -> 45.465 -> 45.47 (circa 1.11 km)
+        assert delta[0] == pytest.approx(haversine(45.46, 9.19, 45.47, 9.19), rel=1e-9)
+        # Bici 2 non era mai stata localizzata: nessuna distanza
+        assert delta[1] == 0.0
+
+    def test_fix_scartati(self):
+        """Test fix non validi, a (0,0) o di biciclette sconosciute"""
+        bike = np.array([1, 1, 1, 99])
+        lat = np.array([95.0, 0.0, 45.46, 45.46])
+        lon = np.array([9.19, 0.0, 9.19, 9.19])
+        ts = np.full(4, np.nan)
+
+        ids, _, _, delta, applicati = compute_increments(
+            bike, lat, lon, ts, {1: (45.46, 9.19)}
+        )
+
+        assert ids.tolist() == [1]
+        assert applicati == 1
+        assert delta.tolist() == [0.0]
+
+    def test_batch_come_update_position(self):
+        """Test il calcolo vettoriale coincide con update_position fix per fix"""
+        from models import Bicicletta
+
+        rng = np.random.default_rng(7)
+        lat = 45.46 + np.cumsum(rng.normal(0, 0.002, 200))
+        lon = 9.19 + np.cumsum(rng.normal(0, 0.002, 200))
+        lat[50:60], lon[50:60] = lat[49], lon[49]  # bici ferma: segmenti nulli
+        lat[100], lon[100] = 0.0, 0.0  # fix senza segnale: ignorato da entrambi
+
+        bici = Bicicletta()
+        bici.update_position(45.46, 9.19)
+        for la, lo in zip(lat, lon):
+            bici.update_position(la, lo)
+
+        _, _, _, delta, _ = compute_increments(
+            np.ones(200, dtype=np.int64), lat, lon, np.full(200, np.nan), {1: (45.46, 9.19)}
+        )
+        assert delta[0] == pytest.approx(bici.distanzaPercorsa, rel=1e-9)
+
+    def test_filtro_velocita(self):
+        """Test salti del GPS oltre la velocità massima non contati"""
+        bike = np.array([1, 1])
+        lat = np.array([45.46, 45.56])  # ~11 km in 10 secondi
+        lon = np.array([9.19, 9.19])
+        ts = np.array([0.0, 10.0])
+
+        _, _, _, delta, _ = compute_increments(bike, lat, lon, ts, {1: (45.46, 9.19)})
+
+        assert delta.tolist() == [0.0]
+
+
+class TestSimulazioneAPI:
+    """Test per le API di telemetria"""
+
+    def test_batch_telemetria(self, client, session):
+        """Test batch di fix su più biciclette"""
+        from models import Bicicletta
+
+        bici1 = Bicicletta()
+        bici1.update_position(45.46, 9.19)
+        bici2 = Bicicletta()
+        session.add_all([bici1, bici2])
+        session.commit()
+
+        fixes = [
+            {"idBicicletta": bici1.ID, "latitudine": 45.465, "longitudine": 9.19, "timestamp": "2024-05-23T10:00:00"},
+            {"idBicicletta": bici2.ID, "latitudine": 45.48, "longitudine": 9.17, "timestamp": 1716458400},
+            {"idBicicletta": bici1.ID, "latitudine": 45.47, "longitudine": 9.19, "timestamp": "2024-05-23T10:01:00"},
+            {"idBicicletta": 999, "latitudine": 45.47, "longitudine": 9.19},
+        ]
+        response = client.post("/api/simulazione", json={"fixes": fixes})
+
+        assert response.status_code == 200
+        data = json.loads(response.data)["data"]
+        assert data["ricevuti"] == 4
+        assert data["applicati"] == 3
+        assert data["biciclette"] == 2
+
+        status = json.loads(client.get(f"/api/biciclette/{bici1.ID}/status").data)["data"]
+        assert status["latitudine"] == 45.47
+        assert status["distanzaPercorsa"] == pytest.approx(haversine(45.46, 9.19, 45.47, 9.19))
+
+        status = json.loads(client.get(f"/api/biciclette/{bici2.ID}/status").data)["data"]
+        assert status["latitudine"] == 45.48
+        assert status["distanzaPercorsa"] == 0.0
+
+    def test_update_a_blocchi(self, session, monkeypatch):
+        """Test un UPDATE (non un executemany) ogni 1000 biciclette, come su MySQL"""
+        import sqlalchemy as sa
+        import telemetry
+        from sqlalchemy.engine import Engine
+        from models import Bicicletta
+        from telemetry import apply_fixes
+
+        biciclette = [Bicicletta() for _ in range(1500)]
+        for i, bici in enumerate(biciclette):
+            bici.update_position(45.40 + i * 1e-4, 9.19)
+        session.add_all(biciclette)
+        session.commit()
+
+        bike = np.array([b.ID for b in biciclette])
+        lat = np.array([45.41 + i * 1e-4 for i in range(1500)])
+        lon = np.full(1500, 9.19)
+        update = []
+
+        def conta(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith("UPDATE"):
+                update.append(executemany)
+
+        monkeypatch.setattr(telemetry, "_EXECUTEMANY_LOCALE", set())
+        sa.event.listen(Engine, "after_cursor_execute", conta)
+        try:
+            apply_fixes(session, bike, lat, lon, np.full(1500, np.nan))
+            session.commit()
+        finally:
+            sa.event.remove(Engine, "after_cursor_execute", conta)
+
+        assert update == [False, False]
+        session.expire_all()
+        ultima = session.get(Bicicletta, biciclette[-1].ID)
+        assert ultima.latitudine == pytest.approx(lat[-1])
+        assert ultima.distanzaPercorsa == pytest.approx(haversine(45.40 + 1499e-4, 9.19, lat[-1], 9.19))
+
+    def test_batch_ndjson(self, client, sample_bike):
+        """Test batch in formato NDJSON"""
+        righe = "\n".join(
+            json.dumps({"idBicicletta": sample_bike.ID, "latitudine": 45.46 + i * 0.001, "longitudine": 9.19})
+            for i in range(3)
+        )
+        response = client.post("/api/simulazione", data=righe, content_type="application/x-ndjson")
+
+        assert response.status_code == 200
+        assert json.loads(response.data)["data"]["applicati"] == 3
+
+    def test_simula_movimento_singola_bici(self, client, sample_bike):
+        """Test fix singolo sulla rotta /api/simulazione/<id>"""
+        response = client.post(
+            f"/api/simulazione/{sample_bike.ID}",
+            json={"latitudine": 45.4642, "longitudine": 9.19},
+        )
+
+        assert response.status_code == 200
+        status = json.loads(client.get(f"/api/biciclette/{sample_bike.ID}/status").data)["data"]
+        assert status["latitudine"] == 45.4642
+
+        response = client.post("/api/simulazione/999", json={"latitudine": 45.4642, "longitudine": 9.19})
+        assert response.status_code == 404
+
+    def test_batch_non_valido(self, client):
+        """Test batch malformati"""
+        response = client.post("/api/simulazione", json={"fixes": [{"latitudine": 45.0}]})
+        assert response.status_code == 400
+
+        response = client.post("/api/simulazione", data="{non json", content_type="application/x-ndjson")
+        assert response.status_code == 400
@@ -0,0 +1,118 @@
+# test_trips.py - Test per la ricostruzione dei viaggi
+import json
+from datetime import date, time
+
+import numpy as np
+import pytest
+
+from trips import NOLEGGIO as N, RICONSEGNA as R, pair_events
+
+
+def _op(session, tipo, utente, bici, stazione, ora, distanza=0):
+    from models import Operazione
+
+    op = Operazione(tipo, utente, bici, stazione, distanzaPercorsa=distanza)
+    op.data = date(2024, 3, 1)
+    op.ora = time(*ora)
+    session.add(op)
+    session.commit()
+    return op.ID
+
+
+class TestPairEvents:
+    """Test per l'accoppiamento vettoriale noleggio -> riconsegna"""
+
+    def test_sequenze_con_anomalie(self):
+        # bici 1: N N R (primo noleggio orfano), bici 2: R N R N (riconsegna
+        # orfana, un viaggio, noleggio aperto); eventi in ordine sparso
+        bike = np.array([2, 1, 2, 1, 2, 1, 2])
+        tipo = np.array([N, N, R, R, N, N, R])
+        ts = np.array([20, 10, 10, 30, 40, 20, 30])
+        op_id = np.arange(len(bike))
+
+        noleggi, riconsegne, orfani, riconsegne_orfane, aperti = pair_events(bike, tipo, ts, op_id)
+
+        assert sorted(zip(noleggi.tolist(), riconsegne.tolist())) == [(0, 6), (5, 3)]
+        assert orfani.tolist() == [1]
+        assert riconsegne_orfane.tolist() == [2]
+        assert aperti.tolist() == [4]
+
+    def test_stesso_istante_ordinato_per_id(self):
+        bike = np.array([1, 1])
+        tipo = np.array([R, N])
+        noleggi, riconsegne, _, _, _ = pair_events(bike, tipo, np.array([5, 5]), np.array([2, 1]))
+        assert noleggi.tolist() == [1] and riconsegne.tolist() == [0]
+
+
+class TestBuildTrips:
+    """Test per POST /api/viaggi/ricostruisci e GET /api/viaggi"""
+
+    def test_ricostruzione_incrementale(self, client, session, sample_user, sample_bike, sample_station):
+        u, b, s = sample_user.id, sample_bike.ID, sample_station.ID
+        noleggio = _op(session, "noleggio", u, b, s, (8, 0))
+        riconsegna = _op(session, "riconsegna", u, b, s, (8, 25, 30), distanza=3)
+        aperto = _op(session, "noleggio", u, b, s, (9, 0))
+
+        data = json.loads(client.post("/api/viaggi/ricostruisci").data)["data"]
+        assert data == {
+            "operazioni": 3, "completi": 1, "inCorso": 1, "noleggiOrfani": 0, "riconsegneOrfane": 0,
+        }
+
+        viaggi = json.loads(client.get("/api/viaggi").data)["data"]
+        assert [v["stato"] for v in viaggi] == ["in_corso", "completo"]
+        completo = viaggi[1]
+        assert completo["idNoleggio"] == noleggio and completo["idRiconsegna"] == riconsegna
+        assert completo["durata"] == 25 * 60 + 30
+        assert completo["inizio"] == "2024-03-01T08:00:00"
+        assert completo["distanzaPercorsa"] == 3
+
+        # Nessuna operazione nuova: niente da fare
+        data = json.loads(client.post("/api/viaggi/ricostruisci").data)["data"]
+        assert data["operazioni"] == 0
+
+        # La riconsegna chiude il viaggio in corso, senza duplicarlo
+        chiusura = _op(session, "riconsegna", u, b, s, (9, 10))
+        client.post("/api/viaggi/ricostruisci")
+        viaggi = json.loads(client.get("/api/viaggi?stato=completo").data)["data"]
+        assert len(viaggi) == 2
+        assert viaggi[0]["idNoleggio"] == aperto and viaggi[0]["idRiconsegna"] == chiusura
+        assert json.loads(client.get("/api/viaggi?stato=in_corso").data)["data"] == []
+
+    def test_eventi_orfani(self, client, session, sample_user, sample_bike, sample_station):
+        u, b, s = sample_user.id, sample_bike.ID, sample_station.ID
+        _op(session, "riconsegna", u, b, s, (7, 0))
+        client.post("/api/viaggi/ricostruisci")
+        doppio = _op(session, "noleggio", u, b, s, (8, 0))
+        _op(session, "noleggio", u, b, s, (8, 5))
+        _op(session, "riconsegna", u, b, s, (8, 30))
+        client.post("/api/viaggi/ricostruisci")
+
+        orfani = json.loads(client.get("/api/viaggi?stato=noleggio_orfano").data)["data"]
+        assert [v["idNoleggio"] for v in orfani] == [doppio]
+        assert len(json.loads(client.get("/api/viaggi?stato=riconsegna_orfana").data)["data"]) == 1
+
+    def test_ricostruzione_completa_uguale_a_incrementale(self, client, session, sample_user, sample_bike, sample_station):
+        u, b, s = sample_user.id, sample_bike.ID, sample_station.ID
+        for ora in range(6, 12):
+            _op(session, "noleggio", u, b, s, (ora, 0))
+            client.post("/api/viaggi/ricostruisci")
+            _op(session, "riconsegna", u, b, s, (ora, 30))
+        client.post("/api/viaggi/ricostruisci")
+        incrementale = json.loads(client.get("/api/viaggi").data)["data"]
+
+        client.post("/api/viaggi/ricostruisci", json={"completo": True})
+        completa = json.loads(client.get("/api/viaggi").data)["data"]
+
+        chiave = lambda v: (v["idNoleggio"], v["idRiconsegna"], v["stato"], v["durata"])
+        assert sorted(map(chiave, completa)) == sorted(map(chiave, incrementale))
+        assert len(completa) == 6
+
+    def test_parametri_non_validi(self, client):
+        assert client.get("/api/viaggi?stato=rubato").status_code == 400
+        assert client.get("/api/viaggi?limit=0").status_code == 400
+
+    def test_comando_cli(self, test_app, session, sample_user, sample_bike, sample_station):
+        _op(session, "noleggio", sample_user.id, sample_bike.ID, sample_station.ID, (8, 0))
+        risultato = test_app.test_cli_runner().invoke(args=["build-trips"])
+        assert risultato.exit_code == 0, risultato.output
+        assert json.loads(risultato.output)["inCorso"] == 1
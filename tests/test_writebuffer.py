@@ -0,0 +1,127 @@
+# test_writebuffer.py - Test per il commit di gruppo delle scritture
+import threading
+
+import pytest
+import sqlalchemy as sa
+
+from models import Stazione
+from writebuffer import WriteBuffer
+
+
+@pytest.fixture()
+def stazione(file_db):
+    """Una stazione i cui slot fanno da contatore per i lavori"""
+    with file_db() as session:
+        stazione = Stazione(
+            numSlot=1000, numBiciclette=0, via="Via Hub", città="Milano",
+            provincia="MI", regione="Lombardia",
+        )
+        session.add(stazione)
+        session.commit()
+        return stazione.ID
+
+
+def _aggiorna(session, station_id):
+    session.execute(
+        sa.update(Stazione)
+        .where(Stazione.ID == station_id)
+        .values(numBiciclette=Stazione.numBiciclette + 1)
+    )
+
+
+def _incrementa(session, tx, station_id):
+    _aggiorna(session, station_id)
+    tx.commit()
+    return threading.current_thread().name
+
+
+def _fallisce(session, tx, station_id):
+    _aggiorna(session, station_id)
+    raise ValueError("lavoro non valido")
+
+
+def _errore_sql(session, tx, station_id):
+    session.execute(sa.text("SELECT * FROM tabella_inesistente"))
+
+
+def _biciclette(Session, station_id):
+    with Session() as session:
+        return session.get(Stazione, station_id).numBiciclette
+
+
+def _in_parallelo(buffer, lavori):
+    """Esegue buffer.run(*lavoro) per ogni lavoro, tutti insieme"""
+    barriera = threading.Barrier(len(lavori))
+    esiti = [None] * len(lavori)
+
+    def chiama(i):
+        barriera.wait()
+        try:
+            esiti[i] = buffer.run(*lavori[i])
+        except Exception as e:
+            esiti[i] = e
+
+    threads = [threading.Thread(target=chiama, args=(i,)) for i in range(len(lavori))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return esiti
+
+
+class TestWriteBuffer:
+    """Test per il commit di gruppo e il ritorno alla modalità sincrona"""
+
+    def test_sincrono(self, file_db, stazione):
+        """Disattivato, il lavoro gira nel thread chiamante con il suo COMMIT"""
+        buffer = WriteBuffer(enabled=False)
+
+        assert buffer.run(_incrementa, stazione) == threading.current_thread().name
+        assert buffer.commits == 0
+        assert _biciclette(file_db, stazione) == 1
+
+    def test_un_commit_per_gruppo(self, file_db, stazione):
+        """Lavori concorrenti confermati insieme, ognuno con il suo risultato"""
+        buffer = WriteBuffer(enabled=True, max_batch=100, max_delay_ms=200)
+
+        esiti = _in_parallelo(buffer, [(_incrementa, stazione)] * 20)
+
+        assert esiti == ["write-buffer"] * 20
+        assert buffer.jobs == 20
+        assert buffer.commits < 20
+        assert _biciclette(file_db, stazione) == 20
+
+    def test_dimensione_massima(self, file_db, stazione):
+        """Un gruppo non supera max_batch lavori"""
+        buffer = WriteBuffer(enabled=True, max_batch=4, max_delay_ms=200)
+
+        _in_parallelo(buffer, [(_incrementa, stazione)] * 12)
+
+        assert buffer.commits >= 3
+        assert _biciclette(file_db, stazione) == 12
+
+    def test_errore_isolato_nel_savepoint(self, file_db, stazione):
+        """Un lavoro che fallisce annulla solo le sue scritture"""
+        buffer = WriteBuffer(enabled=True, max_delay_ms=200)
+
+        esiti = _in_parallelo(buffer, [(_incrementa, stazione)] * 5 + [(_fallisce, stazione)])
+
+        assert isinstance(esiti[-1], ValueError)
+        assert esiti[:-1] == ["write-buffer"] * 5
+        assert _biciclette(file_db, stazione) == 5
+
+    def test_errore_del_database(self, file_db, stazione):
+        """Con la transazione del gruppo persa ogni lavoro è rieseguito da solo"""
+        buffer = WriteBuffer(enabled=True, max_delay_ms=200)
+
+        esiti = _in_parallelo(buffer, [(_incrementa, stazione)] * 5 + [(_errore_sql, stazione)])
+
+        assert isinstance(esiti[-1], sa.exc.OperationalError)
+        assert esiti[:-1] == ["write-buffer"] * 5
+        assert _biciclette(file_db, stazione) == 5
+
+    def test_configurazione_non_valida(self):
+        with pytest.raises(ValueError):
+            WriteBuffer(max_batch=0)
+        with pytest.raises(ValueError):
+            WriteBuffer(max_delay_ms=-1)
@@ -0,0 +1,240 @@
+from datetime import datetime
+
+import numpy as np
+import sqlalchemy as sa
+
+from models import Operazione, Sequenza, Viaggio
+
+NOLEGGIO = 0
+RICONSEGNA = 1
+
+# Contatore in sequenze con l'ultima operazione elaborata; la sua riga fa
+# anche da lock, così due ricostruzioni non si sovrappongono
+SEQUENZA_VIAGGI = "viaggi"
+
+# Le operazioni con ID fino a tanto sotto l'ultima elaborata vengono
+# ricontrollate: una transazione può confermare un ID più basso dopo una
+# con ID più alto
+FINESTRA_RITARDO = 1000
+
+
+def pair_events(bike, tipo, ts, op_id):
+    """Accoppia noleggi e riconsegne di ogni bicicletta in un'unica passata.
+
+    Gli eventi sono ordinati per (bicicletta, istante, ID); un noleggio
+    forma un viaggio con l'evento successivo se è una riconsegna della
+    stessa bicicletta. Restituisce gli indici (negli array originali) di:
+    noleggi accoppiati, riconsegne corrispondenti, noleggi orfani (seguiti
+    da un altro noleggio), riconsegne orfane e noleggi ancora aperti
+    (ultimo evento della bicicletta).
+    """
+    n = len(bike)
+    order = np.lexsort((op_id, ts, bike))
+    b = bike[order]
+    t = tipo[order]
+
+    stessa_bici = b[1:] == b[:-1]
+    coppia = np.zeros(n, dtype=bool)
+    coppia[:-1] = stessa_bici & (t[:-1] == NOLEGGIO) & (t[1:] == RICONSEGNA)
+    riconsegna_accoppiata = np.zeros(n, dtype=bool)
+    riconsegna_accoppiata[1:] = coppia[:-1]
+    ultimo = np.ones(n, dtype=bool)
+    ultimo[:-1] = ~stessa_bici
+
+    noleggi = t == NOLEGGIO
+    libero = noleggi & ~coppia
+    (idx_coppie,) = np.nonzero(coppia)
+    return (
+        order[idx_coppie],
+        order[idx_coppie + 1],
+        order[libero & ~ultimo],
+        order[(t == RICONSEGNA) & ~riconsegna_accoppiata],
+        order[libero & ultimo],
+    )
+
+
+_COLONNE_EVENTO = (
+    Operazione.ID,
+    Operazione.tipo,
+    Operazione.data,
+    Operazione.ora,
+    Operazione.idUtente,
+    Operazione.idBicicletta,
+    Operazione.idStazione,
+    Operazione.distanzaPercorsa,
+)
+
+
+def _events(rows, viaggi=None):
+    """Array degli eventi; ``viaggi`` indica il viaggio in corso di ogni riga, se esiste"""
+    rows = list(rows)
+    n = len(rows)
+    return {
+        "id": np.fromiter((r.ID for r in rows), dtype=np.int64, count=n),
+        "tipo": np.fromiter(
+            (NOLEGGIO if r.tipo == "noleggio" else RICONSEGNA for r in rows), dtype=np.int8, count=n
+        ),
+        "ts": np.array([datetime.combine(r.data, r.ora) for r in rows], dtype="datetime64[s]"),
+        "bike": np.fromiter((r.idBicicletta for r in rows), dtype=np.int64, count=n),
+        "utente": [r.idUtente for r in rows],
+        "stazione": [r.idStazione for r in rows],
+        "distanza": [r.distanzaPercorsa for r in rows],
+        "viaggio": viaggi if viaggi is not None else [None] * n,
+    }
+
+
+def _merge(a, b):
+    return {
+        key: np.concatenate([a[key], b[key]]) if isinstance(a[key], np.ndarray) else a[key] + b[key]
+        for key in a
+    }
+
+
+def _lock_watermark(session):
+    """Blocca e legge la riga del contatore (creandola se manca)"""
+    valore = session.scalar(
+        sa.select(Sequenza.valore).where(Sequenza.nome == SEQUENZA_VIAGGI).with_for_update()
+    )
+    if valore is None:
+        session.add(Sequenza(nome=SEQUENZA_VIAGGI, valore=0))
+        session.flush()
+        valore = 0
+    return valore
+
+
+def build_trips(session, completo=False):
+    """Ricostruisce i viaggi dalle operazioni non ancora elaborate.
+
+    Con ``completo`` cancella i viaggi e rielabora l'intera tabella (i
+    viaggi delle operazioni già archiviate restano com'erano). In
+    modo incrementale legge solo le operazioni successive all'ultima
+    elaborata (più una finestra per quelle confermate in ritardo) e i
+    viaggi ancora in corso delle biciclette coinvolte. Non esegue il
+    commit: è compito del chiamante.
+    """
+    ultima = _lock_watermark(session)
+    inizio = max(0, ultima - FINESTRA_RITARDO)
+    if completo:
+        from archive import archivio
+
+        # Ogni viaggio ha almeno uno dei due eventi
+        ultima = inizio = archivio.archived_until()
+        session.execute(
+            sa.delete(Viaggio).where(
+                sa.func.coalesce(Viaggio.idNoleggio, Viaggio.idRiconsegna) > ultima
+            )
+        )
+
+    elaborate = set()
+    if inizio < ultima or (completo and ultima):
+        for colonna in (Viaggio.idNoleggio, Viaggio.idRiconsegna):
+            elaborate.update(session.scalars(sa.select(colonna).where(colonna > inizio)))
+
+    nuovi = [
+        row
+        for row in session.execute(
+            sa.select(*_COLONNE_EVENTO).where(Operazione.ID > inizio).order_by(Operazione.ID)
+        )
+        if row.ID not in elaborate
+    ]
+    if not nuovi:
+        return {"operazioni": 0, "completi": 0, "inCorso": 0, "noleggiOrfani": 0, "riconsegneOrfane": 0}
+
+    eventi = _events(nuovi)
+
+    # I noleggi rimasti aperti nelle esecuzioni precedenti
+    biciclette = np.unique(eventi["bike"]).tolist()
+    aperti = session.execute(
+        sa.select(Viaggio.ID.label("viaggio"), *_COLONNE_EVENTO)
+        .join(Operazione, Operazione.ID == Viaggio.idNoleggio)
+        .where(Viaggio.stato == "in_corso", Viaggio.idBicicletta.in_(biciclette))
+    ).all()
+    if aperti:
+        eventi = _merge(eventi, _events(aperti, [row.viaggio for row in aperti]))
+
+    noleggi, riconsegne, orfani, riconsegne_orfane, in_corso = pair_events(
+        eventi["bike"], eventi["tipo"], eventi["ts"], eventi["id"]
+    )
+
+    def viaggio(stato, noleggio=None, riconsegna=None):
+        evento = noleggio if noleggio is not None else riconsegna
+        row = {
+            "stato": stato,
+            "idBicicletta": int(eventi["bike"][evento]),
+            "idUtente": eventi["utente"][evento],
+            "idStazionePartenza": None,
+            "idStazioneArrivo": None,
+            "idNoleggio": None,
+            "idRiconsegna": None,
+            "inizio": None,
+            "fine": None,
+            "durata": None,
+            "distanzaPercorsa": 0,
+        }
+        if noleggio is not None:
+            row.update(
+                idStazionePartenza=eventi["stazione"][noleggio],
+                idNoleggio=int(eventi["id"][noleggio]),
+                inizio=eventi["ts"][noleggio].item(),
+            )
+        if riconsegna is not None:
+            row.update(
+                idStazioneArrivo=eventi["stazione"][riconsegna],
+                idRiconsegna=int(eventi["id"][riconsegna]),
+                fine=eventi["ts"][riconsegna].item(),
+                distanzaPercorsa=eventi["distanza"][riconsegna] or 0,
+            )
+        if noleggio is not None and riconsegna is not None:
+            durata = eventi["ts"][riconsegna] - eventi["ts"][noleggio]
+            row["durata"] = int(durata / np.timedelta64(1, "s"))
+        return row
+
+    inserimenti = []
+    aggiornamenti = []
+
+    def salva(row, noleggio):
+        # I viaggi in corso già salvati vengono aggiornati, gli altri inseriti
+        esistente = eventi["viaggio"][noleggio]
+        if esistente is not None:
+            aggiornamenti.append({"v_id": esistente, **{f"v_{k}": v for k, v in row.items()}})
+        else:
+            inserimenti.append(row)
+
+    for i, j in zip(noleggi.tolist(), riconsegne.tolist()):
+        salva(viaggio("completo", noleggio=i, riconsegna=j), i)
+    for i in orfani.tolist():
+        salva(viaggio("noleggio_orfano", noleggio=i), i)
+    for i in in_corso.tolist():
+        if eventi["viaggio"][i] is None:
+            inserimenti.append(viaggio("in_corso", noleggio=i))
+    for j in riconsegne_orfane.tolist():
+        inserimenti.append(viaggio("riconsegna_orfana", riconsegna=j))
+
+    connection = session.connection()
+    tabella = Viaggio.__table__
+    if aggiornamenti:
+        connection.execute(
+            sa.update(tabella)
+            .where(tabella.c.ID == sa.bindparam("v_id"))
+            .values({
+                colonna: sa.bindparam(f"v_{colonna}")
+                for colonna in ("stato", "idStazioneArrivo", "idRiconsegna", "fine", "durata", "distanzaPercorsa")
+            }),
+            aggiornamenti,
+        )
+    if inserimenti:
+        connection.execute(sa.insert(tabella), inserimenti)
+
+    session.execute(
+        sa.update(Sequenza)
+        .where(Sequenza.nome == SEQUENZA_VIAGGI)
+        .values(valore=max(ultima, int(eventi["id"].max())))
+    )
+
+    return {
+        "operazioni": len(nuovi),
+        "completi": len(noleggi),
+        "inCorso": len(in_corso),
+        "noleggiOrfani": len(orfani),
+        "riconsegneOrfane": len(riconsegne_orfane),
+    }
@@ -0,0 +1,184 @@
+"""Commit di gruppo per le scritture più frequenti (noleggi, riconsegne, telemetria).
+
+Senza buffer ogni scrittura apre la sua transazione e la chiude con un
+COMMIT, cioè un fsync del log di InnoDB per richiesta. Con il buffer
+attivo (``WRITE_BUFFER=1``) i thread delle richieste accodano il lavoro a
+un unico thread di scrittura, che esegue le richieste arrivate negli
+ultimi ``WRITE_BUFFER_DELAY_MS`` millisecondi (al massimo
+``WRITE_BUFFER_SIZE``) in una sola transazione, ciascuna nel suo
+SAVEPOINT, e le conferma con un solo COMMIT. Ogni chiamante riceve il
+proprio risultato solo dopo quel COMMIT: la risposta arriva quando i dati
+sono durevoli.
+
+Un lavoro è una funzione ``lavoro(session, tx, *args)`` che esegue le sue
+query su ``session`` e chiude ``tx`` con ``tx.commit()`` o
+``tx.rollback()``. Senza buffer ``tx`` è la sessione stessa, con il buffer
+è il SAVEPOINT del lavoro: la stessa funzione serve entrambe le modalità.
+Se nel gruppo una query fallisce con un errore del database che può aver
+perso la transazione (deadlock, connessione caduta), il gruppo è annullato
+e ogni lavoro rieseguito da solo, così l'errore raggiunge solo il suo
+chiamante.
+
+Il buffer serve i worker a thread (Flask). Con una sessione legata da
+bind_session (modalità ASGI) le scritture restano sincrone.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from sqlalchemy.exc import DBAPIError
+
+from models import Session, session_is_bound, session_scope
+
+DEFAULT_BATCH = 100
+DEFAULT_DELAY_MS = 5.0
+
+
+def settings_from_env(environ=os.environ):
+    """Opzioni del buffer lette dalle variabili d'ambiente"""
+    return {
+        "enabled": environ.get("WRITE_BUFFER", "0").lower() in ("1", "true", "yes"),
+        "max_batch": int(environ.get("WRITE_BUFFER_SIZE", DEFAULT_BATCH)),
+        "max_delay_ms": float(environ.get("WRITE_BUFFER_DELAY_MS", DEFAULT_DELAY_MS)),
+    }
+
+
+class _Lavoro:
+    __slots__ = ("funzione", "args", "future")
+
+    def __init__(self, funzione, args):
+        self.funzione = funzione
+        self.args = args
+        self.future = Future()
+
+
+class WriteBuffer:
+    """Coda dei lavori di scrittura confermati con un COMMIT per gruppo"""
+
+    def __init__(self, enabled=False, max_batch=DEFAULT_BATCH, max_delay_ms=DEFAULT_DELAY_MS):
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = None
+        self.commits = 0
+        self.jobs = 0
+        self.configure(enabled, max_batch, max_delay_ms)
+
+    def configure(self, enabled=None, max_batch=None, max_delay_ms=None):
+        """Cambia modalità e limiti; i valori non indicati restano invariati"""
+        if max_batch is not None and max_batch < 1:
+            raise ValueError("WRITE_BUFFER_SIZE deve essere almeno 1")
+        if max_delay_ms is not None and max_delay_ms < 0:
+            raise ValueError("WRITE_BUFFER_DELAY_MS non può essere negativo")
+        if enabled is not None:
+            self.enabled = enabled
+        if max_batch is not None:
+            self.max_batch = max_batch
+        if max_delay_ms is not None:
+            self.max_delay = max_delay_ms / 1000
+
+    def run(self, funzione, *args):
+        """Esegue il lavoro e ne restituisce il risultato dopo il COMMIT"""
+        if not self.enabled or session_is_bound():
+            with session_scope() as session:
+                return funzione(session, session, *args)
+
+        lavoro = _Lavoro(funzione, args)
+        self._start()
+        self._queue.put(lavoro)
+        return lavoro.future.result()
+
+    def _start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._loop, name="write-buffer", daemon=True
+                )
+                self._thread.start()
+
+    def _raccogli(self):
+        """Il primo lavoro in attesa e quelli che arrivano entro max_delay"""
+        gruppo = [self._queue.get()]
+        scadenza = time.monotonic() + self.max_delay
+        while len(gruppo) < self.max_batch:
+            attesa = scadenza - time.monotonic()
+            try:
+                gruppo.append(self._queue.get(timeout=attesa) if attesa > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return gruppo
+
+    def _loop(self):
+        while True:
+            gruppo = self._raccogli()
+            try:
+                self._flush(gruppo)
+            except BaseException as e:  # pragma: no cover - i chiamanti non devono restare appesi
+                for lavoro in gruppo:
+                    if not lavoro.future.done():
+                        lavoro.future.set_exception(e)
+
+    def _flush(self, gruppo):
+        try:
+            esiti = []
+            with Session() as session:
+                if session.get_bind().dialect.name == "sqlite":
+                    # pysqlite non apre la transazione prima di un SAVEPOINT:
+                    # il RELEASE del primo confermerebbe subito le scritture
+                    session.connection().exec_driver_sql("BEGIN")
+                for lavoro in gruppo:
+                    esiti.append(self._esegui_nel_savepoint(session, lavoro))
+                session.commit()
+        except DBAPIError:
+            # Transazione del gruppo persa: ogni lavoro nella sua transazione
+            for lavoro in gruppo:
+                self._esegui_da_solo(lavoro)
+            return
+
+        self.commits += 1
+        self.jobs += len(gruppo)
+        for lavoro, (riuscito, valore) in zip(gruppo, esiti):
+            if riuscito:
+                lavoro.future.set_result(valore)
+            else:
+                lavoro.future.set_exception(valore)
+
+    @staticmethod
+    def _esegui_nel_savepoint(session, lavoro):
+        tx = session.begin_nested()
+        try:
+            valore = lavoro.funzione(session, tx, *lavoro.args)
+        except DBAPIError:
+            raise
+        except Exception as e:
+            if tx.is_active:
+                tx.rollback()
+            return False, e
+        if tx.is_active:
+            tx.commit()
+        return True, valore
+
+    def _esegui_da_solo(self, lavoro):
+        try:
+            with Session() as session:
+                valore = lavoro.funzione(session, session, *lavoro.args)
+        except Exception as e:
+            lavoro.future.set_exception(e)
+            return
+        self.commits += 1
+        self.jobs += 1
+        lavoro.future.set_result(valore)
+
+    def reset(self):
+        """Dimentica il thread di scrittura (dopo un fork il thread non esiste)"""
+        self._thread = None
+        self._queue = queue.Queue()
+
+
+write_buffer = WriteBuffer(**settings_from_env())
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=write_buffer.reset)